@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from pdf2word import profile_info
+from pdf2word_admission import DEFAULT_MAX_WAITING, DEFAULT_RETRY_AFTER
+from pdf2word_cache import get_default_cache, get_default_page_cache
+from pdf2word_core import ConversionError, ConversionService, office_headers, report_headers
+from pdf2word_metrics import PROMETHEUS_CONTENT_TYPE, TIMING_HEADERS, RequestMetrics, registry
+from pdf2word_office import get_default_office_pool
+from pdf2word_scratch import Workspace
+from pdf2word_streams import iter_base64_json
+
+# ASGI build of the conversion service: uvicorn app:app
+#
+# Uploads and downloads are handled on the event loop, so slow clients only cost
+# a coroutine; conversions run in a process pool sized to the CPUs. Requests beyond
+# the pool plus PDF2WORD_MAX_WAITING are turned away with a 503. Office formats
+# (/convert with format=pdf or rtf) go to warm LibreOffice instances driven from
+# threads of this process, which has the office pool; the conversion processes do not.
+
+CONVERSION_WORKERS = int(os.environ.get('PDF2WORD_WORKERS', str(os.cpu_count() or 1)))
+MAX_PENDING = CONVERSION_WORKERS + DEFAULT_MAX_WAITING
+# Seconds between checks for a disconnected client while a conversion runs
+DISCONNECT_POLL_INTERVAL = 0.5
+
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+logging.basicConfig(level=logging.INFO)
+service = ConversionService(cache=get_default_cache(), page_cache=get_default_page_cache(),
+                            office=get_default_office_pool())
+
+_worker_service = None
+
+def _init_worker():
+    global _worker_service
+    _worker_service = ConversionService(cache=get_default_cache(), page_cache=get_default_page_cache())
+
+def _convert(directory, options):
+    # The event loop marks the workspace cancelled when the client goes away
+    workspace = Workspace(directory)
+    return _worker_service.convert(workspace, options, cancelled=workspace.cancelled)
+
+class ConversionPool:
+    def __init__(self, workers=CONVERSION_WORKERS, max_pending=MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = None
+
+    def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def has_room(self):
+        return self.pending < self.max_pending
+
+    async def convert(self, workspace, options):
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, _convert, workspace.directory, options)
+        except BrokenProcessPool:
+            # A conversion process died (e.g. OOM-killed); replace the pool for later requests
+            self.shutdown()
+            self.start()
+            raise ConversionError("Conversion failed: Conversion process terminated unexpectedly", 500)
+        finally:
+            self.pending -= 1
+
+pool = ConversionPool()
+
+def _overloaded():
+    return JSONResponse({"error": "Server busy: conversion queue is full"}, status_code=503,
+                        headers={"Retry-After": str(DEFAULT_RETRY_AFTER)})
+
+def _error(e):
+    return JSONResponse(e.body(), status_code=e.status, headers=e.headers)
+
+def _finish(request_metrics, response, workspace=None):
+    # Runs once the response body has been sent
+    def cleanup():
+        if workspace is not None:
+            service.workspaces.release(workspace)
+        request_metrics.finish(response.status_code)
+
+    if TIMING_HEADERS:
+        response.headers['Server-Timing'] = request_metrics.server_timing()
+    response.background = BackgroundTask(cleanup)
+    return response
+
+async def health(request):
+    return JSONResponse(dict(service.health(), conversions={
+        "pending": pool.pending, "workers": pool.workers, "maxPending": pool.max_pending
+    }))
+
+async def metrics(request):
+    return Response(registry.render(), headers={'Content-Type': PROMETHEUS_CONTENT_TYPE})
+
+async def _run_conversion(request, workspace, options, request_metrics):
+    with request_metrics.stage('convert'):
+        conversion = asyncio.ensure_future(pool.convert(workspace, options))
+        cancelled = False
+        while not conversion.done():
+            await asyncio.wait({conversion}, timeout=DISCONNECT_POLL_INTERVAL)
+            if not conversion.done() and not cancelled and await request.is_disconnected():
+                # The conversion process sees this at its next check and stops
+                workspace.cancel()
+                cancelled = True
+        try:
+            report = conversion.result()
+        except ConversionError as e:
+            # Count a stopped job under its limit rather than the convert stage
+            request_metrics.failed_stage = e.details.get("limit")
+            raise
+    request_metrics.record_conversion(report)
+    request_metrics.bytes_out = report["outputSize"]
+    return report
+
+async def inspect(request):
+    # Structure-only, so it runs in a thread rather than taking a conversion process
+    request_metrics = RequestMetrics('inspect')
+    workspace = service.workspaces.acquire()
+    try:
+        with request_metrics.stage('upload'):
+            async with request.form(max_files=1) as form:
+                file = form.get('file')
+                if file is None or isinstance(file, str):
+                    return _finish(request_metrics, JSONResponse({"error": "No file provided"}, status_code=400),
+                                   workspace)
+                options = service.options.for_request(form.get('start', request.query_params.get('start')),
+                                                      form.get('end', request.query_params.get('end')),
+                                                      form.get('pages', request.query_params.get('pages')))
+                await run_in_threadpool(service.receive_file, file.file, workspace, request_metrics)
+
+        info = await run_in_threadpool(service.inspect, workspace, options, request_metrics)
+        return _finish(request_metrics, JSONResponse(info), workspace)
+
+    except ConversionError as e:
+        return _finish(request_metrics, _error(e), workspace)
+
+    except Exception as e:
+        logging.error(f'Inspect request processing failed: {str(e)}')
+        return _finish(request_metrics,
+                       JSONResponse({"error": f"Request processing failed: {str(e)}"}, status_code=500), workspace)
+
+async def convert(request):
+    request_metrics = RequestMetrics('convert')
+    workspace = None
+    try:
+        if not pool.has_room():
+            return _finish(request_metrics, _overloaded())
+
+        workspace = service.workspaces.acquire()
+        # Multipart parsing reads the socket on the event loop
+        with request_metrics.stage('upload'):
+            async with request.form(max_files=1) as form:
+                file = form.get('file')
+                if file is None or isinstance(file, str):
+                    return _finish(request_metrics, JSONResponse({"error": "No file provided"}, status_code=400),
+                                   workspace)
+                if file.filename == '':
+                    return _finish(request_metrics, JSONResponse({"error": "No file selected"}, status_code=400),
+                                   workspace)
+
+                filename = file.filename or "document.pdf"
+                target = (form.get('format', request.query_params.get('format')) or 'docx').lower()
+                options = service.options.for_request(form.get('start', request.query_params.get('start')),
+                                                      form.get('end', request.query_params.get('end')),
+                                                      form.get('pages', request.query_params.get('pages')),
+                                                      form.get('profile', request.query_params.get('profile')))
+                await run_in_threadpool(service.receive_file, file.file, workspace, request_metrics)
+
+        if target != 'docx':
+            report = await run_in_threadpool(service.convert_office, workspace, target, request_metrics)
+            response = FileResponse(report["outputPath"], media_type=report["mediaType"],
+                                    filename=f'{os.path.splitext(filename)[0]}.{target}',
+                                    headers=office_headers(report))
+            return _finish(request_metrics, response, workspace)
+
+        report = await _run_conversion(request, workspace, options, request_metrics)
+
+        # The file is streamed from disk by the event loop; the workspace goes once it is sent
+        response = FileResponse(workspace.output_path, media_type=DOCX_MIMETYPE,
+                                filename=filename.replace('.pdf', '.docx'), headers=report_headers(report))
+        return _finish(request_metrics, response, workspace)
+
+    except ConversionError as e:
+        return _finish(request_metrics, _error(e), workspace)
+
+    except Exception as e:
+        logging.error(f'Request processing failed: {str(e)}')
+        return _finish(request_metrics,
+                       JSONResponse({"error": f"Request processing failed: {str(e)}"}, status_code=500), workspace)
+
+def _receive_base64_body(workspace, request_metrics):
+    # Decodes the spooled JSON body into the PDF; returns (data, size)
+    with open(workspace.path('body.json'), 'rb') as body:
+        received = service.receive_base64_json(body, workspace, 'fileData', request_metrics)
+    os.unlink(workspace.path('body.json'))
+    return received
+
+async def convert_base64(request):
+    request_metrics = RequestMetrics('convert-base64')
+    workspace = None
+    try:
+        if not pool.has_room():
+            return _finish(request_metrics, _overloaded())
+
+        if 'application/json' not in request.headers.get('content-type', ''):
+            return _finish(request_metrics, JSONResponse({"error": "No fileData provided"}, status_code=400))
+
+        # Read the body on the event loop and write it in threads (a memory-backed
+        # workspace may move to disk meanwhile), then decode it from there in a thread
+        workspace = service.workspaces.acquire()
+        with request_metrics.stage('upload'):
+            body = await run_in_threadpool(service.workspaces.create, workspace, 'body.json')
+            try:
+                async for chunk in request.stream():
+                    await run_in_threadpool(body.write, chunk)
+            finally:
+                body.close()
+        data, pdf_size = await run_in_threadpool(_receive_base64_body, workspace, request_metrics)
+
+        filename = data.get('fileName', 'document.pdf')
+        options = service.options.for_request(data.get('start'), data.get('end'), data.get('pages'),
+                                              data.get('profile'))
+        report = await _run_conversion(request, workspace, options, request_metrics)
+
+        # Encoded chunk by chunk from disk while the client reads
+        body = iter_base64_json(open(workspace.output_path, 'rb'), "data", {
+            "success": True,
+            "originalSize": pdf_size,
+            "convertedSize": report["outputSize"],
+            "images": report.get("images"),
+            "engines": report.get("engines"),
+            "pageCache": report.get("pageCache"),
+            "profile": profile_info(report["profile"]),
+            "filename": filename.replace('.pdf', '.docx')
+        })
+        response = StreamingResponse(body, media_type='application/json')
+        return _finish(request_metrics, response, workspace)
+
+    except ConversionError as e:
+        return _finish(request_metrics, _error(e), workspace)
+
+    except Exception as e:
+        logging.error(f'Base64 request processing failed: {str(e)}')
+        return _finish(request_metrics,
+                       JSONResponse({"error": f"Request processing failed: {str(e)}"}, status_code=500), workspace)
+
+@asynccontextmanager
+async def lifespan(app):
+    pool.start()
+    try:
+        yield
+    finally:
+        pool.shutdown()
+
+app = Starlette(
+    routes=[
+        Route('/health', health, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/inspect', inspect, methods=['POST']),
+        Route('/convert', convert, methods=['POST']),
+        Route('/convert-base64', convert_base64, methods=['POST']),
+    ],
+    lifespan=lifespan
+)
@@ -1,29 +1,60 @@
-from flask import Flask, request, jsonify, send_file
-import tempfile
+from flask import Flask, Response, g, request, jsonify, send_file, url_for
 import os
-import base64
-from pdf2docx import Converter
+import json
+import threading
+import time
+import zipfile
+from pdf2word import convert_batch, profile_info, summarize_batch
+from pdf2word_cache import get_default_cache, get_default_page_cache
+from pdf2word_core import ConversionError, ConversionService
+from pdf2word_flask import register_conversion_routes
+from pdf2word_progress import ProgressTracker
+from pdf2word_metrics import instrument
+from pdf2word_streams import spool_to_file
+from pdf2word_jobs import JobRunner, JobStore, create_jobs_blueprint
+from pdf2word_admission import AdmissionController, Overloaded
+from pdf2word_office import get_default_office_pool
+from pdf2word_scratch import Workspace
+import pdf2word_warmup
 import logging
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
+service = ConversionService(cache=get_default_cache(), page_cache=get_default_page_cache(),
+                            admission=AdmissionController(), office=get_default_office_pool())
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({
-        "status": "healthy",
-        "service": "PDF to Word conversion",
-        "version": "1.0.0",
-        "endpoints": {
-            "convert": "/convert",
-            "health": "/health"
-        }
-    })
+# /convert-batch limits
+BATCH_WORKERS = int(os.environ.get('PDF2WORD_BATCH_WORKERS', '2'))
+BATCH_MAX_FILES = int(os.environ.get('PDF2WORD_BATCH_MAX_FILES', '50'))
+BATCH_MAX_BYTES = int(os.environ.get('PDF2WORD_BATCH_MAX_BYTES', str(200 * 1024 * 1024)))
+
+# Asynchronous job API (POST /jobs, GET /jobs/<id>, GET /jobs/<id>/result)
+job_store = JobStore()
+job_runner = JobRunner(job_store)
+app.register_blueprint(create_jobs_blueprint(job_store, job_runner))
+# The runner's threads and pool belong in the workers when gunicorn preloads the app
+pdf2word_warmup.after_fork(job_runner.ensure_started)
 
-@app.route('/convert', methods=['POST'])
-def convert():
+register_conversion_routes(app, service, health_info=lambda: {
+    "jobs": job_store.counts(),
+    "endpoints": {
+        "convert": "/convert",
+        "inspect": "/inspect",
+        "convertStream": "/convert-stream",
+        "convertBatch": "/convert-batch",
+        "jobs": "/jobs",
+        "metrics": "/metrics",
+        "health": "/health"
+    }
+})
+
+@app.route('/convert-stream', methods=['POST'])
+@instrument('convert-stream')
+def convert_stream():
+    # Same input as /convert; answers with Server-Sent Events: "start", one
+    # "progress" per parsed and rendered page, then "done" with the result URL
+    # (served by the job API) or "error".
     try:
-        # Handle file upload
         if 'file' not in request.files:
             return jsonify({"error": "No file provided"}), 400
         
@@ -31,60 +62,225 @@ def convert():
         if file.filename == '':
             return jsonify({"error": "No file selected"}), 400
         
-        # Read PDF data
-        pdf_data = file.read()
         filename = file.filename or "document.pdf"
         
-        if not pdf_data:
-            return jsonify({"error": "Empty file"}), 400
+        options = service.options.for_request(request.values.get('start'), request.values.get('end'),
+                                              request.values.get('pages'), request.values.get('profile'))
+        
+        # The conversion is recorded as a job so the result outlives this response
+        job_id = job_store.reserve()
+        workspace = Workspace(job_store.job_dir(job_id))
+        try:
+            pdf_size = service.receive_file(file.stream, workspace, g.request_metrics)
+        except ConversionError:
+            job_store.discard(job_id)
+            raise
+        
+        job_store.begin(job_id, filename, pdf_size, f'stream:{os.getpid()}')
+        urls = {
+            "statusUrl": url_for('jobs.job_status', job_id=job_id),
+            "resultUrl": url_for('jobs.job_result', job_id=job_id)
+        }
+        
+        tracker = ProgressTracker()
+        threading.Thread(
+            target=_stream_conversion,
+            args=(job_id, workspace, options, urls, tracker, g.request_metrics),
+            name=f'pdf2word-stream-{job_id}',
+            daemon=True
+        ).start()
         
-        # Create temporary files
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_pdf:
-            temp_pdf.write(pdf_data)
-            temp_pdf_path = temp_pdf.name
+        # The conversion keeps running if the client goes away; the result stays at resultUrl
+        return Response(tracker.stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
         
-        with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as temp_docx:
-            temp_docx_path = temp_docx.name
+    except ConversionError as e:
+        return jsonify(e.body()), e.status, e.headers
         
+    except Exception as e:
+        logging.error(f'Stream request processing failed: {str(e)}')
+        return jsonify({"error": f"Request processing failed: {str(e)}"}), 500
+
+def _stream_conversion(job_id, workspace, options, urls, tracker, request_metrics):
+    def progress(stage, done, total):
+        job_store.update(job_id, progress=tracker.update(stage, done, total))
+    
+    def started(cost):
+        tracker.restart_clock()
+        tracker.publish("start", dict({"jobId": job_id, "pages": cost["pages"],
+                                       "queueWait": round(cost["waitSeconds"], 3)}, **urls))
+        logging.info(f'Job {job_id}: streaming conversion of {cost["pages"]} pages')
+    
+    try:
+        # Without a heartbeat the job janitor takes the conversion for lost
+        with job_store.heartbeat(job_id):
+            report = service.convert(workspace, options, request_metrics, progress, started)
+        
+        job_store.finish(job_id, report["outputSize"], report["cache"])
+        logging.info(f'Job {job_id}: done (cache {report["cache"]}), {report["outputSize"]} bytes')
+        tracker.publish("done", dict({
+            "jobId": job_id,
+            "convertedSize": report["outputSize"],
+            "pages": report["pages"],
+            "scannedPages": report["scannedPages"],
+            "images": report.get("images"),
+            "engines": report.get("engines"),
+            "pageCache": report.get("pageCache"),
+            "profile": profile_info(report["profile"]),
+            "cache": report["cache"],
+            "elapsed": round(time.monotonic() - tracker.started, 3)
+        }, **urls))
+        
+    except ConversionError as e:
+        logging.warning(f'Job {job_id}: {str(e)}')
+        job_store.fail(job_id, str(e))
+        error = dict(e.body(), jobId=job_id, status=e.status)
+        if "Retry-After" in e.headers:
+            error["retryAfter"] = int(e.headers["Retry-After"])
+        tracker.publish("error", error)
+        
+    finally:
+        if os.path.exists(workspace.input_path):
+            os.unlink(workspace.input_path)
+
+@app.route('/convert-batch', methods=['POST'])
+@instrument('convert-batch')
+def convert_batch_files():
+    # Several PDFs as repeated multipart 'files' fields or one ZIP ('file' field or an
+    # application/zip body). Answers with a ZIP of the DOCX files plus results.json;
+    # a file that fails to convert is reported there without failing the batch.
+    with service.workspace() as workspace:
+        return _convert_batch_files(workspace)
+
+def _convert_batch_files(workspace):
+    try:
+        # One profile for every file in the batch
         try:
-            # Convert PDF to DOCX
-            logging.info(f'Converting PDF ({len(pdf_data)} bytes) to DOCX')
-            cv = Converter(temp_pdf_path)
-            cv.convert(temp_docx_path, start=0, end=None)
-            cv.close()
-            
-            # Check if file was created
-            if not os.path.exists(temp_docx_path) or os.path.getsize(temp_docx_path) == 0:
-                raise Exception("Conversion produced empty output")
-            
-            file_size = os.path.getsize(temp_docx_path)
-            logging.info(f'Conversion successful. Output size: {file_size} bytes')
-            
-            # Return the converted file
-            output_filename = filename.replace('.pdf', '.docx')
-            return send_file(
-                temp_docx_path,
-                as_attachment=True,
-                download_name=output_filename,
-                mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            )
-            
-        except Exception as e:
-            logging.error(f'Conversion failed: {str(e)}')
-            return jsonify({"error": f"Conversion failed: {str(e)}"}), 500
-        
-        finally:
-            # Clean up temp files
+            profile = service.options.for_request(profile=request.values.get('profile')).tuning or {}
+        except ConversionError as e:
+            return jsonify(e.body()), e.status
+        
+        input_dir = workspace.path('input')
+        output_dir = workspace.path('output')
+        os.makedirs(input_dir)
+        
+        with g.request_metrics.stage('upload'):
             try:
-                os.unlink(temp_pdf_path)
-                if os.path.exists(temp_docx_path):
-                    os.unlink(temp_docx_path)
-            except:
-                pass
-                
+                names = _collect_batch_inputs(input_dir)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        
+        if not names:
+            return jsonify({"error": "No PDF files provided"}), 400
+        if len(names) > BATCH_MAX_FILES:
+            return jsonify({"error": f"Too many files: at most {BATCH_MAX_FILES} per batch"}), 413
+        g.request_metrics.bytes_in = sum(os.path.getsize(os.path.join(input_dir, name)) for name in names)
+        
+        jobs = [{
+            "input": os.path.join(input_dir, name),
+            "output": os.path.join(output_dir, os.path.splitext(name)[0] + '.docx'),
+            "profile": profile.get("profile")
+        } for name in names]
+        
+        # The batch takes one admission slot, sized for its largest document
+        largest = max((job["input"] for job in jobs), key=os.path.getsize)
+        try:
+            with service.admission.admit(largest) as cost:
+                g.request_metrics.queue_wait = cost["waitSeconds"]
+                logging.info(f'Converting batch of {len(jobs)} PDFs ({g.request_metrics.bytes_in} bytes)')
+                with g.request_metrics.stage('convert'):
+                    results = convert_batch(jobs, BATCH_WORKERS,
+                                            cache_dir=service.cache.directory if service.cache else None)
+        except Overloaded as e:
+            logging.warning(f'Batch rejected: {str(e)}')
+            g.request_metrics.failed_stage = 'admission'
+            return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
+        
+        summary = summarize_batch([{
+            "filename": name,
+            "output": os.path.basename(job["output"]) if result["success"] else None,
+            "success": result["success"],
+            "error": result.get("error"),
+            "cache": result.get("cache")
+        } for name, job, result in zip(names, jobs, results)])
+        logging.info(f'Batch finished: {summary["succeeded"]}/{summary["total"]} converted')
+        
+        if not summary["succeeded"]:
+            return jsonify(dict(summary, error="No file in the batch could be converted")), 422
+        
+        with g.request_metrics.stage('archive'):
+            archive_path = workspace.path('converted.zip')
+            # DOCX files are already deflated, so they are stored as they are
+            with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_STORED) as archive:
+                for job, result in zip(jobs, results):
+                    if result["success"]:
+                        archive.write(job["output"], os.path.basename(job["output"]))
+                archive.writestr('results.json', json.dumps(summary, indent=2))
+        g.request_metrics.bytes_out = os.path.getsize(archive_path)
+        
+        response = send_file(archive_path, as_attachment=True, download_name='converted.zip',
+                             mimetype='application/zip')
+        response.headers['X-Batch-Succeeded'] = str(summary["succeeded"])
+        response.headers['X-Batch-Failed'] = str(summary["failed"])
+        return response
+        
     except Exception as e:
-        logging.error(f'Request processing failed: {str(e)}')
+        logging.error(f'Batch request processing failed: {str(e)}')
         return jsonify({"error": f"Request processing failed: {str(e)}"}), 500
 
+def _collect_batch_inputs(input_dir):
+    # Writes every PDF of the request into input_dir; returns their unique names in order
+    names = []
+    
+    def target(name):
+        base = os.path.basename(name.replace('\\', '/'))
+        if base in ('', '.', '..'):
+            base = 'document.pdf'
+        # Output names come from the stem, so keep stems unique
+        stem, ext = os.path.splitext(base)
+        stems = {os.path.splitext(existing)[0].lower() for existing in names}
+        unique, count = base, 1
+        while os.path.splitext(unique)[0].lower() in stems:
+            unique, count = f'{stem}-{count}{ext}', count + 1
+        names.append(unique)
+        return os.path.join(input_dir, unique)
+    
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    if not uploads and request.mimetype in ('application/zip', 'application/x-zip-compressed'):
+        archive_path = os.path.join(os.path.dirname(input_dir), 'upload.zip')
+        with open(archive_path, 'wb') as f:
+            spool_to_file(request.stream, f)
+        _extract_pdfs(archive_path, target)
+        return names
+    
+    for upload in uploads:
+        if upload.filename and upload.filename.lower().endswith('.zip'):
+            archive_path = os.path.join(os.path.dirname(input_dir), 'upload.zip')
+            with open(archive_path, 'wb') as f:
+                spool_to_file(upload.stream, f)
+            _extract_pdfs(archive_path, target)
+        elif upload.filename:
+            with open(target(upload.filename), 'wb') as f:
+                spool_to_file(upload.stream, f)
+    return names
+
+def _extract_pdfs(archive_path, target):
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile:
+        raise ValueError("Invalid ZIP archive")
+    with archive:
+        members = [info for info in archive.infolist()
+                   if not info.is_dir() and info.filename.lower().endswith('.pdf')
+                   and not os.path.basename(info.filename).startswith('.')]
+        # Check the declared sizes before anything is unpacked
+        if len(members) > BATCH_MAX_FILES:
+            raise ValueError(f"Too many files: at most {BATCH_MAX_FILES} per batch")
+        if sum(info.file_size for info in members) > BATCH_MAX_BYTES:
+            raise ValueError(f"ZIP contents exceed {BATCH_MAX_BYTES} bytes")
+        for info in members:
+            with archive.open(info) as src, open(target(info.filename), 'wb') as dest:
+                spool_to_file(src, dest)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
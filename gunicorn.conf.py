@@ -0,0 +1,28 @@
+import os
+
+import pdf2word_metrics
+import pdf2word_warmup
+
+# gunicorn settings shared by the Flask images (bind, workers and timeout are
+# given on the command line). With PDF2WORD_PRELOAD on (the default) the master
+# warms up the conversion stack and loads the app once; workers are forked from it.
+
+preload_app = pdf2word_warmup.PRELOAD
+
+if preload_app:
+    # Runs before the master imports the app, so the report shows the import cost
+    pdf2word_warmup.begin_preload()
+
+def on_starting(server):
+    # Metrics snapshots of this master's workers only: workers that load the app
+    # themselves read the directory from the environment, preloaded ones inherit it
+    directory = os.path.join(pdf2word_metrics.DEFAULT_METRICS_DIR, f'master-{os.getpid()}')
+    os.environ['PDF2WORD_METRICS_DIR'] = directory
+    pdf2word_metrics.registry.claim_directory(directory)
+
+def when_ready(server):
+    if preload_app:
+        pdf2word_warmup.end_preload()
+
+def post_fork(server, worker):
+    pdf2word_warmup.worker_started()
@@ -7,7 +7,8 @@ const path = require('path');
 const { promisify } = require('util');
 const libre = require('libreoffice-convert');
 const cors = require('cors');
-const { exec } = require('child_process');
+const { exec, spawn } = require('child_process');
+const net = require('net');
 
 // Promisify the libre convert function and exec
 const libreConvertAsync = promisify(libre.convert);
@@ -33,6 +34,113 @@ const upload = multer({
   limits: { fileSize: 50 * 1024 * 1024 } // 50MB limit
 });
 
+// Long-lived pdf2word server (python3 pdf2word.py --serve) so PDF to Word jobs
+// skip interpreter startup and the pdf2docx/PyMuPDF imports on every request
+const PDF2WORD_SOCKET = process.env.PDF2WORD_SOCKET || '/tmp/pdf2word.sock';
+const PDF2WORD_WORKERS = process.env.PDF2WORD_WORKERS || '2';
+const PDF2WORD_TIMEOUT = 120000; // 2 minutes, same budget as the one-shot CLI
+// Restarts back off from 1s up to a minute; after this many failed starts in a
+// row the server is given up on and PDF to Word jobs use the CLI
+const PDF2WORD_MAX_RESTARTS = parseInt(process.env.PDF2WORD_DAEMON_RESTARTS || '5', 10);
+const PDF2WORD_RESTART_DELAY = 1000;
+const PDF2WORD_MAX_RESTART_DELAY = 60000;
+// A server that stayed up this long counts as started; the backoff starts over
+const PDF2WORD_STABLE_AFTER = 60000;
+let pdf2wordDaemon = null;
+let pdf2wordRestarts = 0;
+let pdf2wordDaemonDisabled = process.env.PDF2WORD_DAEMON === 'off';
+
+function startPdf2WordDaemon() {
+  if (pdf2wordDaemonDisabled) {
+    return;
+  }
+
+  console.log(`[INFO] Starting pdf2word server on ${PDF2WORD_SOCKET} with ${PDF2WORD_WORKERS} workers`);
+  const args = ['pdf2word.py', '--serve', '--socket', PDF2WORD_SOCKET, '--workers', PDF2WORD_WORKERS];
+  if (process.env.PDF2WORD_CACHE_DIR) {
+    args.push('--cache-dir', process.env.PDF2WORD_CACHE_DIR);
+  }
+  const daemon = spawn('python3', args, { cwd: __dirname, stdio: ['ignore', 'inherit', 'inherit'] });
+  const startedAt = Date.now();
+  pdf2wordDaemon = daemon;
+
+  // 'exit' may or may not follow 'error', so whichever comes first restarts
+  const restart = (reason) => {
+    if (pdf2wordDaemon !== daemon) {
+      return;
+    }
+    pdf2wordDaemon = null;
+    if (Date.now() - startedAt >= PDF2WORD_STABLE_AFTER) {
+      pdf2wordRestarts = 0;
+    }
+    if (pdf2wordRestarts >= PDF2WORD_MAX_RESTARTS) {
+      pdf2wordDaemonDisabled = true;
+      console.error(`[ERROR] pdf2word server ${reason}; gave up after ${pdf2wordRestarts} restarts, ` +
+        'PDF to Word conversions use the CLI from now on');
+      return;
+    }
+    const delay = Math.min(PDF2WORD_RESTART_DELAY * 2 ** pdf2wordRestarts, PDF2WORD_MAX_RESTART_DELAY);
+    pdf2wordRestarts += 1;
+    console.warn(`[WARN] pdf2word server ${reason}; restarting in ${delay / 1000}s ` +
+      `(attempt ${pdf2wordRestarts} of ${PDF2WORD_MAX_RESTARTS})`);
+    setTimeout(startPdf2WordDaemon, delay);
+  };
+
+  daemon.on('error', (error) => {
+    console.error('[ERROR] Could not start pdf2word server:', error.message);
+    restart('could not start');
+  });
+
+  daemon.on('exit', (code, signal) => {
+    restart(`exited (code ${code}, signal ${signal})`);
+  });
+}
+
+process.on('exit', () => {
+  if (pdf2wordDaemon) {
+    pdf2wordDaemon.removeAllListeners('exit');
+    pdf2wordDaemon.kill();
+  }
+});
+
+// Default signal handling skips 'exit' listeners and would orphan the server
+['SIGINT', 'SIGTERM'].forEach((signal) => process.on(signal, () => process.exit(0)));
+
+// Send one job to the pdf2word server; rejects if the server is unreachable
+function convertWithPdf2WordDaemon(inputPath, outputPath) {
+  return new Promise((resolve, reject) => {
+    const socket = net.createConnection(PDF2WORD_SOCKET);
+    let buffer = '';
+
+    socket.setTimeout(PDF2WORD_TIMEOUT, () => {
+      const timeoutError = new Error('pdf2word server timed out');
+      timeoutError.code = 'ETIMEDOUT';
+      socket.destroy(timeoutError);
+    });
+
+    socket.on('connect', () => {
+      socket.write(JSON.stringify({ id: Date.now(), input: inputPath, output: outputPath }) + '\n');
+    });
+
+    socket.on('data', (chunk) => {
+      buffer += chunk.toString('utf8');
+      const newline = buffer.indexOf('\n');
+      if (newline === -1) {
+        return;
+      }
+      socket.end();
+      try {
+        resolve(JSON.parse(buffer.slice(0, newline)));
+      } catch (parseError) {
+        reject(parseError);
+      }
+    });
+
+    socket.on('error', reject);
+    socket.on('close', () => reject(new Error('pdf2word server closed the connection')));
+  });
+}
+
 // Verify LibreOffice is properly installed on startup
 async function verifyLibreOffice() {
   try {
@@ -68,19 +176,38 @@ app.post('/api/convert', upload.single('file'), async (req, res) => {
       
       try {
         const outputFilePath = path.join('/tmp', `${Date.now()}-converted.docx`);
-        const pythonCommand = `python3 pdf2word.py "${sourceFilePath}" "${outputFilePath}"`;
-        
-        console.log(`[INFO] Running Python conversion: ${pythonCommand}`);
-        const { stdout, stderr } = await execAsync(pythonCommand, { 
-          timeout: 120000, // 2 minutes timeout
-          cwd: __dirname 
-        });
+        let result;
         
-        console.log('[INFO] Python conversion output:', stdout);
-        if (stderr) console.log('[INFO] Python conversion stderr:', stderr);
-        
-        // Parse the JSON result
-        const result = JSON.parse(stdout);
+        try {
+          if (pdf2wordDaemonDisabled) {
+            throw new Error('pdf2word server is not running');
+          }
+          console.log('[INFO] Sending conversion job to pdf2word server');
+          result = await convertWithPdf2WordDaemon(sourceFilePath, outputFilePath);
+        } catch (daemonError) {
+          // A job that already ran out of time would only time out again
+          if (daemonError.code === 'ETIMEDOUT') {
+            throw daemonError;
+          }
+          // Fall back to the one-shot CLI; it prints the same JSON result. Once the
+          // server is given up on, that was logged at the time
+          if (!pdf2wordDaemonDisabled) {
+            console.warn('[WARN] pdf2word server unavailable, falling back to CLI:', daemonError.message);
+          }
+          const pythonCommand = `python3 pdf2word.py "${sourceFilePath}" "${outputFilePath}"`;
+          
+          console.log(`[INFO] Running Python conversion: ${pythonCommand}`);
+          const { stdout, stderr } = await execAsync(pythonCommand, { 
+            timeout: PDF2WORD_TIMEOUT,
+            cwd: __dirname 
+          });
+          
+          console.log('[INFO] Python conversion output:', stdout);
+          if (stderr) console.log('[INFO] Python conversion stderr:', stderr);
+          
+          // Parse the JSON result
+          result = JSON.parse(stdout);
+        }
         
         if (!result.success) {
           console.error('[ERROR] Python conversion failed:', result.error);
@@ -471,6 +598,8 @@ app.listen(PORT, () => {
   console.log(`[INFO]   GET /api/health`);
   console.log(`[INFO]   GET /test`);
   
+  startPdf2WordDaemon();
+  
   // Verify LibreOffice on startup
   verifyLibreOffice().then(available => {
     if (available) {
@@ -1,158 +1,197 @@
 import azure.functions as func
 import logging
-import tempfile
 import os
 import json
-from pdf2docx import Converter
-import base64
+import io
+
+from pdf2word import profile_info
+from pdf2word_cache import get_default_cache, get_default_page_cache
+from pdf2word_core import ConversionError, ConversionService, office_headers, report_headers
+from pdf2word_metrics import PROMETHEUS_CONTENT_TYPE, TIMING_HEADERS, RequestMetrics, registry
+from pdf2word_office import get_default_office_pool
+from pdf2word_streams import iter_base64_json
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+service = ConversionService(cache=get_default_cache(), page_cache=get_default_page_cache(),
+                            office=get_default_office_pool())
+
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
 
 @app.route(route="pdf2word", methods=["POST"])
 def pdf2word(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('PDF to Word conversion request received.')
+    request_metrics = RequestMetrics('pdf2word')
     
     try:
-        # Get content type
-        content_type = req.headers.get('content-type', '').lower()
-        
-        if 'multipart/form-data' in content_type:
-            # Handle file upload
-            files = req.files
-            if not files or 'file' not in files:
-                return func.HttpResponse(
-                    json.dumps({"error": "No file provided"}),
-                    status_code=400,
-                    mimetype="application/json"
-                )
-            
-            file = files['file']
-            pdf_data = file.read()
-            filename = file.filename or "document.pdf"
-            
-        elif 'application/json' in content_type:
-            # Handle JSON with base64 data
-            try:
-                json_data = req.get_json()
-                if not json_data or 'fileData' not in json_data:
-                    return func.HttpResponse(
-                        json.dumps({"error": "No fileData in JSON"}),
-                        status_code=400,
-                        mimetype="application/json"
-                    )
-                
-                pdf_data = base64.b64decode(json_data['fileData'])
-                filename = json_data.get('fileName', 'document.pdf')
-                
-            except Exception as e:
-                return func.HttpResponse(
-                    json.dumps({"error": f"Invalid JSON: {str(e)}"}),
-                    status_code=400,
-                    mimetype="application/json"
-                )
-        else:
-            return func.HttpResponse(
-                json.dumps({"error": "Unsupported content type. Use multipart/form-data or application/json"}),
-                status_code=400,
-                mimetype="application/json"
-            )
-        
-        if not pdf_data:
-            return func.HttpResponse(
-                json.dumps({"error": "Empty file data"}),
-                status_code=400,
+        with service.workspace() as workspace:
+            response = _convert(req, workspace, request_metrics)
+    except ConversionError as e:
+        response = _error(str(e), e.status, e.headers, e.details)
+    except Exception as e:
+        logging.error(f'Request processing failed: {str(e)}')
+        response = _error(f"Request processing failed: {str(e)}", 500)
+    
+    if TIMING_HEADERS:
+        response.headers['Server-Timing'] = request_metrics.server_timing()
+    request_metrics.finish(response.status_code)
+    return response
+
+def _error(message, status_code, headers=None, details=None):
+    return func.HttpResponse(
+        json.dumps(dict(details or {}, error=message)),
+        status_code=status_code,
+        headers=headers,
+        mimetype="application/json"
+    )
+
+@app.route(route="inspect", methods=["POST"])
+def inspect(req: func.HttpRequest) -> func.HttpResponse:
+    # Same input as pdf2word; answers with the document structure and predicted cost
+    request_metrics = RequestMetrics('inspect')
+    
+    try:
+        with service.workspace() as workspace:
+            _, _, options = _receive(req, workspace, request_metrics)
+            response = func.HttpResponse(
+                json.dumps(service.inspect(workspace, options, request_metrics)),
                 mimetype="application/json"
             )
+    except ConversionError as e:
+        response = _error(str(e), e.status, e.headers, e.details)
+    except Exception as e:
+        logging.error(f'Inspect request processing failed: {str(e)}')
+        response = _error(f"Request processing failed: {str(e)}", 500)
+    
+    request_metrics.finish(response.status_code)
+    return response
+
+def _receive(req, workspace, request_metrics):
+    # Writes the PDF of either content type into the workspace; returns (size, fields, options)
+    content_type = req.headers.get('content-type', '').lower()
+    
+    if 'multipart/form-data' in content_type:
+        # Handle file upload
+        files = req.files
+        if not files or 'file' not in files:
+            raise ConversionError("No file provided", 400)
+        file = files['file']
+        pdf_size = service.receive_file(file.stream, workspace, request_metrics)
+        fields = dict(req.form, fileName=file.filename or "document.pdf")
         
-        # Create temporary files
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_pdf:
-            temp_pdf.write(pdf_data)
-            temp_pdf_path = temp_pdf.name
-        
-        with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as temp_docx:
-            temp_docx_path = temp_docx.name
-        
-        try:
-            # Convert PDF to DOCX
-            logging.info(f'Converting PDF ({len(pdf_data)} bytes) to DOCX')
-            cv = Converter(temp_pdf_path)
-            cv.convert(temp_docx_path, start=0, end=None)
-            cv.close()
-            
-            # Read converted file
-            with open(temp_docx_path, 'rb') as f:
-                docx_data = f.read()
-            
-            if not docx_data:
-                raise Exception("Conversion produced empty output")
-            
-            logging.info(f'Conversion successful. Output size: {len(docx_data)} bytes')
-            
-            # Return based on request type
-            if 'application/json' in content_type:
-                # Return base64 for JSON requests
-                docx_base64 = base64.b64encode(docx_data).decode('utf-8')
-                return func.HttpResponse(
-                    json.dumps({
-                        "success": True,
-                        "data": docx_base64,
-                        "originalSize": len(pdf_data),
-                        "convertedSize": len(docx_data),
-                        "filename": filename.replace('.pdf', '.docx')
-                    }),
-                    mimetype="application/json"
-                )
-            else:
-                # Return file for multipart requests
-                output_filename = filename.replace('.pdf', '.docx')
-                headers = {
-                    'Content-Type': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                    'Content-Disposition': f'attachment; filename="{output_filename}"',
-                    'Content-Length': str(len(docx_data))
-                }
-                
-                return func.HttpResponse(
-                    docx_data,
-                    status_code=200,
-                    headers=headers,
-                    mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-                )
-                
-        except Exception as e:
-            logging.error(f'Conversion failed: {str(e)}')
-            return func.HttpResponse(
-                json.dumps({"error": f"Conversion failed: {str(e)}"}),
-                status_code=500,
-                mimetype="application/json"
-            )
+    elif 'application/json' in content_type:
+        # Handle JSON with base64 data, decoded incrementally to disk
+        fields, pdf_size = service.receive_base64_json(io.BytesIO(req.get_body()), workspace,
+                                                       'fileData', request_metrics)
         
-        finally:
-            # Clean up temporary files
-            try:
-                os.unlink(temp_pdf_path)
-                os.unlink(temp_docx_path)
-            except:
-                pass
-                
-    except Exception as e:
-        logging.error(f'Request processing failed: {str(e)}')
+    else:
+        raise ConversionError("Unsupported content type. Use multipart/form-data or application/json", 400)
+    
+    # Optional page selection and profile; the query string works for both content types
+    options = service.options.for_request(fields.get('start', req.params.get('start')),
+                                          fields.get('end', req.params.get('end')),
+                                          fields.get('pages', req.params.get('pages')),
+                                          fields.get('profile', req.params.get('profile')))
+    return pdf_size, fields, options
+
+def _convert(req, workspace, request_metrics):
+    pdf_size, fields, options = _receive(req, workspace, request_metrics)
+    content_type = req.headers.get('content-type', '').lower()
+    
+    # Other formats than DOCX come from the office pool
+    target = (fields.get('format', req.params.get('format')) or 'docx').lower()
+    if target != 'docx':
+        return _convert_office(fields, workspace, target, content_type, request_metrics)
+    
+    report = service.convert(workspace, options, request_metrics)
+    output_filename = fields.get('fileName', 'document.pdf').replace('.pdf', '.docx')
+    
+    # Return based on request type
+    if 'application/json' in content_type:
+        # Return base64 for JSON requests, encoded from disk in chunks
+        with request_metrics.stage('response'):
+            body = b''.join(iter_base64_json(open(workspace.output_path, 'rb'), "data", {
+                "success": True,
+                "originalSize": pdf_size,
+                "convertedSize": report["outputSize"],
+                "images": report.get("images"),
+                "engines": report.get("engines"),
+                "pageCache": report.get("pageCache"),
+                "profile": profile_info(report["profile"]),
+                "filename": output_filename
+            }))
+        return func.HttpResponse(
+            body,
+            mimetype="application/json"
+        )
+    
+    # Return file for multipart requests
+    with open(workspace.output_path, 'rb') as f:
+        docx_data = f.read()
+    
+    headers = {
+        'Content-Type': DOCX_MIMETYPE,
+        'Content-Disposition': f'attachment; filename="{output_filename}"',
+        'Content-Length': str(len(docx_data)),
+        **report_headers(report)
+    }
+    
+    return func.HttpResponse(
+        docx_data,
+        status_code=200,
+        headers=headers,
+        mimetype=DOCX_MIMETYPE
+    )
+
+def _convert_office(fields, workspace, target, content_type, request_metrics):
+    report = service.convert_office(workspace, target, request_metrics)
+    output_filename = f"{os.path.splitext(fields.get('fileName', 'document.pdf'))[0]}.{target}"
+    
+    if 'application/json' in content_type:
+        with request_metrics.stage('response'):
+            body = b''.join(iter_base64_json(open(report["outputPath"], 'rb'), "data", {
+                "success": True,
+                "originalSize": request_metrics.bytes_in,
+                "convertedSize": report["outputSize"],
+                "format": target,
+                "filename": output_filename
+            }))
         return func.HttpResponse(
-            json.dumps({"error": f"Request processing failed: {str(e)}"}),
-            status_code=500,
+            body,
             mimetype="application/json"
         )
+    
+    with open(report["outputPath"], 'rb') as f:
+        data = f.read()
+    
+    headers = {
+        'Content-Type': report["mediaType"],
+        'Content-Disposition': f'attachment; filename="{output_filename}"',
+        'Content-Length': str(len(data)),
+        **office_headers(report)
+    }
+    
+    return func.HttpResponse(
+        data,
+        status_code=200,
+        headers=headers,
+        mimetype=report["mediaType"]
+    )
 
 @app.route(route="health", methods=["GET"])
 def health(req: func.HttpRequest) -> func.HttpResponse:
     return func.HttpResponse(
-        json.dumps({
-            "status": "healthy",
-            "service": "PDF to Word conversion",
-            "version": "1.0.0",
-            "endpoints": {
-                "convert": "/api/pdf2word",
-                "health": "/api/health"
-            }
-        }),
+        json.dumps(dict(service.health(), endpoints={
+            "convert": "/api/pdf2word",
+            "inspect": "/api/inspect",
+            "metrics": "/api/metrics",
+            "health": "/api/health"
+        })),
         mimetype="application/json"
-    )
\ No newline at end of file
+    )
+
+@app.route(route="metrics", methods=["GET"])
+def metrics(req: func.HttpRequest) -> func.HttpResponse:
+    return func.HttpResponse(
+        registry.render(),
+        headers={'Content-Type': PROMETHEUS_CONTENT_TYPE}
+    )
@@ -0,0 +1,72 @@
+#!/bin/bash
+
+# Publishes the pdf2word Azure Function. function_app.py imports the shared
+# pdf2word modules from the repository root, so they are staged next to it
+# before publishing.
+#
+#   ./publish.sh <function-app-name>   stage and publish
+#   ./publish.sh --stage-only          stage only, then: cd build && func start
+
+set -e
+
+FUNCTION_DIR="$(cd "$(dirname "$0")" && pwd)"
+REPO_ROOT="$(dirname "$FUNCTION_DIR")"
+BUILD_DIR="$FUNCTION_DIR/build"
+
+# Everything function_app.py imports from the repository root, directly or not
+SHARED_MODULES="
+pdf2word.py
+pdf2word_admission.py
+pdf2word_cache.py
+pdf2word_core.py
+pdf2word_images.py
+pdf2word_inspect.py
+pdf2word_metrics.py
+pdf2word_native.py
+pdf2word_office.py
+pdf2word_pages.py
+pdf2word_scratch.py
+pdf2word_streams.py
+pdf2word_supervisor.py
+pdf2word_warmup.py
+"
+
+APP_NAME="$1"
+if [ -z "$APP_NAME" ]; then
+    echo "Usage: $0 <function-app-name> | --stage-only"
+    exit 1
+fi
+
+echo "📦 Staging function in $BUILD_DIR..."
+rm -rf "$BUILD_DIR"
+mkdir -p "$BUILD_DIR"
+cp "$FUNCTION_DIR/function_app.py" "$FUNCTION_DIR/host.json" "$FUNCTION_DIR/requirements.txt" \
+   "$FUNCTION_DIR/.funcignore" "$BUILD_DIR/"
+for module in $SHARED_MODULES; do
+    cp "$REPO_ROOT/$module" "$BUILD_DIR/"
+done
+
+# Fails here rather than at the first request when a module is missing
+(cd "$BUILD_DIR" && python -c "import ast, sys
+imports = set()
+for module in ['function_app'] + [name[:-3] for name in sys.argv[1:]]:
+    tree = ast.parse(open(module + '.py').read())
+    imports |= {node.module for node in ast.walk(tree) if isinstance(node, ast.ImportFrom) and node.module}
+    imports |= {alias.name for node in ast.walk(tree) if isinstance(node, ast.Import) for alias in node.names}
+missing = sorted(name for name in imports if name.startswith('pdf2word') and name + '.py' not in sys.argv[1:])
+if missing:
+    sys.exit('Shared modules missing from publish.sh: ' + ', '.join(missing))" $SHARED_MODULES)
+
+if [ "$APP_NAME" = "--stage-only" ]; then
+    echo "✅ Staged. Run locally with: cd $BUILD_DIR && func start"
+    exit 0
+fi
+
+if ! command -v func &> /dev/null; then
+    echo "❌ Azure Functions Core Tools (func) is not installed."
+    exit 1
+fi
+
+echo "🚀 Publishing to $APP_NAME..."
+cd "$BUILD_DIR"
+func azure functionapp publish "$APP_NAME" --python
@@ -2,34 +2,887 @@
 import sys
 import os
 from pdf2docx import Converter
+from pdf2docx.converter import ConversionException, Document, MakedocxException
 import json
+import logging
+import argparse
+import multiprocessing
+import signal
+import socketserver
+import threading
+import time
+import hashlib
+import heapq
+import shutil
+import tempfile
+from contextlib import closing, nullcontext
+from importlib.metadata import version
+from io import BytesIO
+import fitz
+from docx.shared import Pt
+from pdf2word_cache import PageCache, ResultCache
+from pdf2word_images import optimize_images
+from pdf2word_native import NativeWriter, is_simple_page, new_page_section
+from pdf2word_pages import PageFragments
 
-def convert_pdf_to_word(pdf_path, docx_path):
+USAGE = "Usage: python pdf2word.py <input.pdf> <output.docx>"
+SERVE_USAGE = "python pdf2word.py --serve [--socket PATH | --stdio] [--workers N]"
+BATCH_USAGE = "python pdf2word.py --batch <manifest | directory> [--output-dir DIR] [--workers N]"
+INSPECT_USAGE = "python pdf2word.py --inspect <input.pdf> [--start N] [--end N] [--pages LIST]"
+
+DEFAULT_SOCKET = os.environ.get('PDF2WORD_SOCKET', '/tmp/pdf2word.sock')
+DEFAULT_WORKERS = int(os.environ.get('PDF2WORD_WORKERS', '2'))
+# Recycle pool processes after this many jobs so pdf2docx/PyMuPDF leaks stay bounded
+DEFAULT_MAX_JOBS_PER_WORKER = int(os.environ.get('PDF2WORD_MAX_JOBS_PER_WORKER', '200'))
+
+# Page-sharded conversion: shards of this many pages are parsed in parallel
+# by up to this many processes. Documents that fit in one shard stay single-core.
+DEFAULT_SHARD_WORKERS = int(os.environ.get('PDF2WORD_SHARD_WORKERS', str(os.cpu_count() or 1)))
+DEFAULT_SHARD_SIZE = int(os.environ.get('PDF2WORD_SHARD_SIZE', '10'))
+# Pages parsed and written to the DOCX at a time when parsing in this process;
+# their layout is released before the next window, so peak memory no longer
+# grows with the page count (0 = the whole selection at once)
+DEFAULT_WINDOW_SIZE = int(os.environ.get('PDF2WORD_WINDOW_SIZE', '25'))
+
+# Output settings; any of them can be overridden per conversion (the CLI flags,
+# ConversionOptions.tuning) and all of them are part of the result cache key.
+DEFAULT_TUNING = {
+    # Image-only pages are embedded as one picture at no more than this resolution
+    # instead of going through layout analysis (0 = analyse them like any page)
+    "scan_dpi": int(os.environ.get('PDF2WORD_SCAN_DPI', '150')),
+    # JPEG quality for scanned pages that have to be rendered
+    "scan_quality": int(os.environ.get('PDF2WORD_SCAN_QUALITY', '75')),
+    # Scale images in the DOCX down to this resolution at their displayed size,
+    # re-encode and de-duplicate them (0 = keep pdf2docx's images as they are)
+    "image_dpi": int(os.environ.get('PDF2WORD_IMAGE_DPI', '0')),
+    # JPEG quality for re-encoded photographic images
+    "image_quality": int(os.environ.get('PDF2WORD_IMAGE_QUALITY', '80')),
+    # Parsing profile, one of PROFILES
+    "profile": os.environ.get('PDF2WORD_PROFILE', 'balanced'),
+    # "auto" writes simple single-column text pages with the native engine
+    # (pdf2word_native) and the rest with pdf2docx; "pdf2docx" uses it for every page
+    "engine": os.environ.get('PDF2WORD_ENGINE', 'auto'),
+}
+
+ENGINES = ("auto", "pdf2docx")
+
+# Named sets of pdf2docx parsing settings (over Converter.default_settings),
+# chosen per conversion through the "profile" tuning setting. The benchmark is
+# pages per second per corpus document, all three profiles measured in one run of
+#   python pdf2word_bench.py run --profile fast,balanced,accurate --concurrency 1 --iterations 3
+# on the seeded corpus (1 CPU, Python 3.11), and is returned with each result.
+# The engine was "auto": text-10 and 14 of the mixed-40 pages took the native
+# writer and scan-10 the scan path, which no profile setting affects. Accurate is
+# slower than balanced where pdf2docx does the work; on mixed-40 and scan-10 the
+# two are the same within run-to-run noise (accurate came out 5-8% ahead twice).
+PROFILES = {
+    "fast": {
+        "description": "Editable text only: no table detection, vector graphics clipped at low resolution",
+        "settings": {"parse_lattice_table": False, "parse_stream_table": False, "clip_image_res_ratio": 2.0},
+        "benchmark": {"text-10": 15.33, "table-10": 1.57, "image-10": 10.04, "mixed-40": 3.96, "scan-10": 11.29},
+    },
+    "balanced": {
+        "description": "pdf2docx defaults: text, tables, images and shapes",
+        "settings": {},
+        "benchmark": {"text-10": 15.0, "table-10": 0.6, "image-10": 8.91, "mixed-40": 1.36, "scan-10": 11.5},
+    },
+    "accurate": {
+        "description": "Balanced, with sharper vector graphics and small shapes kept",
+        "settings": {"clip_image_res_ratio": 8.0, "shape_min_dimension": 1.0, "min_svg_w": 1.0, "min_svg_h": 1.0},
+        "benchmark": {"text-10": 11.83, "table-10": 0.53, "image-10": 8.39, "mixed-40": 1.47, "scan-10": 11.71},
+    },
+}
+
+# A page with no fonts whose images cover at least this fraction of it counts as scanned
+SCAN_MIN_COVERAGE = 0.5
+
+def resolve_tuning(tuning=None):
+    unknown = set(tuning or {}) - set(DEFAULT_TUNING)
+    if unknown:
+        raise ValueError(f"Unknown conversion settings: {', '.join(sorted(unknown))}")
+    resolved = dict(DEFAULT_TUNING, **{key: value for key, value in (tuning or {}).items() if value is not None})
+    if not isinstance(resolved["profile"], str) or resolved["profile"] not in PROFILES:
+        raise ProfileError(f"Unknown profile {resolved['profile']!r}: expected one of {', '.join(PROFILES)}")
+    if resolved["engine"] not in ENGINES:
+        raise ValueError(f"Unknown engine {resolved['engine']!r}: expected one of {', '.join(ENGINES)}")
+    return resolved
+
+def profile_info(name):
+    # What a result reports about the profile it was converted with
+    profile = PROFILES[name]
+    return {"name": name, "description": profile["description"], "benchmark": profile["benchmark"]}
+
+def plan_shards(page_indexes, shard_size):
+    page_indexes = list(page_indexes)
+    shard_size = max(1, shard_size)
+    return [page_indexes[i:i + shard_size] for i in range(0, len(page_indexes), shard_size)]
+
+def _parse_shard(args):
+    # Runs in a pool process: parse only this shard's pages and hand back
+    # the serialized layout so the parent can build one DOCX in page order
+    pdf_path, page_indexes, settings = args
+    cv = open_converter(pdf_path)
+    try:
+        cv.load_pages(pages=page_indexes)
+        cv.parse_document(**settings).parse_pages(**settings)
+        return [page.store() for page in cv.pages if page.finalized]
+    finally:
+        cv.close()
+
+def open_converter(pdf):
+    # pdf is a path or the PDF's bytes
+    if isinstance(pdf, (bytes, bytearray)):
+        return Converter(stream=pdf)
+    return Converter(pdf)
+
+def _can_fork_workers():
+    # Pool processes (e.g. the --serve workers) are daemonic and may not have children
+    return not multiprocessing.current_process().daemon
+
+def _engine_digest():
+    # This repository's part of the conversion (this module: scans, windows and
+    # shards; the native writer, image optimisation and page replay) and the
+    # libraries under pdf2docx. Any change to them makes new result and page
+    # cache keys, so DOCX files cached by older code are not served.
+    digest = hashlib.sha256(f"pymupdf-{version('PyMuPDF')}:python-docx-{version('python-docx')}".encode('utf-8'))
+    for name in (__name__, 'pdf2word_images', 'pdf2word_native', 'pdf2word_pages'):
+        with open(sys.modules[name].__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+ENGINE_VERSION = f"pdf2docx-{version('pdf2docx')}+{_engine_digest()}"
+
+class PageRangeError(ValueError):
+    pass
+
+class ProfileError(ValueError):
+    pass
+
+def parse_page_range(start=None, end=None, pages=None):
+    # Normalise a page selection from the CLI, form fields, query strings or JSON.
+    # Same meaning as pdf2docx: 0-based start, exclusive end, or explicit page indexes.
+    try:
+        start = int(start) if start not in (None, '') else 0
+        end = int(end) if end not in (None, '') else None
+        if isinstance(pages, str):
+            pages = [int(page) for page in pages.split(',') if page.strip()]
+        elif pages is not None:
+            pages = [int(page) for page in pages]
+    except (TypeError, ValueError):
+        raise PageRangeError("start and end must be integers and pages a comma separated list of page indexes")
+
+    if start < 0 or (end is not None and end <= start):
+        raise PageRangeError("Invalid page range: expected 0 <= start < end")
+    if pages is not None and any(page < 0 for page in pages):
+        raise PageRangeError("Invalid page range: page indexes start at 0")
+    return {"start": start, "end": end, "pages": sorted(set(pages)) if pages else None}
+
+def select_pages(num_pages, page_range=None):
+    page_range = page_range or parse_page_range()
+    if page_range["pages"]:
+        out_of_range = [page for page in page_range["pages"] if page >= num_pages]
+        if out_of_range:
+            raise PageRangeError(f"Page {out_of_range[0]} is out of range (document has {num_pages} pages)")
+        return list(page_range["pages"])
+
+    indexes = list(range(num_pages)[page_range["start"]:page_range["end"]])
+    if not indexes:
+        raise PageRangeError(f"No pages selected (document has {num_pages} pages)")
+    return indexes
+
+def cache_options(page_range=None, tuning=None):
+    # Everything that changes the DOCX bytes; shard layout does not
+    return dict({"version": ENGINE_VERSION}, **(page_range or parse_page_range()), **resolve_tuning(tuning))
+
+def page_cache_options(tuning=None):
+    # Everything that changes how a page is written; the page selection and the
+    # image optimisation (done on the whole document afterwards) do not
+    tuning = resolve_tuning(tuning)
+    return dict({"version": ENGINE_VERSION}, **{key: value for key, value in tuning.items()
+                                                if key not in ("image_dpi", "image_quality")})
+
+# ---------------------------------------------------------------------------
+# Scanned pages: a page holding only images goes straight into the DOCX as one
+# picture. pdf2docx would extract, analyse and re-encode the same pixels.
+# ---------------------------------------------------------------------------
+
+def _image_rects(page):
+    # Placement of every image drawn on the page; nothing is decoded or rendered
+    return [fitz.Rect(rect) for kind, rect in page.get_bboxlog() if kind in ('fill-image', 'fill-imgmask')]
+
+def is_scanned_page(page):
+    if page.get_fonts():
+        return False
+    rects = _image_rects(page)
+    if not rects:
+        return False
+    page_area = abs(page.rect)
+    covered = sum(abs(rect & page.rect) for rect in rects)
+    return page_area > 0 and covered / page_area >= SCAN_MIN_COVERAGE
+
+def find_scanned_pages(fitz_doc, page_indexes):
+    if fitz_doc.needs_pass:
+        return []
+    return [index for index in page_indexes if is_scanned_page(fitz_doc[index])]
+
+def find_simple_pages(fitz_doc, page_indexes):
+    # Pages the native engine writes without pdf2docx's layout analysis
+    if fitz_doc.needs_pass:
+        return []
+    return [index for index in page_indexes if is_simple_page(fitz_doc[index])]
+
+def scanned_page_image(page, dpi, quality):
+    # A single page-sized RGB or grey JPEG already at or below the target resolution
+    # is embedded as it is; anything else is rendered once at the target resolution
+    images = page.get_images(full=True)
+    rects = _image_rects(page)
+    if len(images) == 1 and len(rects) == 1 and page.rotation == 0:
+        xref, smask, width, _, _, colorspace, _, _, image_filter, _ = images[0]
+        native_dpi = width / (rects[0].width / 72) if rects[0].width else 0
+        fills_page = max(abs(a - b) for a, b in zip(rects[0], page.rect)) <= 2
+        if (fills_page and 0 < native_dpi <= dpi + 1 and not smask and image_filter == 'DCTDecode'
+                and colorspace in ('DeviceRGB', 'DeviceGray')):
+            return page.parent.xref_stream_raw(xref)
+        if native_dpi:
+            dpi = min(dpi, native_dpi)
+
+    gray = all(image[5] == 'DeviceGray' for image in images)
+    pix = page.get_pixmap(dpi=max(int(dpi), 36), colorspace=fitz.csGRAY if gray else fitz.csRGB, alpha=False)
+    return pix.tobytes('jpeg', jpg_quality=quality)
+
+def _make_scanned_page(docx_file, page, tuning):
+    # Same section handling as pdf2docx's Page.make_docx(), with no margins
+    section = new_page_section(docx_file)
+    width, height = page.rect.width, page.rect.height
+    section.page_width, section.page_height = Pt(width), Pt(height)
+    section.left_margin = section.right_margin = section.top_margin = section.bottom_margin = Pt(0)
+    section.header_distance = section.footer_distance = Pt(0)
+
+    paragraph = docx_file.add_paragraph()
+    paragraph.paragraph_format.space_before = paragraph.paragraph_format.space_after = Pt(0)
+    paragraph.paragraph_format.line_spacing = 1.0
+    # A hair under the page height so Word does not push an empty line to a new page
+    image = scanned_page_image(page, tuning["scan_dpi"], tuning["scan_quality"])
+    paragraph.add_run().add_picture(BytesIO(image), width=Pt(width), height=Pt(height - 1))
+
+def convert_document(pdf_path, docx_path, workers=None, shard_size=None, cache=None, page_range=None,
+                     progress=None, tuning=None, window_size=None, runner=None, page_cache=None):
+    # Returns a small report about how the document was produced:
+    # cache outcome, profile, page counts, page cache hits and per-stage timings in seconds.
+    # page_cache, if given, is a pdf2word_cache.PageCache used when the whole
+    # document is not in cache: pages converted before are reused from it.
+    # pdf_path may also be the PDF's bytes and docx_path a writable binary file
+    # object; then nothing is read from or written to the disk (see convert_stream).
+    # progress, if given, is called as progress(stage, done, total) while pages
+    # are parsed ("parse") and written to the DOCX ("render").
+    # tuning overrides DEFAULT_TUNING; window_size overrides DEFAULT_WINDOW_SIZE.
+    # runner, if given, runs the conversion itself (the cache stays in this
+    # process) as runner(function, *args, progress=progress), e.g.
+    # pdf2word_supervisor.JobSupervisor.run in a child process under limits.
+    tuning = resolve_tuning(tuning)
+    timings = {}
+    cache_key = None
+    if cache is not None:
+        start = time.perf_counter()
+        cache_key = cache.key(pdf_path, cache_options(page_range, tuning))
+        hit = cache.fetch(cache_key, docx_path)
+        timings["cache"] = time.perf_counter() - start
+        if hit:
+            return {"cache": "hit", "pages": 0, "scannedPages": 0, "nativePages": 0, "engines": None, "images": None,
+                    "pageCache": None, "profile": tuning["profile"], "timings": timings}
+
+    to_file = isinstance(docx_path, (str, os.PathLike))
+    run = runner or _run_here
+    report = run(_convert_pages, pdf_path, docx_path if to_file else None, workers, shard_size, page_range, tuning,
+                 window_size, page_cache, progress=progress)
+    if not to_file:
+        # Produced in memory, possibly in another process
+        docx = report.pop("docx")
+        docx_path.write(docx)
+    if page_cache is not None and report["pageCache"]:
+        page_cache.tally(report["pageCache"]["hits"], report["pageCache"]["misses"], report["pageCache"]["stored"])
+    timings.update(report["timings"])
+    report.update(cache="off", profile=tuning["profile"], timings=timings)
+    if cache is not None:
+        start = time.perf_counter()
+        cache.store(cache_key, docx_path if to_file else docx)
+        timings["cache"] += time.perf_counter() - start
+        report["cache"] = "miss"
+    return report
+
+def _run_here(function, *args, progress=None):
+    return function(*args, progress=progress)
+
+def _convert_pages(pdf_path, docx_path, workers, shard_size, page_range=None, tuning=None, window_size=None,
+                   page_cache=None, progress=None):
+    # Returns the pages converted, how many of them were scanned and written by
+    # the native engine, the page indexes each engine handled ("pdf2docx",
+    # "native", "scan", or "cache" when reused from page_cache), the page cache
+    # hits and misses and the image optimisation statistics (None when off) and
+    # the stage timings. Without a docx_path the DOCX bytes are returned as "docx".
+    timings = {}
+    tuning = resolve_tuning(tuning)
+    workers = DEFAULT_SHARD_WORKERS if workers is None else workers
+    shard_size = DEFAULT_SHARD_SIZE if shard_size is None else shard_size
+    window_size = DEFAULT_WINDOW_SIZE if window_size is None else window_size
+
+    start = time.perf_counter()
+    cv = open_converter(pdf_path)
     try:
-        cv = Converter(pdf_path)
-        cv.convert(docx_path, start=0, end=None)
+        settings = dict(cv.default_settings, **PROFILES[tuning["profile"]]["settings"])
+        num_pages = len(cv.fitz_doc)
+        # Pages outside the selection are never parsed
+        page_indexes = select_pages(num_pages, page_range)
+        timings["open"] = time.perf_counter() - start
+
+        fragments = None
+        if page_cache is not None and not cv.fitz_doc.needs_pass:
+            start = time.perf_counter()
+            fragments = PageFragments(page_cache, cv.fitz_doc, page_indexes, page_cache_options(tuning))
+            timings["pageCache"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        # Pages written straight from the PDF or the page cache, by kind
+        direct = dict.fromkeys(fragments.cached if fragments else [], "cache")
+        remaining = [index for index in page_indexes if index not in direct]
+        scanned = find_scanned_pages(cv.fitz_doc, remaining) if tuning["scan_dpi"] else []
+        direct.update(dict.fromkeys(scanned, "scan"))
+        native = []
+        if tuning["engine"] == "auto":
+            native = find_simple_pages(cv.fitz_doc, [index for index in page_indexes if index not in direct])
+            direct.update(dict.fromkeys(native, "native"))
+        layout_pages = [index for index in page_indexes if index not in direct]
+        timings["open"] += time.perf_counter() - start
+        timings["parse"] = 0.0
+
+        # Parsing and writing alternate window by window, so the time spent
+        # waiting for parsed pages is taken out of the DOCX stage
+        start = time.perf_counter()
+        output = docx_path or BytesIO()
+        with closing(_iter_parsed_pages(cv, pdf_path, layout_pages, settings, workers, shard_size, window_size,
+                                        timings, progress)) as parsed:
+            images = _make_docx(cv, output, settings, parsed, len(page_indexes), progress, direct, tuning,
+                                fragments)
+        timings["docx"] = time.perf_counter() - start - timings["parse"]
+        if images:
+            timings["images"] = images["seconds"]
+            timings["docx"] -= images["seconds"]
+        report = {"pages": len(page_indexes), "scannedPages": len(scanned), "nativePages": len(native),
+                  "engines": {"pdf2docx": layout_pages, "native": native, "scan": scanned,
+                              "cache": sorted(fragments.cached) if fragments else []},
+                  "pageCache": fragments.stats() if fragments else None, "images": images, "timings": timings}
+        if docx_path is None:
+            report["docx"] = output.getvalue()
+        return report
+    finally:
         cv.close()
-        return {"success": True, "message": "Conversion completed successfully"}
+
+def _iter_parsed_pages(cv, pdf_path, layout_pages, settings, workers, shard_size, window_size, timings,
+                       progress=None):
+    # Yields the parsed pdf2docx pages in document order, holding one window (or, in
+    # parallel mode, one shard) of them at a time: loading the next window replaces
+    # the pages of the previous one, layout and all. Adds the time spent to timings["parse"].
+    if not layout_pages:
+        # Only scans: pdf2docx has nothing to analyse
+        return
+
+    done = 0
+    shards = plan_shards(layout_pages, shard_size)
+    if workers <= 1 or len(shards) <= 1 or cv.fitz_doc.needs_pass or not _can_fork_workers():
+        # Same steps as Converter.convert(), window by window
+        for window in plan_shards(layout_pages, window_size or len(layout_pages)):
+            start = time.perf_counter()
+            cv.load_pages(pages=window)
+            cv.parse_document(**settings)
+            done = _parse_pages(cv, settings, progress, done, len(layout_pages))
+            timings["parse"] += time.perf_counter() - start
+            yield from [page for page in cv.pages if page.finalized]
+        return
+
+    with multiprocessing.Pool(processes=min(workers, len(shards))) as pool:
+        # imap keeps shard order, so pages come back in document order
+        results = pool.imap(_parse_shard, [(pdf_path, shard, settings) for shard in shards])
+        for shard in shards:
+            start = time.perf_counter()
+            stored_pages = next(results)
+            cv.pages.reset()
+            cv.restore({"page_cnt": len(cv.fitz_doc), "pages": stored_pages})
+            done += len(shard)
+            if progress:
+                progress("parse", done, len(layout_pages))
+            timings["parse"] += time.perf_counter() - start
+            yield from [page for page in cv.pages if page.finalized]
+
+# Converter.parse_pages() and Converter.make_docx() with a progress hook per page
+
+def _parse_pages(cv, settings, progress=None, done=0, total=None):
+    # Parses the loaded pages; done and total count pages across windows. Returns the new done.
+    logging.info('\033[1;36m[3/4] Parsing pages...\033[0m')
+    pages = [page for page in cv.pages if not page.skip_parsing]
+    total = total or len(pages)
+    for i, page in enumerate(pages, start=done + 1):
+        pid = page.id + 1
+        logging.info('(%d/%d) Page %d', i, total, pid)
+        try:
+            page.parse(**settings)
+        except Exception as e:
+            if not settings['debug'] and settings['ignore_page_error']:
+                logging.error('Ignore page %d due to parsing page error: %s', pid, e)
+            else:
+                raise ConversionException(f'Error when parsing page {pid}: {e}')
+        if progress:
+            progress("parse", i, total)
+    return done + len(pages)
+
+def _make_docx(cv, docx_path, settings, parsed, total, progress=None, direct=None, tuning=None, fragments=None):
+    # Writes the parsed pages, as they arrive, and the pages written straight from
+    # the PDF (direct: page index -> "scan" for a picture, "native" for the native
+    # engine, "cache" for a fragment of the pdf2word_pages.PageFragments) in page
+    # order into one DOCX; every other page is added to the page cache, if any.
+    # total is the number of selected pages. Returns the image optimisation
+    # statistics, if it is switched on.
+    tuning = resolve_tuning(tuning)
+    direct = direct or {}
+    logging.info('\033[1;36m[4/4] Creating pages...\033[0m')
+    pages = heapq.merge(parsed, sorted(direct), key=lambda page: page if isinstance(page, int) else page.id)
+    native = NativeWriter(cv.fitz_doc) if "native" in direct.values() else None
+
+    docx_file = Document()
+    written = 0
+    for i, page in enumerate(pages, start=1):
+        index, kind = (page, direct[page]) if isinstance(page, int) else (page.id, "pdf2docx")
+        pid = index + 1
+        logging.info('(%d/%d) Page %d', i, total, pid)
+        try:
+            if kind == "cache":
+                fragments.replay(docx_file, index)
+            else:
+                with fragments.record(docx_file, index) if fragments else nullcontext():
+                    _make_page(cv, docx_file, page, kind, native, tuning)
+        except Exception as e:
+            if not settings['debug'] and settings['ignore_page_error']:
+                logging.error('Ignore page %d due to making page error: %s', pid, e)
+            else:
+                raise MakedocxException(f'Error when make page {pid}: {e}')
+        written = i
+        if progress:
+            progress("render", i, total)
+    if not written:
+        raise ConversionException('No parsed pages. Please parse page first.')
+
+    images = None
+    if tuning["image_dpi"]:
+        images = optimize_images(docx_file, tuning["image_dpi"], tuning["image_quality"])
+        logging.info(f'Images: {images["bytesBefore"]} -> {images["bytesAfter"]} bytes '
+                     f'({images["deduplicated"]} duplicates removed)')
+    docx_file.save(docx_path)
+    return images
+
+def _make_page(cv, docx_file, page, kind, native, tuning):
+    if kind == "scan":
+        _make_scanned_page(docx_file, cv.fitz_doc[page], tuning)
+    elif kind == "native":
+        native.write_page(docx_file, cv.fitz_doc[page])
+    else:
+        page.make_docx(docx_file)
+
+def convert_pdf_to_word(pdf_path, docx_path, workers=None, shard_size=None, cache=None, page_range=None,
+                        tuning=None, window_size=None, page_cache=None):
+    try:
+        report = convert_document(pdf_path, docx_path, workers, shard_size, cache, page_range, tuning=tuning,
+                                  window_size=window_size, page_cache=page_cache)
+        result = {"success": True, "message": "Conversion completed successfully", "cache": report["cache"],
+                  "scannedPages": report["scannedPages"], "engines": report["engines"],
+                  "pageCache": report["pageCache"], "profile": profile_info(report["profile"])}
+        if report["images"]:
+            result["images"] = report["images"]
+        return result
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+# ---------------------------------------------------------------------------
+# In-memory API for callers that already hold the PDF: bytes or a file object
+# in, the DOCX into a file object out. PyMuPDF opens the PDF from memory and
+# python-docx saves into a BytesIO, so a small document never touches the
+# disk; a PDF over the spill threshold is converted through temporary files.
+# ---------------------------------------------------------------------------
+
+# PDFs larger than this many bytes are spooled to a temporary file and converted from there
+DEFAULT_SPILL_BYTES = int(os.environ.get('PDF2WORD_SPILL_BYTES', str(16 * 1024 * 1024)))
+
+def convert_stream(source, sink, page_range=None, tuning=None, cache=None, page_cache=None, workers=None,
+                   shard_size=None, window_size=None, progress=None, runner=None, spill_bytes=None):
+    # Converts source - bytes, a bytearray, a memoryview or a readable binary
+    # file object - and writes the DOCX to sink, a writable binary file object.
+    # The other arguments are those of convert_document(). Returns its report,
+    # plus "spilled": whether the conversion went through temporary files.
+    spill_bytes = DEFAULT_SPILL_BYTES if spill_bytes is None else spill_bytes
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        head, rest = source, None
+    else:
+        head, rest = source.read(spill_bytes + 1), source
+    if not len(head):
+        raise ConversionException('Empty PDF')
+    options = {"workers": workers, "shard_size": shard_size, "cache": cache, "page_range": page_range,
+               "progress": progress, "tuning": tuning, "window_size": window_size, "runner": runner,
+               "page_cache": page_cache}
+
+    if len(head) <= spill_bytes:
+        # PyMuPDF opens bytes and bytearrays, not views
+        pdf = head.tobytes() if isinstance(head, memoryview) else head
+        return dict(convert_document(pdf, sink, **options), spilled=False)
+
+    with tempfile.TemporaryDirectory(prefix='pdf2word-spill-') as directory:
+        pdf_path, docx_path = os.path.join(directory, 'input.pdf'), os.path.join(directory, 'output.docx')
+        with open(pdf_path, 'wb') as f:
+            f.write(head)
+            if rest is not None:
+                shutil.copyfileobj(rest, f)
+        report = convert_document(pdf_path, docx_path, **options)
+        with open(docx_path, 'rb') as f:
+            shutil.copyfileobj(f, sink)
+    return dict(report, spilled=True)
+
+def convert_bytes(source, **kwargs):
+    # convert_stream() into memory; returns (docx bytes, report)
+    sink = BytesIO()
+    report = convert_stream(source, sink, **kwargs)
+    return sink.getvalue(), report
+
+# ---------------------------------------------------------------------------
+# Server mode: a pool of pre-imported workers fed over a framed protocol.
+#
+# Every frame is one line of JSON. A job is {"id": ..., "input": ..., "output": ...}
+# and the reply is the same result object the one-shot CLI prints, with "id" echoed.
+# ---------------------------------------------------------------------------
+
+_server_cache = None
+_server_page_cache = None
+
+def page_cache_dir(cache_dir):
+    # The page cache lives next to the results in --cache-dir
+    return os.path.join(cache_dir, 'pages')
+
+def _worker_init(cache_dir=None):
+    global _server_cache, _server_page_cache
+    # The parent handles Ctrl+C / SIGTERM and tears the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cache_dir:
+        _server_cache = ResultCache(cache_dir)
+        _server_page_cache = PageCache(page_cache_dir(cache_dir))
+
+def run_job(job):
+    input_pdf = job.get("input")
+    output_docx = job.get("output")
+
+    if not input_pdf or not output_docx:
+        return {"success": False, "error": "Job requires 'input' and 'output' paths"}
+
+    if not os.path.exists(input_pdf):
+        return {"success": False, "error": f"Input file {input_pdf} does not exist"}
+
+    try:
+        page_range = parse_page_range(job.get("start"), job.get("end"), job.get("pages"))
+    except PageRangeError as e:
+        return {"success": False, "error": str(e)}
+
+    # Jobs may override any DEFAULT_TUNING setting by name
+    tuning = {key: job.get(key) for key in DEFAULT_TUNING}
+    return convert_pdf_to_word(input_pdf, output_docx, job.get("workers"), job.get("shard_size"), _server_cache,
+                               page_range, tuning, job.get("window_size"), _server_page_cache)
+
+def handle_frame(pool, line):
+    try:
+        job = json.loads(line)
+        if not isinstance(job, dict):
+            raise ValueError("frame must be a JSON object")
+    except ValueError as e:
+        return {"success": False, "error": f"Invalid job frame: {str(e)}"}
+
+    try:
+        result = pool.apply(run_job, (job,))
+    except Exception as e:
+        result = {"success": False, "error": f"Worker failed: {str(e)}"}
+
+    if "id" in job:
+        result["id"] = job["id"]
+    return result
+
+def create_pool(workers, max_jobs_per_worker, cache_dir=None):
+    return multiprocessing.Pool(
+        processes=workers,
+        initializer=_worker_init,
+        initargs=(cache_dir,),
+        maxtasksperchild=max_jobs_per_worker or None
+    )
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # A connection may carry any number of jobs; each is answered in order
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            result = handle_frame(self.server.pool, line)
+            self.wfile.write((json.dumps(result) + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+class _JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve_socket(socket_path, pool):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = _JobServer(socket_path, _JobHandler)
+    server.pool = pool
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+
+    print(json.dumps({"success": True, "message": f"pdf2word server listening on {socket_path}"}), flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+def serve_stdio(pool):
+    # Replies may come back out of order; callers match them on "id"
+    write_lock = threading.Lock()
+    pending = []
+
+    def reply(result):
+        with write_lock:
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        worker = threading.Thread(target=lambda l=line: reply(handle_frame(pool, l)), daemon=True)
+        worker.start()
+        pending.append(worker)
+        pending = [t for t in pending if t.is_alive()]
+
+    for worker in pending:
+        worker.join()
+
+def serve(socket_path=None, stdio=False, workers=DEFAULT_WORKERS,
+          max_jobs_per_worker=DEFAULT_MAX_JOBS_PER_WORKER, cache_dir=None):
+    pool = create_pool(workers, max_jobs_per_worker, cache_dir)
+    try:
+        if stdio:
+            serve_stdio(pool)
+        else:
+            serve_socket(socket_path or DEFAULT_SOCKET, pool)
+    finally:
+        pool.terminate()
+        pool.join()
+
+# ---------------------------------------------------------------------------
+# Batch mode: many files through one pool of pre-imported workers.
+# ---------------------------------------------------------------------------
+
+def batch_jobs(source, output_dir=None):
+    # source is a directory (every *.pdf in it) or a manifest file: a JSON list or
+    # JSON lines of {"input", "output", "start", "end", "pages"} objects, or one PDF
+    # path per line. Relative paths in a manifest are relative to the manifest.
+    if os.path.isdir(source):
+        entries = [{"input": os.path.join(source, name)} for name in sorted(os.listdir(source))
+                   if name.lower().endswith('.pdf')]
+        base_dir = source
+    else:
+        with open(source) as f:
+            text = f.read()
+        base_dir = os.path.dirname(os.path.abspath(source))
+        stripped = text.strip()
+        if stripped.startswith('['):
+            entries = json.loads(stripped)
+        else:
+            entries = []
+            for line in stripped.splitlines():
+                line = line.strip()
+                if line:
+                    entries.append(json.loads(line) if line.startswith('{') else {"input": line})
+
+    jobs = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"input": entry}
+        job = dict(entry)
+        job["input"] = os.path.join(base_dir, entry.get("input") or "")
+        output = entry.get("output")
+        if output:
+            job["output"] = os.path.join(output_dir or base_dir, output)
+        else:
+            name = os.path.splitext(os.path.basename(job["input"]))[0] + '.docx'
+            job["output"] = os.path.join(output_dir or os.path.dirname(job["input"]), name)
+        jobs.append(job)
+    return jobs
+
+def _run_batch_job(args):
+    index, job = args
+    try:
+        return index, run_job(job)
+    except Exception as e:
+        return index, {"success": False, "error": str(e)}
+
+def convert_batch(jobs, workers=DEFAULT_WORKERS, max_jobs_per_worker=DEFAULT_MAX_JOBS_PER_WORKER,
+                  cache_dir=None):
+    # Returns one result per job, in job order; a failed file does not stop the others
+    results = [None] * len(jobs)
+    if not jobs:
+        return results
+
+    for job in jobs:
+        if job.get("output"):
+            os.makedirs(os.path.dirname(os.path.abspath(job["output"])), exist_ok=True)
+
+    pool = create_pool(max(1, min(workers, len(jobs))), max_jobs_per_worker, cache_dir)
+    try:
+        for index, result in pool.imap_unordered(_run_batch_job, list(enumerate(jobs))):
+            results[index] = dict(result, input=jobs[index].get("input"), output=jobs[index].get("output"))
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+def summarize_batch(results):
+    succeeded = sum(1 for result in results if result["success"])
+    return {
+        "success": succeeded == len(results),
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }
+
+class _ArgumentParser(argparse.ArgumentParser):
+    # Keep the JSON error contract callers already parse
+    def error(self, message):
+        print(json.dumps({"success": False, "error": f"{USAGE} ({message})"}))
+        sys.exit(1)
+
+def parse_args(argv):
+    parser = _ArgumentParser(usage=f"{USAGE}\n       {SERVE_USAGE}\n       {BATCH_USAGE}\n       {INSPECT_USAGE}")
+    parser.add_argument('input_pdf', nargs='?')
+    parser.add_argument('output_docx', nargs='?')
+    parser.add_argument('--start', default=None, help='first page to convert (0-based)')
+    parser.add_argument('--end', default=None, help='stop before this page (default: last page)')
+    parser.add_argument('--pages', default=None, help='comma separated page indexes to convert (0-based)')
+    parser.add_argument('--serve', action='store_true', help='run as a long-lived conversion server')
+    parser.add_argument('--socket', default=None, help=f'Unix socket path (default {DEFAULT_SOCKET})')
+    parser.add_argument('--stdio', action='store_true', help='read jobs from stdin and write results to stdout')
+    parser.add_argument('--batch', default=None, metavar='SOURCE',
+                        help='convert every PDF in a directory or listed in a manifest file')
+    parser.add_argument('--output-dir', default=None, help='batch mode: write DOCX files here')
+    parser.add_argument('--inspect', action='store_true',
+                        help='report page, image and text structure and the predicted cost instead of converting')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='worker processes in server and batch mode')
+    parser.add_argument('--shard-workers', type=int, default=None,
+                        help=f'processes used to parse page shards in parallel (default {DEFAULT_SHARD_WORKERS})')
+    parser.add_argument('--shard-size', type=int, default=None,
+                        help=f'pages per parallel shard (default {DEFAULT_SHARD_SIZE})')
+    parser.add_argument('--window-size', type=int, default=None,
+                        help='pages parsed and written at a time to bound memory, 0 for all at once '
+                             f'(default {DEFAULT_WINDOW_SIZE})')
+    parser.add_argument('--cache-dir', default=None,
+                        help='reuse results for identical inputs, and converted pages for revised ones, '
+                             'from this directory')
+    parser.add_argument('--max-jobs-per-worker', type=int, default=DEFAULT_MAX_JOBS_PER_WORKER,
+                        help='recycle a worker after this many jobs (0 = never)')
+    parser.add_argument('--scan-dpi', type=int, default=None,
+                        help=f'embed image-only pages as pictures of at most this resolution, 0 to analyse '
+                             f'them like other pages (default {DEFAULT_TUNING["scan_dpi"]})')
+    parser.add_argument('--scan-quality', type=int, default=None,
+                        help=f'JPEG quality for rendered scanned pages (default {DEFAULT_TUNING["scan_quality"]})')
+    parser.add_argument('--image-dpi', type=int, default=None,
+                        help='downsample, re-encode and de-duplicate DOCX images for this resolution, 0 to keep '
+                             f'them as they are (default {DEFAULT_TUNING["image_dpi"]})')
+    parser.add_argument('--image-quality', type=int, default=None,
+                        help=f'JPEG quality for re-encoded images (default {DEFAULT_TUNING["image_quality"]})')
+    parser.add_argument('--profile', default=None, choices=list(PROFILES),
+                        help=f'parsing profile (default {DEFAULT_TUNING["profile"]})')
+    parser.add_argument('--engine', default=None, choices=ENGINES,
+                        help='"auto" to write simple text pages natively, "pdf2docx" for every page '
+                             f'(default {DEFAULT_TUNING["engine"]})')
+    return parser.parse_args(argv)
+
+def inspect(args):
+    from pdf2word_inspect import inspect_pdf
+
+    if not args.input_pdf:
+        print(json.dumps({"success": False, "error": INSPECT_USAGE}))
+        sys.exit(1)
+    if not os.path.exists(args.input_pdf):
+        print(json.dumps({"success": False, "error": f"Input file {args.input_pdf} does not exist"}))
+        sys.exit(1)
+
+    try:
+        info = inspect_pdf(args.input_pdf, parse_page_range(args.start, args.end, args.pages))
+    except ValueError as e:
+        # PageRangeError, possibly the one of the imported pdf2word module when run as a script
+        print(json.dumps({"success": False, "error": str(e)}))
+        sys.exit(1)
+    except Exception as e:
+        print(json.dumps({"success": False, "error": f"Could not inspect {args.input_pdf}: {str(e)}"}))
+        sys.exit(1)
+    print(json.dumps(dict({"success": True}, **info)))
+
 def main():
-    if len(sys.argv) != 3:
-        print(json.dumps({"success": False, "error": "Usage: python pdf2word.py <input.pdf> <output.docx>"}))
+    args = parse_args(sys.argv[1:])
+    tuning = {"scan_dpi": args.scan_dpi, "scan_quality": args.scan_quality,
+              "image_dpi": args.image_dpi, "image_quality": args.image_quality, "profile": args.profile,
+              "engine": args.engine}
+
+    if args.serve:
+        serve(args.socket, args.stdio, max(1, args.workers), args.max_jobs_per_worker, args.cache_dir)
+        return
+
+    if args.batch:
+        try:
+            jobs = batch_jobs(args.batch, args.output_dir)
+            # Settings given on the command line apply to every job that does not set its own
+            settings = dict(tuning, window_size=args.window_size)
+            jobs = [dict({key: value for key, value in settings.items() if value is not None}, **job) for job in jobs]
+        except (OSError, ValueError) as e:
+            print(json.dumps({"success": False, "error": f"Invalid batch source {args.batch}: {str(e)}"}))
+            sys.exit(1)
+        summary = summarize_batch(convert_batch(jobs, max(1, args.workers), args.max_jobs_per_worker, args.cache_dir))
+        print(json.dumps(summary))
+        if not summary["success"]:
+            sys.exit(1)
+        return
+
+    if args.inspect:
+        inspect(args)
+        return
+
+    if not args.input_pdf or not args.output_docx:
+        print(json.dumps({"success": False, "error": USAGE}))
         sys.exit(1)
-    
-    input_pdf = sys.argv[1]
-    output_docx = sys.argv[2]
-    
+
+    input_pdf = args.input_pdf
+    output_docx = args.output_docx
+
     if not os.path.exists(input_pdf):
         print(json.dumps({"success": False, "error": f"Input file {input_pdf} does not exist"}))
         sys.exit(1)
-    
-    result = convert_pdf_to_word(input_pdf, output_docx)
+
+    try:
+        page_range = parse_page_range(args.start, args.end, args.pages)
+    except PageRangeError as e:
+        print(json.dumps({"success": False, "error": str(e)}))
+        sys.exit(1)
+
+    cache = ResultCache(args.cache_dir) if args.cache_dir else None
+    page_cache = PageCache(page_cache_dir(args.cache_dir)) if args.cache_dir else None
+    result = convert_pdf_to_word(input_pdf, output_docx, args.shard_workers, args.shard_size, cache, page_range,
+                                 tuning, args.window_size, page_cache)
     print(json.dumps(result))
-    
+
     if not result["success"]:
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
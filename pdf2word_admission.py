@@ -0,0 +1,169 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+import fitz
+
+# Admission control in front of the conversion call.
+#
+# Every process on the node shares one ledger file (guarded by flock) listing the
+# conversions in flight and the requests waiting for a slot. A request is admitted
+# when a slot is free and its estimated memory fits the node budget; otherwise it
+# waits briefly in a bounded queue and is turned away with a 503 so the load
+# balancer can send it elsewhere.
+
+DEFAULT_MAX_CONCURRENT = int(os.environ.get('PDF2WORD_MAX_CONCURRENT', '2'))
+DEFAULT_MEMORY_BUDGET_MB = int(os.environ.get('PDF2WORD_MEMORY_BUDGET_MB', '1536'))
+DEFAULT_MAX_WAITING = int(os.environ.get('PDF2WORD_MAX_WAITING', '4'))
+DEFAULT_MAX_WAIT = float(os.environ.get('PDF2WORD_ADMISSION_WAIT', '10'))
+DEFAULT_RETRY_AFTER = int(os.environ.get('PDF2WORD_RETRY_AFTER', '5'))
+DEFAULT_STATE_PATH = os.environ.get('PDF2WORD_ADMISSION_STATE',
+                                    os.path.join(tempfile.gettempdir(), 'pdf2word-admission.json'))
+
+# Rough peak RSS model for one pdf2docx conversion
+BASE_MEMORY_MB = 60
+MEMORY_PER_PAGE_MB = float(os.environ.get('PDF2WORD_MB_PER_PAGE', '6'))
+MEMORY_PER_INPUT_MB = 3
+POLL_INTERVAL = 0.1
+
+class Overloaded(Exception):
+    def __init__(self, message, retry_after=DEFAULT_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def estimate_cost(pdf_path, page_range=None):
+    # Page count comes from the xref only; no page is parsed here.
+    # Only pages in the requested range count towards the estimate.
+    pages = 1
+    try:
+        with fitz.open(pdf_path) as doc:
+            pages = len(doc)
+        if page_range and page_range.get("pages"):
+            pages = len([page for page in page_range["pages"] if page < pages])
+        elif page_range:
+            pages = len(range(pages)[page_range["start"]:page_range["end"]])
+        pages = max(1, pages)
+    except Exception as e:
+        logging.warning(f'Could not count pages for admission: {str(e)}')
+    input_mb = os.path.getsize(pdf_path) / (1024 * 1024)
+    memory_mb = BASE_MEMORY_MB + pages * MEMORY_PER_PAGE_MB + input_mb * MEMORY_PER_INPUT_MB
+    return {"pages": pages, "memoryMb": round(memory_mb, 1)}
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class AdmissionController:
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                 max_waiting=DEFAULT_MAX_WAITING, max_wait=DEFAULT_MAX_WAIT,
+                 retry_after=DEFAULT_RETRY_AFTER, state_path=DEFAULT_STATE_PATH):
+        self.max_concurrent = max_concurrent
+        self.memory_budget_mb = memory_budget_mb
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.state_path = state_path
+        self.rejected = 0
+
+    @contextmanager
+    def _ledger(self):
+        with open(self.state_path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                try:
+                    ledger = json.loads(raw) if raw else {}
+                except ValueError:
+                    ledger = {}
+                ledger.setdefault("running", {})
+                ledger.setdefault("waiting", {})
+                # Drop entries left behind by killed workers
+                for section in ("running", "waiting"):
+                    for token, entry in list(ledger[section].items()):
+                        if not _pid_alive(entry["pid"]):
+                            del ledger[section][token]
+
+                yield ledger
+
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(ledger))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _fits(self, ledger, cost):
+        running = ledger["running"].values()
+        if not running:
+            # An idle node always takes the job, even one larger than the budget
+            return True
+        if len(running) >= self.max_concurrent:
+            return False
+        in_flight = sum(entry["memoryMb"] for entry in running)
+        return in_flight + cost["memoryMb"] <= self.memory_budget_mb
+
+    def _reject(self, message):
+        self.rejected += 1
+        return Overloaded(message, self.retry_after)
+
+    @contextmanager
+    def admit(self, pdf_path, page_range=None):
+        cost = estimate_cost(pdf_path, page_range)
+        token = uuid.uuid4().hex
+        entry = {"pid": os.getpid(), "pages": cost["pages"], "memoryMb": cost["memoryMb"]}
+        queued_at = time.monotonic()
+        deadline = queued_at + self.max_wait
+        waiting = False
+
+        try:
+            while True:
+                with self._ledger() as ledger:
+                    if self._fits(ledger, cost):
+                        ledger["waiting"].pop(token, None)
+                        ledger["running"][token] = dict(entry, since=time.time())
+                        waiting = False
+                        break
+                    if not waiting:
+                        if len(ledger["waiting"]) >= self.max_waiting:
+                            raise self._reject("Server busy: conversion queue is full")
+                        ledger["waiting"][token] = entry
+                        waiting = True
+                if time.monotonic() >= deadline:
+                    raise self._reject("Server busy: timed out waiting for a conversion slot")
+                time.sleep(POLL_INTERVAL)
+        finally:
+            if waiting:
+                with self._ledger() as ledger:
+                    ledger["waiting"].pop(token, None)
+
+        cost["waitSeconds"] = time.monotonic() - queued_at
+        try:
+            yield cost
+        finally:
+            with self._ledger() as ledger:
+                ledger["running"].pop(token, None)
+
+    def stats(self):
+        with self._ledger() as ledger:
+            running = list(ledger["running"].values())
+            waiting = len(ledger["waiting"])
+        return {
+            "running": len(running),
+            "waiting": waiting,
+            "memoryInFlightMb": round(sum(entry["memoryMb"] for entry in running), 1),
+            "maxConcurrent": self.max_concurrent,
+            "memoryBudgetMb": self.memory_budget_mb,
+            "maxWaiting": self.max_waiting,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import fitz
+
+# Conversion benchmark harness.
+#
+#   python pdf2word_bench.py generate --corpus-dir bench-corpus
+#   python pdf2word_bench.py run --corpus-dir bench-corpus --target library --concurrency 1,2,4 -o results.json
+#   python pdf2word_bench.py run --target flask --app flask-app.py -o results.json
+#   python pdf2word_bench.py run --target memory --concurrency 1 -o memory.json
+#   python pdf2word_bench.py run --profile fast,balanced,accurate --concurrency 1 -o profiles.json
+#   python pdf2word_bench.py compare baseline.json results.json
+#   python pdf2word_bench.py fit results.json -o cost-model.json
+#   python pdf2word_bench.py check --documents mixed-40
+#
+# The corpus is generated from a fixed seed, so every commit is measured against
+# byte-identical inputs. Results are JSON: latency percentiles, pages/sec, CPU time
+# and peak RSS per document and concurrency level. check converts documents with
+# and without the page cache and fails unless the DOCX bodies are identical.
+
+DEFAULT_CORPUS_DIR = os.environ.get('PDF2WORD_BENCH_CORPUS', 'bench-corpus')
+DEFAULT_SEED = 20240501
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 56
+
+WORDS = ("conversion document layout paragraph table column image render page engine "
+         "throughput latency memory process worker shard cache stream budget request "
+         "response format section heading figure caption value total summary report").split()
+
+# name -> (kind, pages)
+CORPUS = {
+    "text-10": ("text", 10),
+    "table-10": ("table", 10),
+    "image-10": ("image", 10),
+    "mixed-40": ("mixed", 40),
+    "text-300": ("text", 300),
+    "scan-10": ("scan", 10),
+}
+
+def _sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text.capitalize() + '.'
+
+def _text_page(page, rng):
+    y = MARGIN
+    page.insert_text((MARGIN, y), _sentence(rng, 5).rstrip('.'), fontsize=16, fontname='hebo')
+    y += 30
+    while y < PAGE_HEIGHT - MARGIN - 60:
+        paragraph = ' '.join(_sentence(rng, rng.randint(8, 16)) for _ in range(rng.randint(3, 6)))
+        rect = fitz.Rect(MARGIN, y, PAGE_WIDTH - MARGIN, y + 120)
+        spare = page.insert_textbox(rect, paragraph, fontsize=10, fontname='helv')
+        y = rect.y1 - max(spare, 0) + 12
+
+def _table_page(page, rng):
+    rows, cols = rng.randint(18, 26), rng.randint(4, 6)
+    page.insert_text((MARGIN, MARGIN), _sentence(rng, 4).rstrip('.'), fontsize=14, fontname='hebo')
+    top, row_height = MARGIN + 20, 24
+    col_width = (PAGE_WIDTH - 2 * MARGIN) / cols
+    for r in range(rows + 1):
+        y = top + r * row_height
+        page.draw_line((MARGIN, y), (PAGE_WIDTH - MARGIN, y), width=0.5)
+    for c in range(cols + 1):
+        x = MARGIN + c * col_width
+        page.draw_line((x, top), (x, top + rows * row_height), width=0.5)
+    for r in range(rows):
+        for c in range(cols):
+            value = rng.choice(WORDS) if r == 0 or c == 0 else f'{rng.uniform(0, 10000):.2f}'
+            page.insert_text((MARGIN + c * col_width + 4, top + r * row_height + 16), value,
+                             fontsize=9, fontname='hebo' if r == 0 else 'helv')
+
+def _image(rng, width, height):
+    # Smooth gradient with noise: compresses like a photo rather than a flat fill
+    base = [rng.randint(0, 255) for _ in range(3)]
+    samples = bytearray(width * height * 3)
+    for y in range(height):
+        for x in range(width):
+            i = (y * width + x) * 3
+            noise = rng.randint(-12, 12)
+            samples[i] = (base[0] + x + noise) % 256
+            samples[i + 1] = (base[1] + y + noise) % 256
+            samples[i + 2] = (base[2] + (x + y) // 2 + noise) % 256
+    ppm = f'P6 {width} {height} 255\n'.encode('ascii') + bytes(samples)
+    return fitz.Pixmap(ppm).tobytes('jpeg')
+
+def _image_page(page, rng):
+    page.insert_text((MARGIN, MARGIN), _sentence(rng, 6), fontsize=12, fontname='helv')
+    y = MARGIN + 16
+    for _ in range(2):
+        rect = fitz.Rect(MARGIN, y, PAGE_WIDTH - MARGIN, y + 300)
+        page.insert_image(rect, stream=_image(rng, 240, 150))
+        page.insert_text((MARGIN, rect.y1 + 14), _sentence(rng, 8), fontsize=9, fontname='helv')
+        y = rect.y1 + 40
+
+def _scan_page(page, rng):
+    # One page-sized image and no text, like a scanner's output (about 75 dpi)
+    page.insert_image(page.rect, stream=_image(rng, 620, 877))
+
+def _columns_page(page, rng):
+    # A full-width heading and introduction over two columns of text, which
+    # pdf2docx writes as a single-column section followed by a two-column one
+    page.insert_text((MARGIN, MARGIN), _sentence(rng, 5).rstrip('.'), fontsize=16, fontname='hebo')
+    intro = ' '.join(_sentence(rng, 14) for _ in range(3))
+    page.insert_textbox(fitz.Rect(MARGIN, MARGIN + 14, PAGE_WIDTH - MARGIN, MARGIN + 80), intro,
+                        fontsize=10, fontname='helv')
+    gutter = 24
+    width = (PAGE_WIDTH - 2 * MARGIN - gutter) / 2
+    for column in range(2):
+        x = MARGIN + column * (width + gutter)
+        text = ' '.join(_sentence(rng, 14) for _ in range(9))
+        page.insert_textbox(fitz.Rect(x, MARGIN + 100, x + width, PAGE_HEIGHT - MARGIN), text,
+                            fontsize=10, fontname='helv')
+
+def _mixed_page(page, rng, index):
+    (_text_page, _table_page, _image_page)[index % 3](page, rng)
+
+def generate_document(path, kind, pages, seed=DEFAULT_SEED):
+    rng = random.Random(f'{seed}:{kind}:{pages}')
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        if kind == 'text':
+            _text_page(page, rng)
+        elif kind == 'table':
+            _table_page(page, rng)
+        elif kind == 'image':
+            _image_page(page, rng)
+        elif kind == 'scan':
+            _scan_page(page, rng)
+        elif kind == 'columns':
+            _columns_page(page, rng)
+        else:
+            _mixed_page(page, rng, i)
+    # No timestamps or random ids, so the bytes only depend on the seed
+    doc.set_metadata({"producer": "pdf2word_bench", "creator": "pdf2word_bench"})
+    doc.save(path, garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+
+def _sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def generate_corpus(corpus_dir, names=None, seed=DEFAULT_SEED):
+    os.makedirs(corpus_dir, exist_ok=True)
+    manifest = []
+    for name in names or CORPUS:
+        kind, pages = CORPUS[name]
+        path = os.path.join(corpus_dir, f'{name}.pdf')
+        if not os.path.exists(path):
+            generate_document(path, kind, pages, seed)
+        manifest.append({"name": name, "kind": kind, "pages": pages, "path": path,
+                         "bytes": os.path.getsize(path), "sha256": _sha256(path)})
+    with open(os.path.join(corpus_dir, 'manifest.json'), 'w') as f:
+        json.dump({"seed": seed, "documents": manifest}, f, indent=2)
+    return manifest
+
+def load_corpus(corpus_dir, names=None):
+    manifest_path = os.path.join(corpus_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return generate_corpus(corpus_dir, names)
+    with open(manifest_path) as f:
+        documents = json.load(f)["documents"]
+    if names:
+        documents = [d for d in documents if d["name"] in names]
+    return documents
+
+# ---------------------------------------------------------------------------
+# Measurements
+# ---------------------------------------------------------------------------
+
+def _cpu_seconds(usage):
+    return usage.ru_utime + usage.ru_stime
+
+def _maxrss_mb(usage):
+    # Linux reports kilobytes, macOS bytes
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def percentile(values, pct):
+    # Nearest-rank percentile
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.4999)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def summarize(latencies, pages, wall_seconds, cpu_seconds, peak_rss_mb, errors):
+    converted_pages = pages * len(latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "latency": {
+            "min": min(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else None,
+            "mean": sum(latencies) / len(latencies) if latencies else None
+        },
+        "wallSeconds": wall_seconds,
+        "pagesPerSecond": converted_pages / wall_seconds if wall_seconds else None,
+        "cpuSeconds": cpu_seconds,
+        "peakRssMb": peak_rss_mb
+    }
+
+# Library target: every conversion runs in a fresh process, so CPU time and
+# peak RSS belong to that conversion alone (shard workers included). The memory
+# target is the same through convert_bytes(), with the PDF already read.
+
+def _library_job(args):
+    pdf_path, workers, profile, in_memory = args
+    logging.disable(logging.WARNING)
+    from pdf2word import convert_bytes, convert_pdf_to_word
+
+    output_path = os.path.join(os.path.dirname(os.path.abspath(pdf_path)), f'.bench-{uuid.uuid4().hex}.docx')
+    if in_memory:
+        with open(pdf_path, 'rb') as f:
+            data = f.read()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    try:
+        if in_memory:
+            try:
+                convert_bytes(data, workers=workers, tuning={"profile": profile})
+                result = {"success": True}
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+        else:
+            result = convert_pdf_to_word(pdf_path, output_path, workers=workers, tuning={"profile": profile})
+    finally:
+        latency = time.perf_counter() - start
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "success": result["success"],
+        "latency": latency,
+        "cpuSeconds": (_cpu_seconds(after) - _cpu_seconds(before)
+                       + _cpu_seconds(children_after) - _cpu_seconds(children_before)),
+        "peakRssMb": max(_maxrss_mb(after), _maxrss_mb(children_after))
+    }
+
+def bench_library(document, concurrency, iterations, workers=None, profile=None, in_memory=False):
+    jobs = [(document["path"], workers, profile, in_memory)] * (concurrency * iterations)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=concurrency, max_tasks_per_child=1) as pool:
+        results = list(pool.map(_library_job, jobs))
+    wall_seconds = time.perf_counter() - start
+
+    ok = [r for r in results if r["success"]]
+    return summarize([r["latency"] for r in ok], document["pages"], wall_seconds,
+                     sum(r["cpuSeconds"] for r in results),
+                     max((r["peakRssMb"] for r in results), default=None),
+                     len(results) - len(ok))
+
+# Flask target: requests go either to a running server (--url) or to the app
+# loaded in this process through the Flask test client.
+
+def _multipart(path, fields=None):
+    boundary = uuid.uuid4().hex
+    with open(path, 'rb') as f:
+        data = f.read()
+    body = ''.join(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                   for name, value in (fields or {}).items() if value is not None).encode('utf-8')
+    body += (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+             f'filename="{os.path.basename(path)}"\r\nContent-Type: application/pdf\r\n\r\n').encode('utf-8')
+    body += data + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+def load_flask_app(app_path):
+    # PDF2WORD_CACHE=off so repeated requests are really converted
+    os.environ['PDF2WORD_CACHE'] = 'off'
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    spec = importlib.util.spec_from_file_location('pdf2word_bench_app', app_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    logging.disable(logging.WARNING)
+    return module.app
+
+def bench_flask(document, concurrency, iterations, app=None, url=None, profile=None):
+    body, content_type = _multipart(document["path"], {"profile": profile})
+    local = threading.local()
+
+    def send(_):
+        start = time.perf_counter()
+        if url:
+            request = urllib.request.Request(url.rstrip('/') + '/convert', data=body, method='POST',
+                                             headers={'Content-Type': content_type})
+            try:
+                with urllib.request.urlopen(request, timeout=600) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except OSError:
+                status = None
+        else:
+            if not hasattr(local, 'client'):
+                local.client = app.test_client()
+            response = local.client.post('/convert', data=body, content_type=content_type)
+            response.get_data()
+            status = response.status_code
+        return status == 200, time.perf_counter() - start
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, range(concurrency * iterations)))
+    wall_seconds = time.perf_counter() - start
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    # Server-side CPU and memory are only visible when the app runs in-process
+    cpu_seconds = peak_rss_mb = None
+    if not url:
+        cpu_seconds = (_cpu_seconds(usage_after) - _cpu_seconds(usage_before)
+                       + _cpu_seconds(children_after) - _cpu_seconds(children_before))
+        peak_rss_mb = max(_maxrss_mb(usage_after), _maxrss_mb(children_after))
+
+    latencies = [latency for ok, latency in results if ok]
+    return summarize(latencies, document["pages"], wall_seconds, cpu_seconds, peak_rss_mb,
+                     len(results) - len(latencies))
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(corpus_dir, target, concurrency_levels, iterations, names=None, workers=None, app_path=None, url=None,
+        profiles=None):
+    # profiles are measured in turn for each document and concurrency level, so
+    # they are compared under the same machine conditions
+    documents = load_corpus(corpus_dir, names)
+    app = load_flask_app(app_path) if target == 'flask' and not url else None
+
+    from pdf2word import DEFAULT_TUNING, ENGINE_VERSION
+    results = []
+    for document in documents:
+        for concurrency in concurrency_levels:
+            for profile in profiles or [None]:
+                if target in ('library', 'memory'):
+                    summary = bench_library(document, concurrency, iterations, workers, profile, target == 'memory')
+                else:
+                    summary = bench_flask(document, concurrency, iterations, app, url, profile)
+                results.append(dict({"target": target, "document": document["name"], "pages": document["pages"],
+                                     "concurrency": concurrency, "profile": profile}, **summary))
+                print(f'{target} {document["name"]} x{concurrency} {profile or "default"}: '
+                      f'p50 {_fmt(summary["latency"]["p50"])}s, {_fmt(summary["pagesPerSecond"])} pages/s, '
+                      f'{summary["errors"]} errors', file=sys.stderr)
+
+    return {
+        "commit": _git_commit(),
+        "engine": ENGINE_VERSION,
+        # PDF2WORD_ENGINE of the conversions (library and memory targets)
+        "conversionEngine": DEFAULT_TUNING["engine"],
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "iterations": iterations,
+        "shardWorkers": workers,
+        "profiles": profiles,
+        "url": url,
+        "results": results
+    }
+
+def _fmt(value):
+    return '-' if value is None else f'{value:.2f}'
+
+def compare(baseline, current):
+    # Relative change per (target, document, concurrency, profile); negative latency change is better
+    rows = []
+    previous = {(r["target"], r["document"], r["concurrency"], r.get("profile")): r for r in baseline["results"]}
+    for result in current["results"]:
+        before = previous.get((result["target"], result["document"], result["concurrency"], result.get("profile")))
+        if not before:
+            continue
+        row = {"target": result["target"], "document": result["document"], "concurrency": result["concurrency"],
+               "profile": result.get("profile")}
+        for name, old, new in (("p50", before["latency"]["p50"], result["latency"]["p50"]),
+                               ("p95", before["latency"]["p95"], result["latency"]["p95"]),
+                               ("pagesPerSecond", before["pagesPerSecond"], result["pagesPerSecond"]),
+                               ("peakRssMb", before["peakRssMb"], result["peakRssMb"])):
+            row[name] = round((new - old) / old * 100, 1) if old and new is not None else None
+        rows.append(row)
+    return {"baseline": baseline.get("commit"), "current": current.get("commit"), "changePercent": rows}
+
+def fit(result_sets, corpus_dir):
+    # Fits the pdf2word_inspect cost model to single-client library runs: p50 latency
+    # and peak RSS against the structure counts of each corpus document
+    from pdf2word_inspect import fit_cost_model, inspect_pdf
+
+    documents = {document["name"]: document for document in load_corpus(corpus_dir)}
+    samples = []
+    for results in result_sets:
+        for result in results["results"]:
+            document = documents.get(result["document"])
+            if (result["target"] != 'library' or result["concurrency"] != 1 or not document
+                    or result["latency"]["p50"] is None):
+                continue
+            samples.append((inspect_pdf(document["path"]),
+                            {"seconds": result["latency"]["p50"], "memoryMb": result["peakRssMb"]}))
+    if not samples:
+        raise SystemExit('No single-client library results for documents in the corpus')
+    return dict(fit_cost_model(samples), commits=sorted({r["commit"] for r in result_sets if r.get("commit")}))
+
+# Page cache check: a document converted from scratch, with every other page
+# already cached (cached pages between converted ones) and entirely from the
+# cache must give the same document.xml, apart from relationship and drawing ids.
+
+# Always checked, besides the corpus documents asked for
+CHECK_DOCUMENTS = {"columns-3": ("columns", 3)}
+
+def _document_xml(docx_path):
+    # Compared byte for byte: cached pages get the same relationship and drawing ids
+    with zipfile.ZipFile(docx_path) as archive:
+        return archive.read('word/document.xml')
+
+def check_page_cache(documents, profile=None):
+    logging.disable(logging.WARNING)
+    from pdf2word import convert_document, parse_page_range
+    from pdf2word_cache import PageCache
+
+    tuning = {"profile": profile}
+    results = []
+    for document in documents:
+        with tempfile.TemporaryDirectory(prefix='pdf2word-check-') as directory:
+            cache = PageCache(os.path.join(directory, 'pages'))
+            fresh = os.path.join(directory, 'fresh.docx')
+            convert_document(document["path"], fresh, tuning=tuning)
+            expected = _document_xml(fresh)
+
+            every_other = parse_page_range(pages=list(range(0, document["pages"], 2)))
+            convert_document(document["path"], os.path.join(directory, 'partial.docx'), tuning=tuning,
+                             page_range=every_other, page_cache=cache)
+            result = {"document": document["name"], "pages": document["pages"]}
+            for run_name in ("mixed", "cached"):
+                output = os.path.join(directory, f'{run_name}.docx')
+                report = convert_document(document["path"], output, tuning=tuning, page_cache=cache)
+                result[run_name] = {"pageCache": report["pageCache"], "identical": _document_xml(output) == expected}
+            results.append(result)
+        print(f'check {document["name"]}: mixed {"ok" if result["mixed"]["identical"] else "DIFFERENT"}, '
+              f'cached {"ok" if result["cached"]["identical"] else "DIFFERENT"}', file=sys.stderr)
+    return {
+        "commit": _git_commit(),
+        "passed": all(r["mixed"]["identical"] and r["cached"]["identical"] for r in results),
+        "results": results
+    }
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='PDF to Word conversion benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help='write the synthetic PDF corpus')
+    generate.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR)
+    generate.add_argument('--seed', type=int, default=DEFAULT_SEED)
+
+    bench = commands.add_parser('run', help='run the benchmarks')
+    bench.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR)
+    bench.add_argument('--target', choices=('library', 'memory', 'flask'), default='library')
+    bench.add_argument('--concurrency', default='1,2,4', help='comma separated concurrency levels')
+    bench.add_argument('--iterations', type=int, default=2, help='requests per concurrent client')
+    bench.add_argument('--documents', help='comma separated corpus names (default: all)')
+    bench.add_argument('--shard-workers', type=int, help='library and memory targets: shard workers per conversion')
+    bench.add_argument('--app', default='flask-app.py', help='flask target: app module to load in-process')
+    bench.add_argument('--url', help='flask target: base URL of a running server instead of --app')
+    bench.add_argument('--profile', help='comma separated conversion profiles (default: the deployment default)')
+    bench.add_argument('-o', '--output', help='write results JSON here (default: stdout)')
+
+    diff = commands.add_parser('compare', help='compare two result files')
+    diff.add_argument('baseline')
+    diff.add_argument('current')
+
+    model = commands.add_parser('fit', help='fit the inspection cost model to result files')
+    model.add_argument('results', nargs='+')
+    model.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR)
+    model.add_argument('-o', '--output', help='write the model JSON here (default: stdout)')
+
+    check = commands.add_parser('check', help='compare conversions with and without the page cache')
+    check.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR)
+    check.add_argument('--documents', help='comma separated corpus names to check as well (default: none)')
+    check.add_argument('--profile', help='conversion profile (default: the deployment default)')
+    check.add_argument('-o', '--output', help='write results JSON here (default: stdout)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+
+    if args.command == 'generate':
+        output = {"documents": generate_corpus(args.corpus_dir, seed=args.seed)}
+    elif args.command == 'compare':
+        with open(args.baseline) as f, open(args.current) as g:
+            output = compare(json.load(f), json.load(g))
+    elif args.command == 'fit':
+        result_sets = []
+        for path in args.results:
+            with open(path) as f:
+                result_sets.append(json.load(f))
+        output = fit(result_sets, args.corpus_dir)
+    elif args.command == 'check':
+        names = args.documents.split(',') if args.documents else []
+        documents = load_corpus(args.corpus_dir, names) if names else []
+        with tempfile.TemporaryDirectory(prefix='pdf2word-check-') as directory:
+            for name, (kind, pages) in CHECK_DOCUMENTS.items():
+                path = os.path.join(directory, f'{name}.pdf')
+                generate_document(path, kind, pages)
+                documents.append({"name": name, "kind": kind, "pages": pages, "path": path})
+            output = check_page_cache(documents, args.profile)
+    else:
+        names = args.documents.split(',') if args.documents else None
+        levels = [int(level) for level in args.concurrency.split(',')]
+        output = run(args.corpus_dir, args.target, levels, args.iterations, names,
+                     args.shard_workers, args.app, args.url,
+                     args.profile.split(',') if args.profile else None)
+
+    text = json.dumps(output, indent=2)
+    if getattr(args, 'output', None):
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.command == 'check' and not output["passed"]:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+# Content-addressed store for converted documents.
+#
+# Entries are keyed by the SHA-256 of the input bytes plus the conversion options,
+# live as plain files under the cache directory and are evicted least recently
+# used first once the directory grows past its size budget. Recency is the file
+# mtime, so several gunicorn workers can share one directory. The same store
+# holds the converted pages of the per-page cache in a directory of its own.
+
+DEFAULT_CACHE_DIR = os.environ.get('PDF2WORD_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'pdf2word-cache'))
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get('PDF2WORD_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Converted pages of documents that missed the result cache, see PageCache
+DEFAULT_PAGE_CACHE_DIR = os.environ.get('PDF2WORD_PAGE_CACHE_DIR', os.path.join(DEFAULT_CACHE_DIR, 'pages'))
+DEFAULT_PAGE_CACHE_MAX_BYTES = int(os.environ.get('PDF2WORD_PAGE_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def source_digest(source):
+    # SHA-256 of a file given by path, or of the bytes themselves
+    if isinstance(source, (str, os.PathLike)):
+        return file_digest(source)
+    return hashlib.sha256(source).hexdigest()
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ResultCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES, suffix='.docx'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "errors": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source, options=None):
+        # source is the input's path or its bytes
+        options_blob = json.dumps(options or {}, sort_keys=True, default=str)
+        return hashlib.sha256(f"{source_digest(source)}:{options_blob}".encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def fetch(self, key, dest_path):
+        # Materialise a cached entry at dest_path, or write it to dest_path when
+        # that is a writable file object; returns False on a miss
+        if not isinstance(dest_path, (str, os.PathLike)):
+            data = self.read(key)
+            self._count("misses" if data is None else "hits")
+            if data is not None:
+                dest_path.write(data)
+            return data is not None
+        entry = self._path(key)
+        try:
+            os.utime(entry)  # mark as recently used
+            if os.path.exists(dest_path):
+                os.unlink(dest_path)
+            try:
+                os.link(entry, dest_path)
+            except OSError:
+                shutil.copyfile(entry, dest_path)
+        except FileNotFoundError:
+            self._count("misses")
+            return False
+        except OSError as e:
+            logging.warning(f'Result cache read failed for {key}: {str(e)}')
+            self._count("errors")
+            return False
+
+        self._count("hits")
+        return True
+
+    def read(self, key):
+        # The bytes of an entry, or None; lookups are counted by the caller
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+            os.utime(self._path(key))  # mark as recently used
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.warning(f'Result cache read failed for {key}: {str(e)}')
+            self._count("errors")
+            return None
+        return data
+
+    def store(self, key, src_path):
+        # src_path may also be the bytes to store
+        if isinstance(src_path, (bytes, bytearray, memoryview)):
+            return self.write(key, src_path)
+
+        def copy(out):
+            with open(src_path, 'rb') as src:
+                shutil.copyfileobj(src, out)
+        return self._write(key, copy)
+
+    def write(self, key, data):
+        return self._write(key, lambda out: out.write(data))
+
+    def _write(self, key, fill):
+        # Write through a temp file in the cache directory so readers never see partial entries
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    fill(out)
+                os.replace(temp_path, self._path(key))
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError as e:
+            logging.warning(f'Result cache write failed for {key}: {str(e)}')
+            self._count("errors")
+            return False
+
+        self._count("stores")
+        self.evict()
+        return True
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+
+        # Oldest first until the directory fits the budget again
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                self._count("evictions")
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        counters.update({
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "maxBytes": self.max_bytes,
+            "hitRatio": round(counters["hits"] / lookups, 4) if lookups else None
+        })
+        return counters
+
+class PageCache:
+    # Per-page DOCX fragments (see pdf2word_pages), keyed by a fingerprint of each
+    # page, so a revised document only converts the pages that changed. Lookups
+    # happen in whichever process converts; convert_document() tallies each
+    # conversion's hits, misses and stores here, in the process that owns the cache.
+    def __init__(self, directory=DEFAULT_PAGE_CACHE_DIR, max_bytes=DEFAULT_PAGE_CACHE_MAX_BYTES):
+        self.store = ResultCache(directory, max_bytes, suffix='.page')
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._tally = {"hits": 0, "misses": 0, "stores": 0}
+
+    def read(self, key):
+        return self.store.read(key)
+
+    def write(self, key, data):
+        return self.store.write(key, data)
+
+    def tally(self, hits, misses, stores):
+        with self._lock:
+            self._tally["hits"] += hits
+            self._tally["misses"] += misses
+            self._tally["stores"] += stores
+
+    def stats(self):
+        counters = self.store.stats()
+        with self._lock:
+            counters.update(self._tally)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hitRatio"] = round(counters["hits"] / lookups, 4) if lookups else None
+        return counters
+
+def get_default_cache():
+    # PDF2WORD_CACHE=off disables caching; a cache that cannot be created is skipped
+    if os.environ.get('PDF2WORD_CACHE', 'on').lower() in ('off', '0', 'false'):
+        return None
+    try:
+        return ResultCache()
+    except OSError as e:
+        logging.warning(f'Result cache disabled: {str(e)}')
+        return None
+
+def get_default_page_cache():
+    # PDF2WORD_PAGE_CACHE=off (or PDF2WORD_CACHE=off) disables per-page caching
+    switches = (os.environ.get(name, 'on').lower() for name in ('PDF2WORD_CACHE', 'PDF2WORD_PAGE_CACHE'))
+    if any(switch in ('off', '0', 'false') for switch in switches):
+        return None
+    try:
+        return PageCache()
+    except OSError as e:
+        logging.warning(f'Page cache disabled: {str(e)}')
+        return None
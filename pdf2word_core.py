@@ -0,0 +1,316 @@
+import logging
+import os
+from contextlib import contextmanager
+
+from pdf2word import PROFILES, PageRangeError, ProfileError, convert_document, parse_page_range, profile_info, resolve_tuning
+from pdf2word_admission import Overloaded
+from pdf2word_inspect import inspect_pdf
+from pdf2word_office import CONVERSIONS, MEDIA_TYPES, OfficeBusy, OfficeConversionFailed, OfficeUnavailable, sniff_format
+from pdf2word_scratch import WorkspacePool
+from pdf2word_streams import decode_json_base64_field, spool_to_file
+from pdf2word_supervisor import JobLimitExceeded, JobLimits, JobSupervisor
+import pdf2word_warmup
+
+# The conversion path shared by every entry point.
+#
+# The Flask apps, the ASGI app and the Azure function only translate their
+# request and response objects; receiving the PDF, choosing options, admission,
+# caching, instrumentation and cleanup all happen here, so a change to the
+# conversion path reaches every deployment at once.
+
+# HTTP status for each job limit; "cancelled" is nginx's "client closed request",
+# logged although nobody is left to read it
+LIMIT_STATUS = {"deadline": 504, "cpu": 504, "memory": 413, "cancelled": 499}
+
+# Room a memory-backed workspace must have for a conversion's output, as a
+# multiple of what it already holds; without it the workspace moves to disk first
+OUTPUT_ROOM_FACTOR = 2
+
+class ConversionError(Exception):
+    # Carries the HTTP status (and headers) the adapters answer with, and extra
+    # members for the JSON error body
+    def __init__(self, message, status=500, headers=None, details=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+        self.details = details or {}
+
+    def __reduce__(self):
+        # Keep status, headers and details when raised in a pool process
+        return (ConversionError, (str(self), self.status, self.headers, self.details))
+
+    def body(self):
+        return dict(self.details, error=str(self))
+
+class ConversionOptions:
+    # Deployment-wide settings; each request may only narrow the page range and
+    # pick a profile. tuning overrides pdf2word.DEFAULT_TUNING (scanned page resolution etc.),
+    # window_size pdf2word.DEFAULT_WINDOW_SIZE
+    def __init__(self, workers=None, shard_size=None, page_range=None, tuning=None, window_size=None):
+        self.workers = workers
+        self.shard_size = shard_size
+        self.page_range = page_range
+        self.tuning = tuning
+        self.window_size = window_size
+
+    def for_request(self, start=None, end=None, pages=None, profile=None):
+        if start is None and end is None and pages is None and profile in (None, ''):
+            return self
+        page_range, tuning = self.page_range, self.tuning
+        try:
+            if start is not None or end is not None or pages is not None:
+                page_range = parse_page_range(start, end, pages)
+            if profile not in (None, ''):
+                tuning = dict(tuning or {}, profile=profile)
+                resolve_tuning(tuning)
+        except (PageRangeError, ProfileError) as e:
+            raise ConversionError(str(e), 400)
+        return ConversionOptions(self.workers, self.shard_size, page_range, tuning, self.window_size)
+
+class ConversionService:
+    # limits (pdf2word_supervisor.JobLimits) apply to every conversion; JobLimits(0, 0, 0)
+    # converts in the calling process. page_cache (pdf2word_cache.PageCache) reuses
+    # the converted pages of earlier versions of a document. office (pdf2word_office.OfficePool)
+    # serves the other formats; its instances start after the fork.
+    def __init__(self, cache=None, admission=None, options=None, workspaces=None, limits=None, page_cache=None,
+                 office=None):
+        self.cache = cache
+        self.page_cache = page_cache
+        self.office = office
+        if office is not None:
+            pdf2word_warmup.after_fork(office.start)
+        self.admission = admission
+        self.options = options or ConversionOptions()
+        self.workspaces = workspaces or WorkspacePool()
+        self.limits = JobLimits() if limits is None else limits
+
+    def workspace(self):
+        return self.workspaces.workspace()
+
+    def receive_file(self, stream, workspace, request_metrics=None):
+        # Spool an uploaded PDF to disk in chunks; returns its size
+        with self.workspaces.create(workspace, 'input.pdf') as f, _stage(request_metrics, 'upload'):
+            size = spool_to_file(stream, f)
+        if request_metrics:
+            request_metrics.bytes_in = size
+        if not size:
+            raise ConversionError("Empty file", 400)
+        return size
+
+    def receive_base64_json(self, stream, workspace, field='fileData', request_metrics=None):
+        # Decode the base64 member of a JSON body straight to disk; returns (data, size)
+        # where data holds the other top-level members
+        with self.workspaces.create(workspace, 'input.pdf') as f, _stage(request_metrics, 'decode'):
+            try:
+                data, size = decode_json_base64_field(stream, field, f)
+            except ValueError as e:
+                raise ConversionError(str(e), 400)
+        if request_metrics:
+            request_metrics.bytes_in = size
+        if field not in data:
+            raise ConversionError(f"No {field} provided", 400)
+        if not size:
+            raise ConversionError("Empty file data", 400)
+        return data, size
+
+    def convert(self, workspace, options=None, request_metrics=None, progress=None, started=None, cancelled=None):
+        # Convert workspace.input_path into workspace.output_path; returns the
+        # convert_document() report plus the output size. started(cost) is called
+        # once the conversion has a slot (cost is None without admission control).
+        # cancelled, if given, is polled during the conversion and stops it when
+        # it returns True, e.g. when the client has disconnected.
+        options = options or self.options
+        self._make_output_room(workspace)
+        try:
+            with self._admit(workspace, options) as cost:
+                if request_metrics and cost:
+                    request_metrics.queue_wait = cost["waitSeconds"]
+                if started:
+                    started(cost)
+                report = self._convert(workspace, options, request_metrics, progress, cancelled)
+        except Overloaded as e:
+            logging.warning(f'Conversion rejected: {str(e)}')
+            if request_metrics:
+                request_metrics.failed_stage = 'admission'
+            raise ConversionError(str(e), 503, {"Retry-After": str(e.retry_after)})
+        except JobLimitExceeded as e:
+            logging.warning(f'Conversion stopped: {str(e)}')
+            if request_metrics:
+                request_metrics.failed_stage = e.limit
+            raise ConversionError(str(e), LIMIT_STATUS[e.limit], details={
+                "code": "cancelled" if e.limit == "cancelled" else "limit_exceeded",
+                "limit": e.limit,
+                "maximum": e.maximum,
+                "elapsed": e.elapsed,
+                "progress": e.progress
+            })
+        except ConversionError:
+            raise
+        except PageRangeError as e:
+            raise ConversionError(str(e), 400)
+        except Exception as e:
+            logging.error(f'Conversion failed: {str(e)}')
+            raise ConversionError(f"Conversion failed: {str(e)}", 500)
+        return report
+
+    def _make_output_room(self, workspace):
+        size = workspace.size()
+        self.workspaces.make_room(workspace, size + size * OUTPUT_ROOM_FACTOR)
+
+    @contextmanager
+    def _admit(self, workspace, options):
+        if self.admission is None:
+            yield None
+        else:
+            with self.admission.admit(workspace.input_path, options.page_range) as cost:
+                yield cost
+
+    def _convert(self, workspace, options, request_metrics, progress, cancelled=None):
+        logging.info(f'Converting PDF ({os.path.getsize(workspace.input_path)} bytes) to DOCX')
+        supervisor = JobSupervisor(self.limits, cancelled)
+        with _stage(request_metrics, 'convert'):
+            report = convert_document(workspace.input_path, workspace.output_path, options.workers,
+                                      options.shard_size, self.cache, options.page_range, progress, options.tuning,
+                                      options.window_size, supervisor.run, self.page_cache)
+        if request_metrics:
+            request_metrics.record_conversion(report)
+
+        output_size = os.path.getsize(workspace.output_path) if os.path.exists(workspace.output_path) else 0
+        if not output_size:
+            raise Exception("Conversion produced empty output")
+        if request_metrics:
+            request_metrics.bytes_out = output_size
+        logging.info(f'Conversion successful (cache {report["cache"]}). Output size: {output_size} bytes')
+        return dict(report, outputSize=output_size)
+
+    def convert_office(self, workspace, target, request_metrics=None):
+        # Convert the uploaded document in workspace.input_path (DOCX, DOC, ODT or RTF to
+        # PDF, or PDF to RTF) with the office pool; returns a report with the output path
+        if self.office is None:
+            raise ConversionError(f"Conversion to {target} is not enabled on this server", 501)
+        source = sniff_format(workspace.input_path)
+        if (source, target) not in CONVERSIONS:
+            supported = ", ".join(f"{a} to {b}" for a, b in CONVERSIONS)
+            raise ConversionError(f"Cannot convert {source or 'this file'} to {target} (supported: {supported})", 400)
+
+        self._make_output_room(workspace)
+        # LibreOffice goes by the extension as well as the content
+        input_path = workspace.path(f'input.{source}')
+        os.replace(workspace.input_path, input_path)
+        output_path = workspace.path(f'output.{target}')
+        logging.info(f'Converting {source.upper()} ({os.path.getsize(input_path)} bytes) to {target.upper()}')
+        try:
+            with _stage(request_metrics, 'office'):
+                result = self.office.convert(input_path, output_path, source, target)
+        except (OfficeBusy, OfficeUnavailable) as e:
+            logging.warning(f'Office conversion rejected: {str(e)}')
+            if e.retry_after is None:
+                # LibreOffice is not installed here; asking again will not help
+                raise ConversionError(f"Conversion to {target} is not available on this server: {str(e)}", 501)
+            raise ConversionError(str(e), 503, {"Retry-After": str(e.retry_after)})
+        except JobLimitExceeded as e:
+            logging.warning(f'Office conversion stopped: {str(e)}')
+            if request_metrics:
+                request_metrics.failed_stage = e.limit
+            raise ConversionError(str(e), LIMIT_STATUS[e.limit], details={
+                "code": "limit_exceeded",
+                "limit": e.limit,
+                "maximum": e.maximum,
+                "elapsed": e.elapsed
+            })
+        except OfficeConversionFailed as e:
+            logging.error(f'Office conversion failed: {str(e)}')
+            raise ConversionError(f"Conversion failed: {str(e)}", 500)
+
+        output_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+        if not output_size:
+            raise ConversionError("Conversion failed: Conversion produced empty output", 500)
+        if request_metrics:
+            request_metrics.bytes_out = output_size
+        logging.info(f'Office conversion successful in {result["seconds"]}s. Output size: {output_size} bytes')
+        return dict(result, source=source, target=target, outputPath=output_path, outputSize=output_size,
+                    mediaType=MEDIA_TYPES[target])
+
+    def inspect(self, workspace, options=None, request_metrics=None):
+        # Structure-only look at workspace.input_path with the predicted conversion cost
+        options = options or self.options
+        try:
+            with _stage(request_metrics, 'inspect'):
+                return inspect_pdf(workspace.input_path, options.page_range)
+        except PageRangeError as e:
+            raise ConversionError(str(e), 400)
+        except Exception as e:
+            logging.warning(f'Inspection failed: {str(e)}')
+            raise ConversionError(f"Invalid PDF: {str(e)}", 400)
+
+    def health(self):
+        info = {
+            "status": "healthy",
+            "service": "PDF to Word conversion",
+            "version": "1.0.0",
+            "cache": self.cache.stats() if self.cache else None,
+            "pageCache": self.page_cache.stats() if self.page_cache else None,
+            "office": self.office.stats() if self.office else None,
+            "scratch": self.workspaces.stats(),
+            "profiles": {name: profile_info(name) for name in PROFILES}
+        }
+        if self.admission is not None:
+            info["admission"] = self.admission.stats()
+        if pdf2word_warmup.startup_report is not None:
+            info["startup"] = pdf2word_warmup.startup_report
+        return info
+
+def image_headers(report):
+    # Response headers for the image optimisation stage, when it ran
+    images = report.get("images")
+    if not images:
+        return {}
+    return {
+        "X-Image-Bytes-Before": str(images["bytesBefore"]),
+        "X-Image-Bytes-After": str(images["bytesAfter"]),
+        "X-Image-Seconds": str(images["seconds"])
+    }
+
+def profile_headers(report):
+    # Response headers naming the profile and its benchmark pages per second
+    info = profile_info(report["profile"])
+    headers = {"X-Conversion-Profile": info["name"]}
+    if info["benchmark"]:
+        headers["X-Profile-Pages-Per-Second"] = ", ".join(f"{document}={value}"
+                                                           for document, value in info["benchmark"].items())
+    return headers
+
+def engine_headers(report):
+    # Response header with the number of pages each engine wrote
+    engines = report.get("engines")
+    if not engines:
+        return {}
+    return {"X-Engine-Pages": ", ".join(f"{engine}={len(pages)}" for engine, pages in engines.items())}
+
+def page_cache_headers(report):
+    # Response header with the page cache hits, misses and hit ratio of this conversion
+    page_cache = report.get("pageCache")
+    if not page_cache:
+        return {}
+    return {"X-Page-Cache": f'hits={page_cache["hits"]}, misses={page_cache["misses"]}, '
+                            f'ratio={page_cache["hitRatio"]}'}
+
+def report_headers(report):
+    # Every response header describing how the document was produced
+    return dict(image_headers(report), **profile_headers(report), **engine_headers(report),
+                **page_cache_headers(report))
+
+def office_headers(report):
+    # Response headers for a conversion done by the office pool
+    return {
+        "X-Office-Conversion": f'{report["source"]}->{report["target"]}',
+        "X-Office-Seconds": str(report["seconds"])
+    }
+
+@contextmanager
+def _stage(request_metrics, name):
+    if request_metrics is None:
+        yield
+    else:
+        with request_metrics.stage(name):
+            yield
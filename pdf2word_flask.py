@@ -0,0 +1,160 @@
+import os
+import select
+import socket
+
+from flask import Response, g, jsonify, request, send_file
+
+from pdf2word import profile_info
+from pdf2word_core import ConversionError, office_headers, report_headers
+from pdf2word_metrics import PROMETHEUS_CONTENT_TYPE, instrument, registry
+from pdf2word_streams import iter_base64_json
+
+# Flask adapter over ConversionService: /health, /metrics, /inspect, /convert and
+# optionally /convert-base64, with the request and response formats the apps
+# have always used. /convert with format=pdf or format=rtf hands the upload to the
+# office pool instead.
+
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+def error_response(e):
+    return jsonify(e.body()), e.status, e.headers
+
+def client_disconnected():
+    # For ConversionService.convert(cancelled=...): whether the client of the current
+    # request has closed its connection. Only gunicorn exposes the socket; None elsewhere.
+    sock = request.environ.get('gunicorn.socket')
+    if sock is None:
+        return None
+
+    def disconnected():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            # Readable with nothing to read means the peer has closed
+            return bool(readable) and not sock.recv(1, socket.MSG_PEEK)
+        except ValueError:
+            # TLS sockets cannot peek
+            return False
+        except OSError:
+            return True
+    return disconnected
+
+def register_conversion_routes(app, service, base64_endpoint=False, health_info=None):
+    # health_info, if given, returns extra fields for /health
+    @app.route('/health', methods=['GET'])
+    def health():
+        info = service.health()
+        if health_info:
+            info.update(health_info())
+        return jsonify(info)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return registry.render(), 200, {'Content-Type': PROMETHEUS_CONTENT_TYPE}
+
+    @app.route('/inspect', methods=['POST'])
+    @instrument('inspect')
+    def inspect():
+        # Same upload as /convert; answers with the document structure and predicted cost
+        try:
+            if 'file' not in request.files:
+                return jsonify({"error": "No file provided"}), 400
+
+            with service.workspace() as workspace:
+                options = service.options.for_request(request.values.get('start'), request.values.get('end'),
+                                                      request.values.get('pages'))
+                service.receive_file(request.files['file'].stream, workspace, g.request_metrics)
+                return jsonify(service.inspect(workspace, options, g.request_metrics))
+
+        except ConversionError as e:
+            return error_response(e)
+
+        except Exception as e:
+            return jsonify({"error": f"Request processing failed: {str(e)}"}), 500
+
+    @app.route('/convert', methods=['POST'])
+    @instrument('convert')
+    def convert():
+        try:
+            # Handle file upload
+            if 'file' not in request.files:
+                return jsonify({"error": "No file provided"}), 400
+
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({"error": "No file selected"}), 400
+
+            filename = file.filename or "document.pdf"
+            target = (request.values.get('format') or 'docx').lower()
+
+            with service.workspace() as workspace:
+                if target != 'docx':
+                    service.receive_file(file.stream, workspace, g.request_metrics)
+                    report = service.convert_office(workspace, target, g.request_metrics)
+                    response = send_file(
+                        report["outputPath"],
+                        as_attachment=True,
+                        download_name=f'{os.path.splitext(filename)[0]}.{target}',
+                        mimetype=report["mediaType"]
+                    )
+                    response.headers.update(office_headers(report))
+                    return response
+
+                # Optional page selection and profile (form fields or query string)
+                options = service.options.for_request(request.values.get('start'), request.values.get('end'),
+                                                      request.values.get('pages'), request.values.get('profile'))
+                service.receive_file(file.stream, workspace, g.request_metrics)
+                report = service.convert(workspace, options, g.request_metrics, cancelled=client_disconnected())
+
+                # The open file outlives the workspace cleanup
+                response = send_file(
+                    workspace.output_path,
+                    as_attachment=True,
+                    download_name=filename.replace('.pdf', '.docx'),
+                    mimetype=DOCX_MIMETYPE
+                )
+                response.headers.update(report_headers(report))
+                return response
+
+        except ConversionError as e:
+            return error_response(e)
+
+        except Exception as e:
+            return jsonify({"error": f"Request processing failed: {str(e)}"}), 500
+
+    if not base64_endpoint:
+        return
+
+    @app.route('/convert-base64', methods=['POST'])
+    @instrument('convert-base64')
+    def convert_base64():
+        try:
+            if not request.is_json:
+                return jsonify({"error": "No fileData provided"}), 400
+
+            with service.workspace() as workspace:
+                data, pdf_size = service.receive_base64_json(request.stream, workspace, 'fileData', g.request_metrics)
+                filename = data.get('fileName', 'document.pdf')
+                options = service.options.for_request(data.get('start'), data.get('end'), data.get('pages'),
+                                                      data.get('profile'))
+                report = service.convert(workspace, options, g.request_metrics, cancelled=client_disconnected())
+
+                # Stream the base64 encoded result from disk
+                return Response(
+                    iter_base64_json(open(workspace.output_path, 'rb'), "data", {
+                        "success": True,
+                        "originalSize": pdf_size,
+                        "convertedSize": report["outputSize"],
+                        "images": report.get("images"),
+                        "engines": report.get("engines"),
+                        "pageCache": report.get("pageCache"),
+                        "profile": profile_info(report["profile"]),
+                        "filename": filename.replace('.pdf', '.docx')
+                    }),
+                    mimetype='application/json'
+                )
+
+        except ConversionError as e:
+            return error_response(e)
+
+        except Exception as e:
+            return jsonify({"error": f"Request processing failed: {str(e)}"}), 500
@@ -0,0 +1,124 @@
+import hashlib
+import math
+import posixpath
+import time
+
+import fitz
+from docx.opc.constants import CONTENT_TYPE as CT
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.oxml.ns import qn
+
+# Image optimisation for the finished DOCX, before it is saved.
+#
+# pdf2docx stores every image at its source resolution, mostly as lossless PNG.
+# Each image part is scaled down to the target DPI at the largest size the
+# document shows it, re-encoded as PNG (transparency, few colours: drawings,
+# screenshots) or JPEG (photos and scans), and identical results are stored once.
+# An image is only replaced when the new encoding is smaller.
+
+EMU_PER_INCH = 914400
+# Images with at most this many distinct colours stay lossless
+PNG_MAX_COLORS = 256
+# Pixels looked at to count colours (Pixmap.color_count() scans every pixel)
+COLOR_SAMPLE = 4096
+# Scale down only when the image is this much larger than needed
+DOWNSAMPLE_THRESHOLD = 1.1
+
+FORMATS = {"png": CT.PNG, "jpeg": CT.JPEG}
+
+def _displayed_sizes(document_part):
+    # rId -> largest (width, height) in EMU the document draws it at
+    sizes = {}
+    for blip in document_part.element.iter(qn('a:blip')):
+        rId = blip.get(qn('r:embed'))
+        for drawing in blip.iterancestors(qn('wp:inline'), qn('wp:anchor')):
+            extent = drawing.find(qn('wp:extent'))
+            if extent is not None:
+                width, height = int(extent.get('cx')), int(extent.get('cy'))
+                previous = sizes.get(rId, (0, 0))
+                sizes[rId] = (max(previous[0], width), max(previous[1], height))
+            break
+    return sizes
+
+def _few_colors(pix, limit=PNG_MAX_COLORS):
+    samples = pix.samples_mv
+    step = pix.n * max(1, pix.width * pix.height // COLOR_SAMPLE)
+    colors = set()
+    for offset in range(0, len(samples), step):
+        colors.add(bytes(samples[offset:offset + pix.n]))
+        if len(colors) > limit:
+            return False
+    return True
+
+def optimize_image(blob, size, dpi, quality):
+    # Returns (data, format, downsampled), or None to keep the original bytes
+    try:
+        pix = fitz.Pixmap(blob)
+    except Exception:
+        return None
+    if pix.colorspace is None:
+        return None
+    if pix.colorspace.n not in (1, 3):
+        # CMYK and the like: JPEG/PNG in Word want grey or RGB
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+
+    downsampled = False
+    if size and size[0] and size[1]:
+        width = max(1, math.ceil(size[0] / EMU_PER_INCH * dpi))
+        height = max(1, math.ceil(size[1] / EMU_PER_INCH * dpi))
+        if pix.width > width * DOWNSAMPLE_THRESHOLD and pix.height > height * DOWNSAMPLE_THRESHOLD:
+            pix = fitz.Pixmap(pix, width, height, None)
+            downsampled = True
+    if not downsampled and blob[:2] == b'\xff\xd8':
+        # Already a JPEG at a sensible resolution: re-encoding would only lose quality
+        return None
+
+    if pix.alpha or _few_colors(pix):
+        data, image_format = pix.tobytes('png'), "png"
+    else:
+        data, image_format = pix.tobytes('jpeg', jpg_quality=quality), "jpeg"
+    if len(data) >= len(blob):
+        return None
+    return data, image_format, downsampled
+
+def optimize_images(docx_file, dpi, quality):
+    # Rewrites the image parts of a python-docx Document in place; returns statistics
+    start = time.perf_counter()
+    document_part = docx_file.part
+    sizes = _displayed_sizes(document_part)
+
+    # Each part is optimised once, for the largest place it is shown
+    usages = {}
+    for rId, rel in document_part.rels.items():
+        if rel.reltype == RT.IMAGE and not rel.is_external:
+            usages.setdefault(rel.target_part, []).append(rId)
+
+    stats = {"images": len(usages), "downsampled": 0, "recompressed": 0, "deduplicated": 0,
+             "bytesBefore": sum(len(part.blob) for part in usages), "bytesAfter": 0}
+    stored = {}
+    for part, rIds in usages.items():
+        size = (max((sizes.get(rId, (0, 0))[0] for rId in rIds), default=0),
+                max((sizes.get(rId, (0, 0))[1] for rId in rIds), default=0))
+        optimized = optimize_image(part.blob, size, dpi, quality)
+        if optimized:
+            data, image_format, downsampled = optimized
+            stem = posixpath.splitext(part.partname)[0]
+            part._blob = data
+            part._content_type = FORMATS[image_format]
+            part.partname = PackURI(f'{stem}.{image_format}')
+            stats["recompressed"] += 1
+            stats["downsampled"] += downsampled
+
+        # Point every use of an identical image at one part; the others are not saved
+        digest = hashlib.sha1(part.blob).hexdigest()
+        if digest in stored:
+            for rId in rIds:
+                document_part.rels[rId]._target = stored[digest]
+            stats["deduplicated"] += 1
+        else:
+            stored[digest] = part
+            stats["bytesAfter"] += len(part.blob)
+
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
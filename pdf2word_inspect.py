@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import re
+
+import fitz
+import numpy
+
+from pdf2word import DEFAULT_TUNING, is_scanned_page, select_pages
+
+# Pre-flight inspection: what a PDF will cost to convert, without converting it.
+#
+# Only the document structure is read through PyMuPDF (page tree, resources and the
+# raw content streams); no page is laid out. The counts feed a linear cost model
+# whose coefficients are fitted from benchmark runs:
+#
+#   python pdf2word_bench.py run --concurrency 1 -o results.json
+#   python pdf2word_bench.py fit results.json -o cost-model.json
+#
+# and loaded from PDF2WORD_COST_MODEL when set.
+
+DEFAULT_COST_MODEL_PATH = os.environ.get('PDF2WORD_COST_MODEL')
+
+# Model features, in the order of the coefficients. Scanned pages skip layout
+# analysis (pdf2word.is_scanned_page), so they are counted apart from "pages".
+FEATURES = ("pages", "scannedPages", "textOps", "pathOps", "imageMb")
+
+# Fitted with `pdf2word_bench.py fit` on the seeded corpus (1 CPU, Python 3.11)
+DEFAULT_COST_MODEL = {
+    "source": "builtin",
+    "seconds": {"intercept": 0.0, "pages": 0.138, "scannedPages": 0.0177, "textOps": 0.0, "pathOps": 0.043,
+                "imageMb": 0.0},
+    "memoryMb": {"intercept": 84.75, "pages": 0.0, "scannedPages": 0.0, "textOps": 0.049, "pathOps": 0.0,
+                 "imageMb": 4.79}
+}
+
+# Text showing and path construction operators in a content stream
+TEXT_OPERATORS = re.compile(rb'(?<![\w.])(?:Tj|TJ|\'|")(?=\s|$)')
+PATH_OPERATORS = re.compile(rb'(?<![\w.])(?:re|l|c|v|y)(?=\s|$)')
+
+_cost_model = None
+
+def load_cost_model(path=None):
+    # The model file named by PDF2WORD_COST_MODEL, or the built-in coefficients
+    global _cost_model
+    path = path or DEFAULT_COST_MODEL_PATH
+    if path is None:
+        return DEFAULT_COST_MODEL
+    if _cost_model is None or _cost_model["source"] != path:
+        try:
+            with open(path) as f:
+                model = json.load(f)
+            _cost_model = dict(model, source=path)
+        except (OSError, ValueError) as e:
+            logging.warning(f'Could not load cost model {path}: {str(e)}')
+            return DEFAULT_COST_MODEL
+    return _cost_model
+
+def predict(features, model=None):
+    model = model or load_cost_model()
+    estimate = {}
+    for target in ("seconds", "memoryMb"):
+        coefficients = model[target]
+        value = coefficients["intercept"] + sum(coefficients[name] * features[name] for name in FEATURES)
+        estimate[target] = round(max(value, 0.0), 3 if target == "seconds" else 1)
+    estimate["model"] = model["source"]
+    return estimate
+
+def _image_bytes(doc, xref):
+    # The declared stream length avoids reading the image data
+    kind, value = doc.xref_get_key(xref, "Length")
+    if kind == "int":
+        return int(value)
+    return len(doc.xref_stream_raw(xref))
+
+def inspect_pdf(pdf_path, page_range=None, model=None):
+    # Raises PageRangeError for a range the document does not have
+    with fitz.open(pdf_path) as doc:
+        info = {
+            "pages": len(doc),
+            "fileSize": os.path.getsize(pdf_path),
+            "encrypted": bool(doc.is_encrypted),
+            "needsPassword": bool(doc.needs_pass)
+        }
+        if doc.needs_pass:
+            # Nothing past the trailer can be read, so there is nothing to estimate
+            info.update(selectedPages=None, kind="encrypted", estimate=None)
+            return info
+
+        page_indexes = select_pages(len(doc), page_range)
+        counts = {"text": 0, "scanned": 0, "empty": 0}
+        text_ops = path_ops = 0
+        images = {}
+        for index in page_indexes:
+            page = doc[index]
+            page_images = page.get_images(full=True)
+            for image in page_images:
+                if image[0] not in images:
+                    images[image[0]] = _image_bytes(doc, image[0])
+
+            contents = page.read_contents()
+            page_text_ops = len(TEXT_OPERATORS.findall(contents))
+            text_ops += page_text_ops
+            path_ops += len(PATH_OPERATORS.findall(contents))
+
+            if is_scanned_page(page):
+                counts["scanned"] += 1
+            elif page_text_ops:
+                counts["text"] += 1
+            else:
+                counts["empty"] += 1
+
+    image_bytes = sum(images.values())
+    if not counts["scanned"]:
+        kind = "text"
+    elif not counts["text"]:
+        kind = "scanned"
+    else:
+        kind = "mixed"
+
+    info.update({
+        "selectedPages": len(page_indexes),
+        "kind": kind,
+        "textPages": counts["text"],
+        "scannedPages": counts["scanned"],
+        "emptyPages": counts["empty"],
+        "images": len(images),
+        "imageBytes": image_bytes,
+        "textOperators": text_ops,
+        "pathOperators": path_ops
+    })
+    info["estimate"] = predict(features_of(info), model)
+    return info
+
+def features_of(info):
+    # With the scanned page path switched off, scans are analysed like any page
+    scanned = info["scannedPages"] if DEFAULT_TUNING["scan_dpi"] else 0
+    return {"pages": info["selectedPages"] - scanned, "scannedPages": scanned,
+            "textOps": info["textOperators"], "pathOps": info["pathOperators"],
+            "imageMb": info["imageBytes"] / (1024 * 1024)}
+
+def fit_cost_model(samples):
+    # samples: [(inspect_pdf() result, {"seconds": ..., "memoryMb": ...}), ...]
+    # Least squares with coefficients kept non-negative: a feature whose fitted
+    # weight goes negative is dropped and the rest are fitted again.
+    rows = numpy.array([[1.0] + [features_of(info)[name] for name in FEATURES] for info, _ in samples])
+    model = {"samples": len(samples)}
+    for target in ("seconds", "memoryMb"):
+        observed = numpy.array([measured[target] for _, measured in samples], dtype=float)
+        active = list(range(rows.shape[1]))
+        weights = numpy.zeros(rows.shape[1])
+        while active:
+            solution = numpy.linalg.lstsq(rows[:, active], observed, rcond=None)[0]
+            weights[:] = 0.0
+            weights[active] = solution
+            negative = [column for column, weight in zip(active, solution) if weight < 0]
+            if not negative:
+                break
+            active = [column for column in active if column not in negative]
+        model[target] = dict(zip(("intercept",) + FEATURES, (float(weight) for weight in weights)))
+    return model
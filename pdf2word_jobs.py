@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+
+from flask import Blueprint, jsonify, request, send_file, url_for
+
+from pdf2word_cache import get_default_cache, get_default_page_cache
+from pdf2word_core import ConversionError, ConversionOptions, ConversionService
+from pdf2word_progress import ProgressEstimate
+from pdf2word_scratch import Workspace
+from pdf2word_streams import decode_json_base64_field, spool_to_file
+from pdf2word_supervisor import JobLimits
+
+# Asynchronous conversion jobs.
+#
+# Jobs live in a SQLite database next to their input and output files, so any
+# number of web processes (and standalone `python pdf2word_jobs.py` workers)
+# on one node share a single bounded queue without outside services. Workers
+# claim jobs with an atomic UPDATE and run the conversion through a
+# ConversionService, whose supervised child process reports page progress.
+# A running job carries a heartbeat; one whose worker has stopped beating is
+# requeued (or failed, for a streamed conversion, whose upload is gone).
+
+DEFAULT_JOBS_DIR = os.environ.get('PDF2WORD_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'pdf2word-jobs'))
+DEFAULT_MAX_QUEUED = int(os.environ.get('PDF2WORD_JOBS_MAX_QUEUED', '100'))
+DEFAULT_JOB_WORKERS = int(os.environ.get('PDF2WORD_JOB_WORKERS', '1'))
+# Finished jobs and their files are removed after this many seconds
+DEFAULT_JOB_TTL = int(os.environ.get('PDF2WORD_JOB_TTL', '3600'))
+# Wall-clock seconds a job may convert before it is stopped (0 = no deadline);
+# synchronous requests have their own, shorter PDF2WORD_CONVERT_DEADLINE
+DEFAULT_JOB_TIMEOUT = int(os.environ.get('PDF2WORD_JOB_TIMEOUT', '900'))
+MAX_ATTEMPTS = 2
+POLL_INTERVAL = 1.0
+# Seconds between heartbeats of a running job, and without one before the job
+# is assumed lost with its worker
+HEARTBEAT_INTERVAL = 10
+STALE_AFTER = 60
+
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    input_size INTEGER NOT NULL,
+    output_size INTEGER,
+    progress REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    cache TEXT,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    options TEXT,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state_created ON jobs (state, created_at);
+"""
+
+# Columns added since the first schema, for databases created before them
+ADDED_COLUMNS = (("options", "TEXT"), ("heartbeat", "REAL"))
+
+class QueueFullError(Exception):
+    pass
+
+class JobStore:
+    def __init__(self, directory=DEFAULT_JOBS_DIR, max_queued=DEFAULT_MAX_QUEUED):
+        self.directory = directory
+        self.max_queued = max_queued
+        os.makedirs(directory, exist_ok=True)
+        self.db_path = os.path.join(directory, 'jobs.db')
+        with closing(self._connect()) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+            existing = {row["name"] for row in db.execute('PRAGMA table_info(jobs)')}
+            for name, kind in ADDED_COLUMNS:
+                if name not in existing:
+                    try:
+                        db.execute(f'ALTER TABLE jobs ADD COLUMN {name} {kind}')
+                    except sqlite3.OperationalError:
+                        # Added by another process meanwhile
+                        pass
+
+    def _connect(self):
+        # One short-lived connection per operation keeps this safe across threads and processes
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def input_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), 'input.pdf')
+
+    def output_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), 'output.docx')
+
+    def reserve(self):
+        # Create the job directory before the upload is spooled into it
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.job_dir(job_id))
+        return job_id
+
+    def discard(self, job_id):
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def enqueue(self, job_id, filename, input_size, options=None):
+        # options: the page range and tuning of the job's ConversionOptions
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            queued = db.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                db.execute('ROLLBACK')
+                raise QueueFullError(f"Job queue is full ({queued} jobs waiting)")
+            db.execute(
+                "INSERT INTO jobs (id, state, filename, input_size, options, created_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, filename, input_size, json.dumps(options) if options else None, time.time())
+            )
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    def begin(self, job_id, filename, input_size, worker):
+        # Record a conversion that runs outside the queue (e.g. a streamed request)
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute(
+                "INSERT INTO jobs (id, state, filename, input_size, worker, attempts, created_at, started_at, "
+                "heartbeat) VALUES (?, 'running', ?, ?, ?, 1, ?, ?, ?)",
+                (job_id, filename, input_size, worker, now, now, now)
+            )
+
+    def get(self, job_id):
+        with closing(self._connect()) as db:
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            job["queue_position"] = None
+            if job["state"] == 'queued':
+                job["queue_position"] = db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND created_at <= ?",
+                    (job["created_at"],)
+                ).fetchone()[0]
+            return job
+
+    def claim(self, worker):
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute(
+                "SELECT id FROM jobs WHERE state = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                db.execute('COMMIT')
+                return None
+            now = time.time()
+            db.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, started_at = ?, heartbeat = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker, now, now, row["id"])
+            )
+            db.execute('COMMIT')
+            return row["id"]
+        finally:
+            db.close()
+
+    def update(self, job_id, **fields):
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        with closing(self._connect()) as db:
+            db.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+
+    def finish(self, job_id, output_size, cache):
+        self.update(job_id, state='done', progress=1.0, output_size=output_size,
+                    cache=cache, finished_at=time.time())
+
+    def fail(self, job_id, error):
+        self.update(job_id, state='failed', error=error, finished_at=time.time())
+
+    @contextmanager
+    def heartbeat(self, job_id, interval=HEARTBEAT_INTERVAL):
+        # Marks the job alive every interval seconds while the block runs
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.update(job_id, heartbeat=time.time())
+                except sqlite3.Error as e:
+                    logging.warning(f'Job {job_id}: heartbeat failed: {str(e)}')
+
+        thread = threading.Thread(target=beat, name=f'pdf2word-heartbeat-{job_id}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def requeue_stale(self, stale_after=STALE_AFTER):
+        # Running jobs without a heartbeat for stale_after seconds lost their worker.
+        # Queued jobs are retried up to MAX_ATTEMPTS; streamed conversions, which no
+        # runner owns and whose upload is gone, are failed.
+        now = time.time()
+        cutoff = now - stale_after
+        stale = "state = 'running' AND COALESCE(heartbeat, started_at) < ?"
+        with closing(self._connect()) as db:
+            db.execute(
+                f"UPDATE jobs SET state = 'failed', error = 'Conversion was interrupted', finished_at = ? "
+                f"WHERE {stale} AND worker LIKE 'stream:%'",
+                (now, cutoff)
+            )
+            db.execute(
+                f"UPDATE jobs SET state = 'failed', error = 'Job worker stopped responding', finished_at = ? "
+                f"WHERE {stale} AND attempts >= ?",
+                (now, cutoff, MAX_ATTEMPTS)
+            )
+            db.execute(f"UPDATE jobs SET state = 'queued', worker = NULL WHERE {stale}", (cutoff,))
+
+    def purge(self, ttl=DEFAULT_JOB_TTL):
+        cutoff = time.time() - ttl
+        with closing(self._connect()) as db:
+            expired = [row["id"] for row in db.execute(
+                "SELECT id FROM jobs WHERE state IN ('done', 'failed') AND finished_at < ?", (cutoff,)
+            )]
+            for job_id in expired:
+                db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        for job_id in expired:
+            self.discard(job_id)
+        return len(expired)
+
+    def counts(self):
+        with closing(self._connect()) as db:
+            rows = db.execute('SELECT state, COUNT(*) AS n FROM jobs GROUP BY state').fetchall()
+        return {row["state"]: row["n"] for row in rows}
+
+def job_options(options):
+    # What enqueue() keeps of a request's ConversionOptions
+    return {"page_range": options.page_range, "tuning": options.tuning}
+
+class JobRunner:
+    # service converts the jobs; by default one with the job deadline and without
+    # admission control, since the queue already bounds the work
+    def __init__(self, store, workers=DEFAULT_JOB_WORKERS, service=None):
+        self.store = store
+        self.workers = workers
+        self.service = service or ConversionService(cache=get_default_cache(), page_cache=get_default_page_cache(),
+                                                    limits=JobLimits(deadline=DEFAULT_JOB_TIMEOUT))
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_started(self):
+        # Threads and pools do not survive a fork, so (re)start in each process
+        with self._lock:
+            if self.workers <= 0 or self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            for i in range(self.workers):
+                threading.Thread(target=self._loop, name=f'pdf2word-job-{i}', daemon=True).start()
+            threading.Thread(target=self._housekeeping, name='pdf2word-job-janitor', daemon=True).start()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def _loop(self):
+        worker = f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+        while not self._stop.is_set():
+            job_id = self.store.claim(worker)
+            if job_id is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self.run(job_id)
+
+    def run(self, job_id):
+        workspace = Workspace(self.store.job_dir(job_id))
+        estimate = ProgressEstimate()
+
+        def progress(stage, done, total):
+            self.store.update(job_id, progress=estimate.update(stage, done, total))
+
+        try:
+            logging.info(f'Job {job_id}: converting {os.path.getsize(workspace.input_path)} bytes')
+            options = self._options(self.store.get(job_id))
+            with self.store.heartbeat(job_id):
+                report = self.service.convert(workspace, options, progress=progress)
+            self.store.finish(job_id, report["outputSize"], report["cache"])
+            logging.info(f'Job {job_id}: done (cache {report["cache"]}), {report["outputSize"]} bytes')
+        except Exception as e:
+            # ConversionError carries the reason (limits, invalid PDF); anything else is ours
+            logging.error(f'Job {job_id}: conversion failed: {str(e)}')
+            self.store.fail(job_id, str(e))
+        finally:
+            if os.path.exists(workspace.input_path):
+                os.unlink(workspace.input_path)
+
+    def _options(self, job):
+        # The deployment's options with the page range and profile the job was submitted with
+        base = self.service.options
+        if not job or not job["options"]:
+            return base
+        stored = json.loads(job["options"])
+        return ConversionOptions(base.workers, base.shard_size, stored["page_range"], stored["tuning"],
+                                 base.window_size)
+
+    def _housekeeping(self):
+        while not self._stop.wait(60):
+            try:
+                self.store.requeue_stale()
+                purged = self.store.purge()
+                if purged:
+                    logging.info(f'Purged {purged} expired jobs')
+            except Exception as e:
+                logging.error(f'Job housekeeping failed: {str(e)}')
+
+def _job_status(job):
+    return {
+        "jobId": job["id"],
+        "status": job["state"],
+        "progress": job["progress"],
+        "queuePosition": job["queue_position"],
+        "filename": job["filename"],
+        "originalSize": job["input_size"],
+        "convertedSize": job["output_size"],
+        "cache": job["cache"],
+        "error": job["error"],
+        "createdAt": job["created_at"],
+        "startedAt": job["started_at"],
+        "finishedAt": job["finished_at"]
+    }
+
+def create_jobs_blueprint(store, runner):
+    jobs = Blueprint('jobs', __name__)
+
+    @jobs.route('/jobs', methods=['POST'])
+    def submit_job():
+        runner.ensure_started()
+        job_id = store.reserve()
+        try:
+            with open(store.input_path(job_id), 'wb') as temp_pdf:
+                if request.is_json:
+                    try:
+                        data, pdf_size = decode_json_base64_field(request.stream, 'fileData', temp_pdf)
+                    except ValueError as e:
+                        store.discard(job_id)
+                        return jsonify({"error": str(e)}), 400
+                    if 'fileData' not in data:
+                        store.discard(job_id)
+                        return jsonify({"error": "No fileData provided"}), 400
+                    filename = data.get('fileName', 'document.pdf')
+                else:
+                    if 'file' not in request.files or request.files['file'].filename == '':
+                        store.discard(job_id)
+                        return jsonify({"error": "No file provided"}), 400
+                    file = request.files['file']
+                    pdf_size = spool_to_file(file.stream, temp_pdf)
+                    filename = file.filename or "document.pdf"
+                    data = request.values
+
+            if not pdf_size:
+                store.discard(job_id)
+                return jsonify({"error": "Empty file"}), 400
+
+            # Optional page selection and profile, as for /convert
+            options = runner.service.options.for_request(data.get('start'), data.get('end'), data.get('pages'),
+                                                         data.get('profile'))
+            store.enqueue(job_id, filename, pdf_size, job_options(options))
+        except ConversionError as e:
+            store.discard(job_id)
+            return jsonify(e.body()), e.status, e.headers
+        except QueueFullError as e:
+            store.discard(job_id)
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "30"}
+        except Exception as e:
+            store.discard(job_id)
+            logging.error(f'Job submission failed: {str(e)}')
+            return jsonify({"error": f"Request processing failed: {str(e)}"}), 500
+
+        runner.notify()
+        logging.info(f'Job {job_id}: queued {pdf_size} bytes')
+        return jsonify({
+            "jobId": job_id,
+            "status": "queued",
+            "statusUrl": url_for('jobs.job_status', job_id=job_id),
+            "resultUrl": url_for('jobs.job_result', job_id=job_id)
+        }), 202
+
+    @jobs.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        runner.ensure_started()
+        job = store.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(_job_status(job))
+
+    @jobs.route('/jobs/<job_id>/result', methods=['GET'])
+    def job_result(job_id):
+        job = store.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        if job["state"] == 'failed':
+            return jsonify({"error": f"Conversion failed: {job['error']}"}), 409
+        if job["state"] != 'done':
+            return jsonify({"error": f"Job is {job['state']}"}), 409, {"Retry-After": "2"}
+
+        return send_file(
+            store.output_path(job_id),
+            as_attachment=True,
+            download_name=job["filename"].replace('.pdf', '.docx'),
+            mimetype=DOCX_MIMETYPE
+        )
+
+    return jobs
+
+def main():
+    # Standalone worker: lets web processes run with PDF2WORD_JOB_WORKERS=0 and only enqueue
+    parser = argparse.ArgumentParser(description='Run pdf2word conversion job workers')
+    parser.add_argument('--jobs-dir', default=DEFAULT_JOBS_DIR)
+    parser.add_argument('--workers', type=int, default=max(1, DEFAULT_JOB_WORKERS))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    runner = JobRunner(JobStore(args.jobs_dir), args.workers)
+    runner.ensure_started()
+    logging.info(f'Job workers running on {args.jobs_dir}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        runner.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Hot-path instrumentation for the conversion services.
+#
+# Each request collects per-stage timings in a RequestMetrics object; when it
+# finishes, the numbers are folded into a process-wide registry and rendered on
+# /metrics in the Prometheus text format. gunicorn runs several processes, so
+# every process also snapshots its registry into PDF2WORD_METRICS_DIR and /metrics
+# adds up the snapshots of all processes on the node. A snapshot is named after
+# its process's pid and start time; one whose process is gone is deleted rather
+# than counted, and a gunicorn master gives its workers a directory of their own
+# (see claim_directory), emptied at startup.
+
+DEFAULT_METRICS_DIR = os.environ.get('PDF2WORD_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'pdf2word-metrics'))
+# Adds a Server-Timing header with the per-stage breakdown to every response
+TIMING_HEADERS = os.environ.get('PDF2WORD_TIMING_HEADERS', 'off').lower() in ('on', '1', 'true')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200)
+
+DESCRIPTIONS = {
+    "pdf2word_requests_total": ("counter", "Conversion requests by endpoint and HTTP status"),
+    "pdf2word_errors_total": ("counter", "Failed conversion requests by endpoint and stage"),
+    "pdf2word_request_seconds": ("histogram", "End-to-end request handling time"),
+    "pdf2word_stage_seconds": ("histogram", "Time spent in each request stage"),
+    "pdf2word_queue_wait_seconds": ("histogram", "Time spent waiting for a conversion slot"),
+    "pdf2word_pages_total": ("counter", "PDF pages converted"),
+    "pdf2word_scanned_pages_total": ("counter", "PDF pages embedded as scanned images"),
+    "pdf2word_native_pages_total": ("counter", "PDF pages written by the native engine instead of pdf2docx"),
+    "pdf2word_pages_per_second": ("histogram", "Conversion throughput per request"),
+    "pdf2word_bytes_in_total": ("counter", "Input bytes received"),
+    "pdf2word_bytes_out_total": ("counter", "Output bytes produced"),
+    "pdf2word_cache_total": ("counter", "Result cache lookups by outcome"),
+    "pdf2word_page_cache_total": ("counter", "Page cache lookups by outcome"),
+    "pdf2word_scratch_bytes_total": ("counter", "Bytes left in request workspaces, by RAM or disk backing"),
+    "pdf2word_scratch_moved_to_disk_total": ("counter", "RAM-backed workspaces moved to disk after running out of room"),
+    "pdf2word_scratch_orphans_removed_total": ("counter", "Abandoned workspaces removed by the janitor"),
+    "pdf2word_office_conversions_total": ("counter", "Office format conversions by source and target format"),
+    "pdf2word_office_restarts_total": ("counter", "Office instances replaced, by reason"),
+}
+
+class Registry:
+    def __init__(self, directory=DEFAULT_METRICS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            logging.warning(f'Metrics snapshots disabled: {str(e)}')
+            self.directory = None
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=DURATION_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": list(buckets), "counts": [0] * len(buckets),
+                                                     "sum": 0.0, "count": 0}
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, labels, value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, labels, dict(h, counts=list(h["counts"]))]
+                               for (name, labels), h in self._histograms.items()]
+            }
+
+    def claim_directory(self, directory):
+        # Switches to an empty snapshot directory of this process tree's own
+        try:
+            os.makedirs(directory, exist_ok=True)
+            for name in os.listdir(directory):
+                if name.endswith(('.json', '.tmp')):
+                    os.unlink(os.path.join(directory, name))
+        except OSError as e:
+            logging.warning(f'Metrics snapshots disabled: {str(e)}')
+            directory = None
+        self.directory = directory
+
+    def flush(self):
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, _snapshot_name(os.getpid()))
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._snapshot(), f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning(f'Could not write metrics snapshot: {str(e)}')
+
+    def _collect(self):
+        # Own numbers from memory, every other live process's from its last snapshot
+        snapshots = [self._snapshot()]
+        if self.directory:
+            own = _snapshot_name(os.getpid())
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json') or name == own:
+                    continue
+                path = os.path.join(self.directory, name)
+                pid = name.split('-', 1)[0]
+                if not pid.isdigit() or _snapshot_name(int(pid)) != name:
+                    # Left by a process that has exited, or whose pid was reused since
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+
+        counters, histograms = {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, h in snapshot["histograms"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                merged = histograms.get(key)
+                if merged is None:
+                    histograms[key] = dict(h, counts=list(h["counts"]))
+                    continue
+                merged["counts"] = [a + b for a, b in zip(merged["counts"], h["counts"])]
+                merged["sum"] += h["sum"]
+                merged["count"] += h["count"]
+        return counters, histograms
+
+    def render(self):
+        counters, histograms = self._collect()
+        lines = []
+        for metric, (kind, description) in DESCRIPTIONS.items():
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} {kind}')
+            if kind == 'counter':
+                for (name, labels), value in sorted(counters.items()):
+                    if name == metric:
+                        lines.append(f'{metric}{_labels(labels)} {_number(value)}')
+                continue
+            for (name, labels), h in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                for bound, count in zip(h["buckets"], h["counts"]):
+                    lines.append(f'{metric}_bucket{_labels(labels + (("le", _number(bound)),))} {count}')
+                lines.append(f'{metric}_bucket{_labels(labels + (("le", "+Inf"),))} {h["count"]}')
+                lines.append(f'{metric}_sum{_labels(labels)} {_number(h["sum"])}')
+                lines.append(f'{metric}_count{_labels(labels)} {h["count"]}')
+        return '\n'.join(lines) + '\n'
+
+def _snapshot_name(pid):
+    # <pid>-<start time>.json, or None when no such process is running
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The start time is the 22nd field; the command name before it may hold spaces
+            return f'{pid}-{f.read().rsplit(")", 1)[1].split()[19]}.json'
+    except FileNotFoundError:
+        return None
+    except (OSError, IndexError):
+        pass
+    # No /proc: the pid alone
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return f'{pid}-0.json'
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+registry = Registry()
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class RequestMetrics:
+    def __init__(self, endpoint, registry=registry):
+        self.endpoint = endpoint
+        self.registry = registry
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.current_stage = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.pages = 0
+        self.scanned_pages = 0
+        self.native_pages = 0
+        self.cache = None
+        self.page_cache = None
+        self.queue_wait = None
+        self.failed_stage = None
+        self._finished = False
+
+    @contextmanager
+    def stage(self, name):
+        previous = self.current_stage
+        self.current_stage = name
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.failed_stage = self.failed_stage or name
+            raise
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+            self.current_stage = previous
+
+    def record_conversion(self, report):
+        # Stage timings measured inside convert_document()
+        for name, seconds in report.get("timings", {}).items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.pages = report.get("pages", 0)
+        self.scanned_pages = report.get("scannedPages", 0)
+        self.native_pages = report.get("nativePages", 0)
+        self.cache = report.get("cache")
+        self.page_cache = report.get("pageCache")
+
+    def server_timing(self):
+        parts = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.stages.items()]
+        if self.queue_wait is not None:
+            parts.append(f'queue;dur={self.queue_wait * 1000:.1f}')
+        parts.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(parts)
+
+    def finish(self, status, failed_stage=None):
+        if self._finished:
+            return
+        self._finished = True
+        labels = {"endpoint": self.endpoint}
+        total = time.perf_counter() - self.started
+
+        self.registry.inc("pdf2word_requests_total", dict(labels, status=str(status)))
+        self.registry.observe("pdf2word_request_seconds", labels, total)
+        for name, seconds in self.stages.items():
+            self.registry.observe("pdf2word_stage_seconds", dict(labels, stage=name), seconds)
+        if self.queue_wait is not None:
+            self.registry.observe("pdf2word_queue_wait_seconds", labels, self.queue_wait)
+        if status >= 400:
+            stage = failed_stage or self.failed_stage or "request"
+            self.registry.inc("pdf2word_errors_total", dict(labels, stage=stage))
+        if self.bytes_in:
+            self.registry.inc("pdf2word_bytes_in_total", labels, self.bytes_in)
+        if self.bytes_out:
+            self.registry.inc("pdf2word_bytes_out_total", labels, self.bytes_out)
+        if self.cache:
+            self.registry.inc("pdf2word_cache_total", dict(labels, result=self.cache))
+        if self.page_cache:
+            for result, count in (("hit", self.page_cache["hits"]), ("miss", self.page_cache["misses"])):
+                if count:
+                    self.registry.inc("pdf2word_page_cache_total", dict(labels, result=result), count)
+        if self.pages and status < 400:
+            self.registry.inc("pdf2word_pages_total", labels, self.pages)
+            if self.scanned_pages:
+                self.registry.inc("pdf2word_scanned_pages_total", labels, self.scanned_pages)
+            if self.native_pages:
+                self.registry.inc("pdf2word_native_pages_total", labels, self.native_pages)
+            converting = sum(self.stages.get(name, 0.0) for name in ("open", "parse", "docx"))
+            if converting > 0:
+                self.registry.observe("pdf2word_pages_per_second", labels, self.pages / converting, RATE_BUCKETS)
+        self.registry.flush()
+
+def instrument(endpoint):
+    # Flask view decorator: exposes the RequestMetrics as flask.g.request_metrics
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import g, make_response
+
+            request_metrics = g.request_metrics = RequestMetrics(endpoint)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                request_metrics.finish(500, request_metrics.current_stage)
+                raise
+
+            if TIMING_HEADERS:
+                response.headers['Server-Timing'] = request_metrics.server_timing()
+
+            if response.is_streamed and not response.direct_passthrough:
+                # Generated bodies (e.g. chunked base64) are produced after the view returns
+                response.response = _timed_body(response.response, request_metrics, response.status_code)
+            else:
+                request_metrics.finish(response.status_code)
+            return response
+        return wrapper
+    return decorator
+
+def _timed_body(body, request_metrics, status):
+    try:
+        iterator = iter(body)
+        while True:
+            with request_metrics.stage('response'):
+                chunk = next(iterator, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        request_metrics.finish(status)
@@ -0,0 +1,210 @@
+import statistics
+from copy import deepcopy
+
+import fitz
+import numpy
+from docx.enum.section import WD_SECTION
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
+from docx.oxml.ns import qn
+from docx.shared import Pt, RGBColor
+from pdf2docx.font.Fonts import Fonts
+
+# Native engine for simple pages.
+#
+# Plain single-column text (letters, contracts, reports without figures) needs
+# none of pdf2docx's layout analysis. Such pages are recognised from PyMuPDF's
+# structured text and drawing log with a few vectorised geometry checks, and
+# their text spans are written straight to python-docx paragraphs with font,
+# size, colour, bold and italic set the way pdf2docx sets them. Anything else -
+# images, vector graphics (table rules, shapes), links, columns, rotated or
+# overlapping text - is left to pdf2docx.
+
+# Text flags for extraction: no images, ligatures and whitespace as in the PDF
+TEXT_FLAGS = fitz.TEXTFLAGS_TEXT
+# Drawing log entries a simple page may have; any other (paths, images, shadings) is layout
+TEXT_OPERATIONS = ('fill-text', 'stroke-text', 'ignore-text')
+# Lines overlapping vertically by more than this fraction of the shorter one share a row
+ROW_OVERLAP = 0.5
+# A line ending this many points before its block's right edge ends with a line break
+LINE_BREAK_GAP = 24.0
+# Tolerance (points) for left, right and centre alignment
+ALIGN_TOLERANCE = 2.0
+
+# Span flags, as in pdf2docx's TextSpan
+SPAN_SUPERSCRIPT = 1
+SPAN_ITALIC = 2
+SPAN_BOLD = 16
+
+def page_text(page):
+    return page.get_text('dict', flags=TEXT_FLAGS)
+
+def _blocks(text):
+    # Lines of each text block, leaving out lines with nothing visible
+    blocks = [[line for line in block["lines"] if any(span["text"].strip() for span in line["spans"])]
+              for block in text["blocks"] if block["type"] == 0]
+    return [lines for lines in blocks if lines]
+
+def is_simple_page(page, text=None):
+    # Single column of horizontal text and nothing else on the page
+    if page.rotation:
+        return False
+    # Links are not in the drawing log; pdf2docx writes them as hyperlinks
+    if page.first_link is not None:
+        return False
+    if any(kind not in TEXT_OPERATIONS for kind, _ in page.get_bboxlog()):
+        return False
+    lines = [line for lines in _blocks(text or page_text(page)) for line in lines]
+    if not lines:
+        return False
+
+    boxes = numpy.array([line["bbox"] for line in lines], dtype=float)
+    directions = numpy.array([line["dir"] for line in lines], dtype=float)
+    if not numpy.allclose(directions, (1.0, 0.0), atol=1e-3):
+        return False
+    x0, y0, x1, y1 = boxes.T
+    if (x0 < page.rect.x0 - 1).any() or (x1 > page.rect.x1 + 1).any():
+        return False
+
+    # Pairs of lines on the same row: side by side means columns or tab stops,
+    # overlapping means text drawn over text
+    heights = numpy.maximum(y1 - y0, 1e-3)
+    shared = numpy.minimum.outer(y1, y1) - numpy.maximum.outer(y0, y0)
+    same_row = shared > ROW_OVERLAP * numpy.minimum.outer(heights, heights)
+    numpy.fill_diagonal(same_row, False)
+    return not same_row.any()
+
+def _paragraphs(text):
+    # Lists of lines in reading order: text blocks from top to bottom, split where
+    # two lines are more than half a line apart (a blank line between paragraphs)
+    paragraphs = []
+    for lines in sorted(_blocks(text), key=lambda lines: lines[0]["bbox"][1]):
+        current = [lines[0]]
+        for previous, line in zip(lines, lines[1:]):
+            height = previous["bbox"][3] - previous["bbox"][1]
+            if line["bbox"][1] - previous["bbox"][3] > 0.5 * height:
+                paragraphs.append(current)
+                current = []
+            current.append(line)
+        paragraphs.append(current)
+    return paragraphs
+
+def _alignment(lines, left, right):
+    # Alignment of a paragraph within the text column [left, right]
+    if len(lines) == 1:
+        x0, _, x1, _ = lines[0]["bbox"]
+        if x0 - left > ALIGN_TOLERANCE and abs((x0 + x1) / 2 - (left + right) / 2) <= ALIGN_TOLERANCE:
+            return WD_ALIGN_PARAGRAPH.CENTER
+        if x0 - left > ALIGN_TOLERANCE and right - x1 <= ALIGN_TOLERANCE:
+            return WD_ALIGN_PARAGRAPH.RIGHT
+        return WD_ALIGN_PARAGRAPH.LEFT
+    x0 = numpy.array([line["bbox"][0] for line in lines])
+    x1 = numpy.array([line["bbox"][2] for line in lines])
+    if numpy.ptp(x0) > ALIGN_TOLERANCE and numpy.ptp((x0 + x1) / 2) <= ALIGN_TOLERANCE:
+        return WD_ALIGN_PARAGRAPH.CENTER
+    if numpy.ptp(x0) > ALIGN_TOLERANCE and numpy.ptp(x1) <= ALIGN_TOLERANCE:
+        return WD_ALIGN_PARAGRAPH.RIGHT
+    if numpy.ptp(x1[:-1]) <= ALIGN_TOLERANCE and x1[-1] < x1[0] - ALIGN_TOLERANCE:
+        return WD_ALIGN_PARAGRAPH.JUSTIFY
+    return WD_ALIGN_PARAGRAPH.LEFT
+
+def new_page_section(docx_file):
+    # Same section handling as pdf2docx's Page.make_docx(), without building the
+    # list of every paragraph written so far for each page
+    if docx_file.element.body.find(qn('w:p')) is not None:
+        return docx_file.add_section(WD_SECTION.NEW_PAGE)
+    return docx_file.sections[0]
+
+class NativeWriter:
+    # Writes simple pages of one PDF into python-docx documents
+    def __init__(self, fitz_doc):
+        # Family names of the embedded fonts, which Word knows better than PDF font names
+        self.fonts = Fonts.extract(fitz_doc)
+        # Run properties (<w:rPr>) by span style; formatting each run through
+        # python-docx's properties costs more than the rest of the page
+        self._styles = {}
+
+    def _font_name(self, name):
+        font = self.fonts.get(name) if name else None
+        return font.name if font else name.split('+')[-1]
+
+    def _add_run(self, paragraph, span, text):
+        run = paragraph.add_run()
+        style = (span["font"], round(span["size"] * 2) / 2, span["flags"], span["color"])
+        properties = self._styles.get(style)
+        if properties is None:
+            # Set as pdf2docx's TextSpan sets them
+            name = self._font_name(span["font"])
+            run.bold = bool(span["flags"] & SPAN_BOLD)
+            run.italic = bool(span["flags"] & SPAN_ITALIC)
+            run.font.superscript = bool(span["flags"] & SPAN_SUPERSCRIPT)
+            run.font.name = name
+            run._element.rPr.rFonts.set(qn('w:eastAsia'), name)
+            run.font.color.rgb = RGBColor.from_string(f'{span["color"]:06X}')
+            run.font.size = Pt(style[1])
+            self._styles[style] = deepcopy(run._element.rPr)
+        else:
+            run._element.insert(0, deepcopy(properties))
+        if '\t' in text or '\n' in text:
+            run.text = text
+        else:
+            run._element.add_t(text)
+
+    def write_page(self, docx_file, page, text=None):
+        # One section per page with the margins of the text column, and the
+        # vertical positions kept through paragraph spacing
+        text = text or page_text(page)
+        paragraphs = _paragraphs(text)
+        section = new_page_section(docx_file)
+        width, height = page.rect.width, page.rect.height
+        section.page_width, section.page_height = Pt(width), Pt(height)
+        section.header_distance = section.footer_distance = Pt(0)
+
+        if not paragraphs:
+            section.left_margin = section.right_margin = section.top_margin = section.bottom_margin = Pt(0)
+            docx_file.add_paragraph()
+            return
+
+        boxes = numpy.array([line["bbox"] for lines in paragraphs for line in lines], dtype=float)
+        left, top = boxes[:, 0].min(), boxes[:, 1].min()
+        right, bottom = boxes[:, 2].max(), boxes[:, 3].max()
+        section.left_margin, section.top_margin = Pt(left), Pt(top)
+        # A little slack on the right so Word does not wrap lines the PDF kept whole
+        section.right_margin = Pt(max(width - right - ALIGN_TOLERANCE, 0))
+        section.bottom_margin = Pt(max(min(height - bottom, top) / 2, 0))
+
+        cursor = top
+        for lines in paragraphs:
+            first_top = lines[0]["bbox"][1]
+            # Baseline to baseline, so the paragraph ends where the next one's gap starts
+            pitch = (statistics.median(b["bbox"][3] - a["bbox"][3] for a, b in zip(lines, lines[1:]))
+                     if len(lines) > 1 else lines[0]["bbox"][3] - first_top)
+
+            paragraph = docx_file.add_paragraph()
+            paragraph_format = paragraph.paragraph_format
+            paragraph_format.space_before = Pt(max(first_top - cursor, 0))
+            paragraph_format.space_after = Pt(0)
+            paragraph_format.line_spacing_rule = WD_LINE_SPACING.EXACTLY
+            paragraph_format.line_spacing = Pt(pitch)
+            alignment = _alignment(lines, left, right)
+            paragraph_format.alignment = alignment
+            if alignment in (WD_ALIGN_PARAGRAPH.LEFT, WD_ALIGN_PARAGRAPH.JUSTIFY):
+                # First line indented or hanging (a numbered item) relative to the rest
+                indents = [line["bbox"][0] - left for line in lines]
+                body = min(indents[1:]) if len(indents) > 1 else indents[0]
+                paragraph_format.left_indent = Pt(body)
+                if abs(indents[0] - body) > ALIGN_TOLERANCE:
+                    paragraph_format.first_line_indent = Pt(indents[0] - body)
+
+            block_right = max(line["bbox"][2] for line in lines)
+            for i, line in enumerate(lines):
+                spans = line["spans"]
+                for j, span in enumerate(spans):
+                    span_text = span["text"]
+                    if j == len(spans) - 1 and i < len(lines) - 1:
+                        if block_right - line["bbox"][2] > LINE_BREAK_GAP:
+                            # A short line that is not the last: an address, a list, a verse
+                            span_text += '\n'
+                        elif not span_text.endswith((' ', '-')):
+                            span_text += ' '
+                    self._add_run(paragraph, span, span_text)
+            cursor = first_top + pitch * len(lines)
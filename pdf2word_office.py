@@ -0,0 +1,374 @@
+import atexit
+import logging
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from contextlib import contextmanager
+
+from pdf2word_metrics import registry
+from pdf2word_supervisor import JobLimitExceeded
+
+# Office formats through a pool of warm LibreOffice instances.
+#
+# Starting soffice for every document costs seconds, so each serving process
+# keeps a few headless instances running, every one with a user profile of its
+# own, and drives them over UNO (LibreOffice's Python bridge): load the input,
+# store it with the export filter, close it. An instance is health-checked
+# before each job, replaced after max_jobs jobs, restarted when it has crashed
+# and killed when a job runs past the deadline. Instances are started after
+# the fork in every worker (a UNO connection cannot be shared across a fork)
+# and stopped when the process exits.
+
+OFFICE_BINARY = os.environ.get('PDF2WORD_OFFICE_BINARY', 'soffice')
+# Where LibreOffice's Python bridge lives when it is not on the interpreter's path
+# (Debian's python3-uno next to a python:3.11 image). The bridge is a compiled
+# module for the distro's python3, so the image's Python must be the same
+# version: Dockerfile.flask and Dockerfile.asgi pin bookworm for that
+OFFICE_PYTHONPATH = os.environ.get('PDF2WORD_OFFICE_PYTHONPATH',
+                                   '/usr/lib/python3/dist-packages:/usr/lib/libreoffice/program')
+DEFAULT_OFFICE_INSTANCES = int(os.environ.get('PDF2WORD_OFFICE_INSTANCES', '1'))
+# Jobs an instance runs before it is replaced, bounding LibreOffice's own leaks
+DEFAULT_OFFICE_MAX_JOBS = int(os.environ.get('PDF2WORD_OFFICE_MAX_JOBS', '100'))
+# Seconds per conversion before the instance is killed (0 = no deadline)
+DEFAULT_OFFICE_TIMEOUT = float(os.environ.get('PDF2WORD_OFFICE_TIMEOUT', '120'))
+DEFAULT_OFFICE_START_TIMEOUT = float(os.environ.get('PDF2WORD_OFFICE_START_TIMEOUT', '60'))
+# Seconds a request waits for a free instance before it is turned away
+DEFAULT_OFFICE_QUEUE_TIMEOUT = float(os.environ.get('PDF2WORD_OFFICE_QUEUE_TIMEOUT', '30'))
+# Seconds a client is asked to wait after an instance failed to start
+OFFICE_RETRY_AFTER = 10
+# Start the instances with the worker instead of on the first office request
+OFFICE_WARM = os.environ.get('PDF2WORD_OFFICE_WARM', 'on').lower() in ('on', '1', 'true')
+
+# (source, target) -> (import filter, None to let LibreOffice detect it; export filter)
+CONVERSIONS = {
+    ("docx", "pdf"): (None, "writer_pdf_Export"),
+    ("doc", "pdf"): (None, "writer_pdf_Export"),
+    ("odt", "pdf"): (None, "writer_pdf_Export"),
+    ("rtf", "pdf"): (None, "writer_pdf_Export"),
+    ("pdf", "rtf"): ("writer_pdf_import", "Rich Text Format"),
+}
+
+MEDIA_TYPES = {"pdf": "application/pdf", "rtf": "application/rtf"}
+
+ODT_MIMETYPE = b'application/vnd.oasis.opendocument.text'
+
+class OfficeUnavailable(Exception):
+    # LibreOffice or its Python bridge is missing (retry_after None), or an
+    # instance did not start and the next request may do better
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class OfficeBusy(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class OfficeConversionFailed(Exception):
+    pass
+
+def sniff_format(path):
+    # "pdf", "rtf", "doc", "docx", "odt" or None, from the file's first bytes
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    if head.startswith(b'%PDF'):
+        return "pdf"
+    if head.startswith(b'{\\rtf'):
+        return "rtf"
+    if head.startswith(b'\xd0\xcf\x11\xe0'):
+        return "doc"
+    if head.startswith(b'PK'):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                names = set(archive.namelist())
+                if 'mimetype' in names and archive.read('mimetype').strip() == ODT_MIMETYPE:
+                    return "odt"
+                if 'word/document.xml' in names:
+                    return "docx"
+        except zipfile.BadZipFile:
+            return None
+    return None
+
+def _import_uno():
+    try:
+        import uno
+    except ImportError:
+        sys.path.extend(path for path in OFFICE_PYTHONPATH.split(':') if path and path not in sys.path)
+        try:
+            import uno
+        except ImportError as e:
+            raise OfficeUnavailable(f'LibreOffice Python bridge (uno) not found: {str(e)}')
+    return uno
+
+def _properties(uno, **values):
+    properties = []
+    for name, value in values.items():
+        prop = uno.createUnoStruct('com.sun.star.beans.PropertyValue')
+        prop.Name, prop.Value = name, value
+        properties.append(prop)
+    return tuple(properties)
+
+class OfficeInstance:
+    # One headless soffice process and the UNO connection to it
+    def __init__(self, binary=OFFICE_BINARY, start_timeout=DEFAULT_OFFICE_START_TIMEOUT):
+        self.binary = binary
+        self.start_timeout = start_timeout
+        self.pipe = f'pdf2word-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.profile = tempfile.mkdtemp(prefix='pdf2word-office-')
+        self.process = None
+        self.desktop = None
+        self.jobs = 0
+
+    def start(self):
+        uno = _import_uno()
+        command = [self.binary, '--headless', '--invisible', '--nologo', '--nodefault', '--norestore',
+                   '--nolockcheck', f'-env:UserInstallation={uno.systemPathToFileUrl(self.profile)}',
+                   f'--accept=pipe,name={self.pipe};urp;StarOffice.ComponentContext']
+        try:
+            # A session of its own, so killing it takes soffice.bin along with the launcher
+            self.process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL, start_new_session=True,
+                                            env=dict(os.environ, SAL_USE_VCLPLUGIN='svp'))
+        except OSError as e:
+            raise OfficeUnavailable(f'Could not start {self.binary}: {str(e)}')
+
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+        deadline = time.monotonic() + self.start_timeout
+        while True:
+            if self.process.poll() is not None:
+                raise OfficeUnavailable(f'{self.binary} exited during startup (exit code {self.process.returncode})',
+                                        OFFICE_RETRY_AFTER)
+            try:
+                context = resolver.resolve(f'uno:pipe,name={self.pipe};urp;StarOffice.ComponentContext')
+                break
+            except Exception:
+                # NoConnectException until soffice listens on the pipe
+                if time.monotonic() > deadline:
+                    self.kill()
+                    raise OfficeUnavailable(f'{self.binary} did not accept connections '
+                                            f'within {self.start_timeout:g} seconds', OFFICE_RETRY_AFTER)
+                time.sleep(0.2)
+        self.desktop = context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+        self.jobs = 0
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def healthy(self):
+        # Alive and answering over UNO
+        if not self.running() or self.desktop is None:
+            return False
+        try:
+            self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+
+    def convert(self, input_path, output_path, import_filter, export_filter):
+        uno = _import_uno()
+        load = {"Hidden": True, "ReadOnly": True}
+        if import_filter:
+            load["FilterName"] = import_filter
+        document = self.desktop.loadComponentFromURL(uno.systemPathToFileUrl(os.path.abspath(input_path)),
+                                                     '_blank', 0, _properties(uno, **load))
+        if document is None:
+            raise OfficeConversionFailed('LibreOffice could not open the document')
+        try:
+            document.storeToURL(uno.systemPathToFileUrl(os.path.abspath(output_path)),
+                                _properties(uno, FilterName=export_filter))
+        finally:
+            try:
+                document.close(True)
+            except Exception:
+                pass
+        self.jobs += 1
+
+    def kill(self):
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.wait()
+
+    def stop(self):
+        # Asks soffice to quit, then makes sure it has
+        if self.running() and self.desktop is not None:
+            try:
+                self.desktop.terminate()
+                self.process.wait(5)
+            except Exception:
+                pass
+        self.kill()
+        self.process = self.desktop = None
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(self.profile, ignore_errors=True)
+
+class OfficePool:
+    def __init__(self, instances=DEFAULT_OFFICE_INSTANCES, max_jobs=DEFAULT_OFFICE_MAX_JOBS,
+                 timeout=DEFAULT_OFFICE_TIMEOUT, queue_timeout=DEFAULT_OFFICE_QUEUE_TIMEOUT, binary=OFFICE_BINARY,
+                 warm=OFFICE_WARM):
+        self.size = max(1, instances)
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.binary = binary
+        self.warm = warm
+        self._lock = threading.Lock()
+        self._pid = None
+        self._instances = []
+        self._idle = None
+        self._counters = {"jobs": 0, "failures": 0, "timeouts": 0, "starts": 0, "recycled": 0, "crashes": 0}
+        atexit.register(self.close)
+
+    def available(self):
+        return shutil.which(self.binary) is not None
+
+    def _ensure_instances(self):
+        # Instances belong to the process that started them; a forked worker makes its own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._instances = [OfficeInstance(self.binary) for _ in range(self.size)]
+            self._idle = queue.Queue()
+            for instance in self._instances:
+                self._idle.put(instance)
+
+    def start(self):
+        # Starts the instances in the background (through pdf2word_warmup.after_fork), each
+        # taken from the idle queue like a job, so a request arriving meanwhile waits for
+        # one rather than starting it twice. A failure is logged; the next job retries.
+        if not self.warm or not self.available():
+            return
+        self._ensure_instances()
+
+        def warm():
+            started = time.perf_counter()
+            try:
+                for _ in range(self.size):
+                    with self._instance():
+                        pass
+            except (OfficeUnavailable, OfficeBusy) as e:
+                logging.warning(f'Office instances not started: {str(e)}')
+                return
+            logging.info(f'Started {self.size} office instances in {time.perf_counter() - started:.1f}s')
+
+        threading.Thread(target=warm, name='pdf2word-office-warm', daemon=True).start()
+
+    def close(self):
+        # Only the process that started the instances stops them
+        if self._pid != os.getpid():
+            return
+        for instance in self._instances:
+            instance.close()
+
+    def _count(self, name, reason=None):
+        with self._lock:
+            self._counters[name] += 1
+        if reason:
+            registry.inc("pdf2word_office_restarts_total", {"reason": reason})
+
+    @contextmanager
+    def _instance(self):
+        self._ensure_instances()
+        try:
+            instance = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise OfficeBusy(f'Server busy: no office instance free within {self.queue_timeout:g} seconds',
+                             max(1, int(self.queue_timeout)))
+        try:
+            if instance.jobs >= self.max_jobs:
+                instance.stop()
+                self._count("recycled", "recycle")
+            if not instance.healthy():
+                if instance.process is not None:
+                    # Started before and gone or unresponsive since
+                    instance.stop()
+                    self._count("crashes", "crash")
+                instance.start()
+                self._count("starts")
+            yield instance
+        finally:
+            self._idle.put(instance)
+
+    def convert(self, input_path, output_path, source, target):
+        # Converts input_path (of format source) to target at output_path; returns
+        # the time taken and how many jobs the instance has run
+        if (source, target) not in CONVERSIONS:
+            raise ValueError(f'Cannot convert {source or "this file"} to {target}')
+        if not self.available():
+            raise OfficeUnavailable(f'LibreOffice ({self.binary}) is not installed')
+        import_filter, export_filter = CONVERSIONS[(source, target)]
+
+        with self._instance() as instance:
+            start = time.perf_counter()
+            expired = threading.Event()
+
+            def expire():
+                expired.set()
+                instance.kill()
+
+            timer = threading.Timer(self.timeout, expire) if self.timeout else None
+            if timer:
+                timer.start()
+            error = None
+            try:
+                instance.convert(input_path, output_path, import_filter, export_filter)
+            except OfficeConversionFailed:
+                self._count("failures")
+                raise
+            except Exception as e:
+                error = e
+            finally:
+                if timer:
+                    timer.cancel()
+
+            if expired.is_set():
+                # Killed by the timer; whatever the call returned, the output is not to be trusted
+                instance.stop()
+                self._count("timeouts", "timeout")
+                raise JobLimitExceeded("deadline", f"Office conversion timed out after {self.timeout:g} seconds",
+                                       self.timeout, round(time.perf_counter() - start, 3))
+            if error is not None:
+                self._count("failures")
+                if not instance.healthy():
+                    # Started again by the next job that gets this instance
+                    logging.warning(f'Office instance {instance.pipe} crashed: {str(error)}')
+                    instance.stop()
+                    self._count("crashes", "crash")
+                raise OfficeConversionFailed(f'LibreOffice could not convert the document: {str(error)}')
+            self._count("jobs")
+            registry.inc("pdf2word_office_conversions_total", {"source": source, "target": target})
+            return {"seconds": round(time.perf_counter() - start, 3), "instanceJobs": instance.jobs}
+
+    def stats(self):
+        with self._lock:
+            info = dict(self._counters)
+        info.update({
+            "available": self.available(),
+            "instances": self.size,
+            "running": sum(1 for instance in self._instances if instance.running()),
+            "maxJobs": self.max_jobs,
+            "timeout": self.timeout,
+            "conversions": [f'{source}->{target}' for source, target in CONVERSIONS]
+        })
+        return info
+
+def get_default_office_pool():
+    # PDF2WORD_OFFICE=off disables office conversions
+    if os.environ.get('PDF2WORD_OFFICE', 'on').lower() in ('off', '0', 'false'):
+        return None
+    return OfficePool()
@@ -0,0 +1,213 @@
+import base64
+import hashlib
+import json
+import logging
+import re
+from contextlib import contextmanager
+from io import BytesIO
+
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from lxml import etree
+
+from pdf2word_native import new_page_section
+
+# Per-page incremental conversion.
+#
+# A revised contract often differs from the last version in two pages out of
+# forty, which misses the whole-file result cache. Every page is fingerprinted
+# from what it draws - its content stream, the resources it uses (fonts, images,
+# forms) hashed by content rather than object number, its geometry, links and
+# annotation appearances - and the body XML it produced in the DOCX is cached
+# under that fingerprint together with the images and links it refers to. The
+# next conversion puts cached pages back in place and only converts the rest.
+
+# Bump when the fragment format or the way pages are written changes
+FRAGMENT_VERSION = 2
+
+# An indirect object reference, "12 0 R"
+_REFERENCE = re.compile(r'\b(\d+) \d+ R\b')
+# The name python-docx gives a picture, from its drawing id
+_PICTURE_NAME = re.compile(r'Picture \d+')
+_RELATIONSHIP_NAMESPACE = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+# Page tree levels searched for inherited resources
+_MAX_TREE_DEPTH = 32
+
+def page_fingerprints(fitz_doc, page_indexes, options=None):
+    # Cache key per page index. options (the conversion settings) are part of
+    # every key; objects shared between pages, such as fonts, are hashed once.
+    options_blob = json.dumps(options or {}, sort_keys=True, default=str)
+    objects = {}
+    return {index: _fingerprint(fitz_doc, fitz_doc[index], options_blob, objects) for index in page_indexes}
+
+def _fingerprint(doc, page, options_blob, objects):
+    digest = hashlib.sha256(f'{FRAGMENT_VERSION}:{options_blob}'.encode('utf-8'))
+    digest.update(repr((tuple(page.mediabox), tuple(page.cropbox), page.rotation)).encode('utf-8'))
+    digest.update(page.read_contents())
+    digest.update(_resources(doc, page.xref, objects).encode('utf-8'))
+    for link in page.get_links():
+        digest.update(repr((link["kind"], tuple(link["from"]), link.get("uri"))).encode('utf-8'))
+    for annot in page.annots():
+        digest.update(repr((annot.type[0], tuple(annot.rect))).encode('utf-8'))
+        digest.update(_value(doc, doc.xref_get_key(annot.xref, 'AP/N'), objects).encode('utf-8'))
+    return digest.hexdigest()
+
+def _resources(doc, xref, objects):
+    # The page's resource dictionary, or the one it inherits from the page tree
+    for _ in range(_MAX_TREE_DEPTH):
+        kind, value = doc.xref_get_key(xref, 'Resources')
+        if kind != 'null':
+            return _value(doc, (kind, value), objects)
+        kind, parent = doc.xref_get_key(xref, 'Parent')
+        if kind != 'xref':
+            break
+        xref = int(parent.split()[0])
+    return ''
+
+def _value(doc, item, objects):
+    # A dictionary value with every object it refers to replaced by its digest
+    kind, value = item
+    if kind == 'xref':
+        return _object(doc, int(value.split()[0]), objects, set())
+    if kind == 'null':
+        return ''
+    return _REFERENCE.sub(lambda match: _object(doc, int(match.group(1)), objects, set()), value)
+
+def _object(doc, xref, objects, visiting):
+    # Digest of an object's source and stream bytes, the objects it refers to
+    # included; references back into an object being hashed count as a marker
+    if xref in objects:
+        return objects[xref]
+    if xref in visiting:
+        return 'cycle'
+    visiting.add(xref)
+    try:
+        source = doc.xref_object(xref, compressed=True)
+        digest = hashlib.sha256(_REFERENCE.sub(lambda match: _object(doc, int(match.group(1)), objects, visiting),
+                                               source).encode('utf-8'))
+        if doc.xref_is_stream(xref):
+            digest.update(doc.xref_stream_raw(xref) or b'')
+        objects[xref] = digest.hexdigest()
+    except (RuntimeError, ValueError):
+        # A broken or missing object: hash the reference itself
+        objects[xref] = f'missing:{xref}'
+    visiting.discard(xref)
+    return objects[xref]
+
+class PageFragments:
+    # Page cache lookups and stores for one conversion. cache is a
+    # pdf2word_cache.PageCache; cached holds the fragments found, by page index.
+    def __init__(self, cache, fitz_doc, page_indexes, options=None):
+        self.cache = cache
+        self.keys = page_fingerprints(fitz_doc, page_indexes, options)
+        self.cached = {}
+        self.stored = 0
+        for index, key in self.keys.items():
+            data = cache.read(key)
+            if data is None:
+                continue
+            try:
+                self.cached[index] = json.loads(data)
+            except ValueError:
+                logging.warning(f'Ignoring unreadable page cache entry {key}')
+
+    def stats(self):
+        hits = len(self.cached)
+        lookups = len(self.keys)
+        return {"hits": hits, "misses": lookups - hits, "stored": self.stored,
+                "hitRatio": round(hits / lookups, 4) if lookups else None}
+
+    @contextmanager
+    def record(self, docx_file, index):
+        # Wraps writing page index into docx_file and caches what it added; nothing
+        # is cached when writing fails
+        body = docx_file.element.body
+        # New content goes in before the closing <w:sectPr>
+        start = len(body) - 1
+        # Starting a section leaves a paragraph holding the previous page's
+        # section properties, which belongs to that page
+        if body.find(qn('w:p')) is not None:
+            start += 1
+        yield
+        fragment = _fragment(docx_file, list(body)[start:-1], body.sectPr)
+        if fragment is None:
+            logging.info(f'Page {index + 1} refers to parts the page cache cannot keep')
+            return
+        if self.cache.write(self.keys[index], json.dumps(fragment).encode('utf-8')):
+            self.stored += 1
+
+    def replay(self, docx_file, index):
+        # Writes the cached page index into docx_file, in a new section like any page
+        fragment = self.cached[index]
+        part = docx_file.part
+        section = new_page_section(docx_file)
+        ids = {}
+        for rid, relationship in fragment["relationships"].items():
+            if "image" in relationship:
+                ids[rid], _ = part.get_or_add_image(BytesIO(base64.b64decode(relationship["image"])))
+            else:
+                ids[rid] = part.relate_to(relationship["target"], relationship["type"], is_external=True)
+
+        # The page's first section starts as the new section does (a new page, or
+        # the document's first section); later ones keep their recorded start
+        start_type = section.start_type
+        sentinel = section._sectPr
+        for xml in fragment["elements"]:
+            element = parse_xml(xml)
+            for node in element.iter():
+                for name, value in node.attrib.items():
+                    if name.startswith(_RELATIONSHIP_NAMESPACE) and value in ids:
+                        node.set(name, ids[value])
+            # Drawing ids must be unique within the document; python-docx names pictures after them
+            for properties in element.iter(qn('wp:docPr')):
+                drawing_id = part.next_id
+                properties.set('id', str(drawing_id))
+                if _PICTURE_NAME.fullmatch(properties.get('name', '')):
+                    properties.set('name', f'Picture {drawing_id}')
+            sentinel.addprevious(element)
+
+        for child in list(sentinel):
+            sentinel.remove(child)
+        for child in parse_xml(fragment["sectPr"]):
+            sentinel.append(child)
+        _first_section(docx_file.element.body[-len(fragment["elements"]) - 1:]).start_type = start_type
+
+def _fragment(docx_file, elements, sectPr):
+    # The page's body elements, section properties and the images and external
+    # links they refer to, as JSON; None if they refer to any other part
+    # In document order, so a replayed page adds its parts, and gets its ids, in
+    # the order a fresh conversion would
+    rids = dict.fromkeys(value for element in elements for node in element.iter()
+                         for name, value in node.attrib.items() if name.startswith(_RELATIONSHIP_NAMESPACE))
+    relationships = {}
+    for rid in rids:
+        relationship = docx_file.part.rels.get(rid)
+        if relationship is None:
+            return None
+        if relationship.is_external:
+            relationships[rid] = {"type": relationship.reltype, "target": relationship.target_ref}
+        elif relationship.reltype == RT.IMAGE:
+            relationships[rid] = {"image": base64.b64encode(relationship.target_part.blob).decode('ascii')}
+        else:
+            return None
+
+    # Copies, so the first section's start type can go without touching the document
+    copies = [parse_xml(etree.tostring(element)) for element in elements + [sectPr]]
+    first = _first_section(copies)
+    for child in first.findall(qn('w:type')):
+        first.remove(child)
+    return {
+        "elements": [etree.tostring(element, encoding='unicode') for element in copies[:-1]],
+        "sectPr": etree.tostring(copies[-1], encoding='unicode'),
+        "relationships": relationships
+    }
+
+def _first_section(elements):
+    # The section properties ending the page's first section: those of the first
+    # section break among elements, else the last element (the closing <w:sectPr>)
+    for element in elements[:-1]:
+        properties = element.find(f'{qn("w:pPr")}/{qn("w:sectPr")}')
+        if properties is not None:
+            return properties
+    return elements[-1]
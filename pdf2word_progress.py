@@ -0,0 +1,85 @@
+import json
+import queue
+import threading
+import time
+
+# Server-Sent Events for streamed conversions.
+#
+# convert_document() calls ProgressTracker.update() once per page it parses and
+# once per page it writes to the DOCX (window by window, so the two stages
+# interleave on long documents); the tracker turns those calls into
+# "progress" events with an estimate of the time remaining, and the HTTP
+# handler relays them to the client as they happen.
+
+# Seconds between keep-alive comments while no page has finished
+KEEPALIVE_INTERVAL = 15
+# Writing a page into the DOCX costs about this fraction of parsing it
+RENDER_COST = 0.2
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode('utf-8')
+
+class ProgressEstimate:
+    # Overall fraction done from convert_document()'s progress calls, for callers
+    # without an event stream (e.g. the job API)
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Pages done and to do per stage; windowed conversions alternate between them
+        self._done = {"parse": 0, "render": 0}
+        self._total = {}
+
+    def update(self, stage, done, total):
+        with self._lock:
+            self._done[stage], self._total[stage] = done, total
+            parse_total = self._total.get("parse", 0)
+            # Until the first page is written, assume every parsed page will be
+            render_total = self._total.get("render", parse_total)
+            work = parse_total + render_total * RENDER_COST
+            return (self._done["parse"] + self._done["render"] * RENDER_COST) / work if work else 0.0
+
+class ProgressTracker:
+    def __init__(self, keepalive=KEEPALIVE_INTERVAL):
+        self.keepalive = keepalive
+        self.started = time.monotonic()
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._clock = self.started
+        self._estimate = ProgressEstimate()
+
+    def publish(self, event, data):
+        self._events.put((event, data))
+
+    def restart_clock(self):
+        # Call when the conversion actually starts (e.g. after waiting for admission)
+        with self._lock:
+            self._clock = time.monotonic()
+
+    def update(self, stage, done, total):
+        # Progress hook for convert_document(); returns the overall fraction done
+        now = time.monotonic()
+        fraction = self._estimate.update(stage, done, total)
+        with self._lock:
+            elapsed = now - self._clock
+        remaining = elapsed * (1 - fraction) / fraction if fraction else 0.0
+
+        self.publish("progress", {
+            "stage": stage,
+            "page": done,
+            "pages": total,
+            "percent": round(fraction * 100, 1),
+            "elapsed": round(now - self.started, 3),
+            "eta": round(remaining, 3)
+        })
+        return fraction
+
+    def stream(self):
+        # Yields encoded events until a "done" or "error" event has been sent
+        while True:
+            try:
+                event, data = self._events.get(timeout=self.keepalive)
+            except queue.Empty:
+                yield b': keep-alive\n\n'
+                continue
+            yield sse_event(event, data)
+            if event in ("done", "error"):
+                return
@@ -0,0 +1,359 @@
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from pdf2word_metrics import registry
+
+# Scratch space for conversions: one directory per request, always emptied.
+#
+# Workspaces are created on a RAM-backed filesystem (/dev/shm) while its usage
+# stays within a byte budget, and on disk otherwise, so uploads, DOCX output and
+# everything pdf2docx writes in between normally never touch the container's
+# disk. Each RAM-backed workspace holds a share of the budget that grows as
+# uploads are written and before the conversion writes its output; one that
+# cannot get more, or runs out of room, moves to disk and carries on there.
+# Emptied directories are reused. A janitor thread removes workspaces left
+# behind by killed processes once they are older than a TTL; usage of both
+# areas is reported on /health and in /metrics.
+
+DEFAULT_WORKSPACE_ROOT = os.environ.get('PDF2WORD_WORKSPACE_DIR', os.path.join(tempfile.gettempdir(), 'pdf2word-work'))
+DEFAULT_MEMORY_ROOT = os.environ.get('PDF2WORD_MEMORY_WORKSPACE_DIR', '/dev/shm/pdf2word-work')
+# Bytes of RAM-backed scratch shared by all processes on the node (0 = disk only).
+# Not used when the filesystem has less room than this (Docker's /dev/shm is 64 MB).
+DEFAULT_MEMORY_BUDGET = int(os.environ.get('PDF2WORD_MEMORY_WORKSPACE_BYTES', str(256 * 1024 * 1024)))
+# Room a new workspace is expected to need; below it a workspace goes to disk
+WORKSPACE_HEADROOM = 32 * 1024 * 1024
+# A workspace's share of the budget grows in steps of this many bytes
+RESERVATION_STEP = 8 * 1024 * 1024
+# Seconds a measurement of the RAM-backed area's usage is reused for
+MEMORY_USAGE_TTL = 2.0
+# Emptied workspace directories kept per process for the next request
+DEFAULT_IDLE_WORKSPACES = int(os.environ.get('PDF2WORD_IDLE_WORKSPACES', '8'))
+# Workspaces untouched for this many seconds belong to no live request
+DEFAULT_WORKSPACE_TTL = int(os.environ.get('PDF2WORD_WORKSPACE_TTL', '3600'))
+DEFAULT_JANITOR_INTERVAL = int(os.environ.get('PDF2WORD_JANITOR_INTERVAL', '300'))
+
+WORKSPACE_PREFIX = 'job-'
+
+class Workspace:
+    # One request's scratch directory: the uploaded PDF, the DOCX and anything else.
+    # backing is "memory" or "disk".
+    def __init__(self, directory, backing="disk"):
+        self.directory = directory
+        self.backing = backing
+
+    @property
+    def input_path(self):
+        return os.path.join(self.directory, 'input.pdf')
+
+    @property
+    def output_path(self):
+        return os.path.join(self.directory, 'output.docx')
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def cancel(self):
+        # Marks the workspace for a conversion polling cancelled(), from any process
+        with open(self.path('cancelled'), 'w'):
+            pass
+
+    def cancelled(self):
+        return os.path.exists(self.path('cancelled'))
+
+    def size(self):
+        return _tree_size(self.directory)
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.unlink(entry.path)
+
+class WorkspacePool:
+    # Reuses emptied directories instead of creating and removing one per request.
+    # Files still open elsewhere (e.g. a response being streamed) survive the cleanup.
+    def __init__(self, root=DEFAULT_WORKSPACE_ROOT, max_idle=DEFAULT_IDLE_WORKSPACES, memory_root=DEFAULT_MEMORY_ROOT,
+                 memory_budget=DEFAULT_MEMORY_BUDGET, ttl=DEFAULT_WORKSPACE_TTL,
+                 janitor_interval=DEFAULT_JANITOR_INTERVAL):
+        self.root = root
+        self.max_idle = max_idle
+        self.memory_root = _memory_root(memory_root, memory_budget)
+        self.memory_budget = memory_budget if self.memory_root else 0
+        self.ttl = ttl
+        self.janitor_interval = janitor_interval
+        self._idle = {"memory": [], "disk": []}
+        self._active = set()
+        self._counters = {"spilled": 0, "movedToDisk": 0, "orphansRemoved": 0}
+        # Budget held by this process's memory-backed workspaces, by directory
+        self._reserved = {}
+        self._memory_used = 0
+        self._memory_measured = float('-inf')
+        self._lock = threading.Lock()
+        self._janitor_pid = None
+        os.makedirs(root, exist_ok=True)
+
+    def _roots(self):
+        return {"memory": self.memory_root, "disk": self.root} if self.memory_root else {"disk": self.root}
+
+    def _choose_backing(self):
+        if not self.memory_root:
+            return "disk"
+        self._measure_memory()
+        with self._lock:
+            if self._memory_used + WORKSPACE_HEADROOM <= self.memory_budget:
+                self._memory_used += WORKSPACE_HEADROOM
+                return "memory"
+            self._counters["spilled"] += 1
+        return "disk"
+
+    def _measure_memory(self):
+        # Budget in use: what other processes' workspaces hold on the filesystem,
+        # plus the larger of size and share of each of this process's
+        with self._lock:
+            if time.monotonic() - self._memory_measured <= MEMORY_USAGE_TTL:
+                return
+        sizes = {}
+        try:
+            for entry in os.scandir(self.memory_root):
+                sizes[entry.path] = (_tree_size(entry.path) if entry.is_dir(follow_symlinks=False)
+                                     else entry.stat(follow_symlinks=False).st_size)
+        except OSError:
+            pass
+        with self._lock:
+            used = sum(size for directory, size in sizes.items() if directory not in self._reserved)
+            used += sum(max(sizes.get(directory, 0), share) for directory, share in self._reserved.items())
+            self._memory_used, self._memory_measured = used, time.monotonic()
+
+    def reserve(self, workspace, size):
+        # Grows a memory-backed workspace's share of the budget to size bytes in
+        # all; False when the budget has no room for that
+        if workspace.backing != "memory":
+            return True
+        with self._lock:
+            if size <= self._reserved.get(workspace.directory, 0):
+                return True
+        self._measure_memory()
+        with self._lock:
+            held = self._reserved.get(workspace.directory, 0)
+            wanted = -(-size // RESERVATION_STEP) * RESERVATION_STEP
+            for share in (wanted, size):
+                if self._memory_used + share - held <= self.memory_budget:
+                    self._memory_used += share - held
+                    self._reserved[workspace.directory] = share
+                    return True
+        return False
+
+    def make_room(self, workspace, size):
+        # Moves a memory-backed workspace to disk unless it may hold size bytes in all
+        if not self.reserve(workspace, size):
+            self.move_to_disk(workspace, over_budget=True)
+
+    def acquire(self):
+        self._ensure_janitor()
+        backing = self._choose_backing()
+        with self._lock:
+            while self._idle[backing]:
+                directory = self._idle[backing].pop()
+                # Another process's janitor may have taken it
+                if os.path.isdir(directory):
+                    return self._activate(directory, backing)
+        directory = tempfile.mkdtemp(prefix=WORKSPACE_PREFIX, dir=self._roots()[backing])
+        with self._lock:
+            return self._activate(directory, backing)
+
+    def _activate(self, directory, backing):
+        # With the lock held; a memory-backed workspace starts with the headroom as its share
+        self._active.add(directory)
+        if backing == "memory":
+            self._reserved[directory] = WORKSPACE_HEADROOM
+        return Workspace(directory, backing)
+
+    def create(self, workspace, name):
+        # Opens a new file in the workspace for writing; when a memory-backed
+        # workspace runs out of room, it moves to disk and writing carries on there
+        return _ScratchFile(self, workspace, name)
+
+    def move_to_disk(self, workspace, over_budget=False):
+        # Moves a memory-backed workspace and its files to disk, once it is over
+        # its share of the budget or the filesystem is out of room
+        directory = tempfile.mkdtemp(prefix=WORKSPACE_PREFIX, dir=self.root)
+        for entry in os.scandir(workspace.directory):
+            shutil.move(entry.path, os.path.join(directory, entry.name))
+        shutil.rmtree(workspace.directory, ignore_errors=True)
+        reason = 'is over its share of the memory budget' if over_budget else 'ran out of memory-backed space'
+        logging.warning(f'Workspace {workspace.directory} {reason}, moved to {directory}')
+        with self._lock:
+            self._active.discard(workspace.directory)
+            self._active.add(directory)
+            self._memory_used = max(0, self._memory_used - self._reserved.pop(workspace.directory, 0))
+            if not over_budget:
+                # Full as far as the next few requests are concerned
+                self._memory_used = self.memory_budget
+                self._memory_measured = time.monotonic()
+            self._counters["movedToDisk"] += 1
+        registry.inc("pdf2word_scratch_moved_to_disk_total", {})
+        workspace.directory = directory
+        workspace.backing = "disk"
+
+    def release(self, workspace):
+        with self._lock:
+            self._active.discard(workspace.directory)
+            self._memory_used = max(0, self._memory_used - self._reserved.pop(workspace.directory, 0))
+        try:
+            registry.inc("pdf2word_scratch_bytes_total", {"backing": workspace.backing}, workspace.size())
+            workspace.clear()
+        except OSError as e:
+            logging.warning(f'Could not clean workspace {workspace.directory}: {str(e)}')
+            shutil.rmtree(workspace.directory, ignore_errors=True)
+            return
+        with self._lock:
+            idle = self._idle[workspace.backing]
+            if len(idle) < self.max_idle:
+                idle.append(workspace.directory)
+                return
+        shutil.rmtree(workspace.directory, ignore_errors=True)
+
+    @contextmanager
+    def workspace(self):
+        workspace = self.acquire()
+        try:
+            yield workspace
+        finally:
+            self.release(workspace)
+
+    def sweep(self):
+        # Remove workspaces of any process on the node that nothing has touched
+        # for ttl seconds; returns how many were removed
+        with self._lock:
+            own = self._active.union(*self._idle.values())
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for root in self._roots().values():
+            try:
+                entries = [entry for entry in os.scandir(root)
+                           if entry.name.startswith(WORKSPACE_PREFIX) and entry.is_dir(follow_symlinks=False)]
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.path in own or _last_modified(entry.path) > cutoff:
+                    continue
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        if removed:
+            logging.info(f'Workspace janitor removed {removed} orphaned workspaces')
+            registry.inc("pdf2word_scratch_orphans_removed_total", {}, removed)
+            with self._lock:
+                self._counters["orphansRemoved"] += removed
+        return removed
+
+    def _ensure_janitor(self):
+        # Threads do not survive a fork, so start one in each process that serves requests
+        with self._lock:
+            if self.janitor_interval <= 0 or self._janitor_pid == os.getpid():
+                return
+            self._janitor_pid = os.getpid()
+        threading.Thread(target=self._janitor, name='pdf2word-workspace-janitor', daemon=True).start()
+
+    def _janitor(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.warning(f'Workspace janitor failed: {str(e)}')
+            time.sleep(self.janitor_interval)
+
+    def stats(self):
+        with self._lock:
+            info = dict(self._counters, active=len(self._active),
+                        idle=sum(len(idle) for idle in self._idle.values()))
+        info["disk"] = {"root": self.root, "usedBytes": _tree_size(self.root)}
+        info["memory"] = {"root": self.memory_root, "usedBytes": _tree_size(self.memory_root),
+                          "budgetBytes": self.memory_budget} if self.memory_root else None
+        return info
+
+class _ScratchFile:
+    # A file being written into a workspace, unbuffered so that the bytes on
+    # disk are known exactly when the filesystem fills up
+    def __init__(self, pool, workspace, name):
+        self.pool = pool
+        self.workspace = workspace
+        self.name = name
+        self.size = 0
+        self._file = open(workspace.path(name), 'wb', buffering=0)
+
+    def write(self, data):
+        if not self.pool.reserve(self.workspace, self.size + len(data)):
+            self._move_to_disk(over_budget=True)
+        view = memoryview(data)
+        while view:
+            try:
+                written = self._file.write(view)
+            except OSError as e:
+                if e.errno != errno.ENOSPC or self.workspace.backing != "memory":
+                    raise
+                self._move_to_disk()
+                continue
+            view = view[written:]
+            self.size += written
+        return len(data)
+
+    def _move_to_disk(self, over_budget=False):
+        self._file.close()
+        self.pool.move_to_disk(self.workspace, over_budget)
+        self._file = open(self.workspace.path(self.name), 'r+b', buffering=0)
+        self._file.truncate(self.size)
+        self._file.seek(self.size)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _memory_root(directory, budget):
+    # The RAM-backed root, or None when it is switched off or too small for the budget
+    if not budget or not directory:
+        return None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        stat = os.statvfs(directory)
+    except OSError as e:
+        logging.warning(f'Memory workspaces disabled: {str(e)}')
+        return None
+    if stat.f_bavail * stat.f_frsize + _tree_size(directory) < budget:
+        logging.warning(f'Memory workspaces disabled: {directory} has less than {budget} bytes')
+        return None
+    return directory
+
+def _tree_size(directory):
+    total = 0
+    for path, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(path, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def _last_modified(directory):
+    latest = 0.0
+    for path, _, files in os.walk(directory):
+        for item in [path] + [os.path.join(path, name) for name in files]:
+            try:
+                latest = max(latest, os.lstat(item).st_mtime)
+            except OSError:
+                pass
+    return latest
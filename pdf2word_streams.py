@@ -0,0 +1,175 @@
+import base64
+import json
+import re
+
+# Chunked I/O helpers for the HTTP handlers, so uploads, base64 payloads and
+# converted documents move between the socket and disk without a full copy in memory.
+
+CHUNK_SIZE = 1024 * 1024
+# Multiple of 3 so every encoded chunk is padding-free and can be concatenated
+ENCODE_CHUNK_SIZE = 3 * 256 * 1024
+
+_BASE64_WHITESPACE = b' \t\r\n'
+_STRING_STOP = re.compile(rb'["\\]')
+_MAX_CAPTURED_KEY = 256
+
+def spool_to_file(src, dest, chunk_size=CHUNK_SIZE):
+    # Copy a readable stream into an open binary file; returns the byte count
+    size = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        dest.write(chunk)
+        size += len(chunk)
+    dest.flush()
+    return size
+
+class Base64StreamDecoder:
+    def __init__(self, dest):
+        self.dest = dest
+        self.size = 0
+        self._pending = b''
+
+    def feed(self, data):
+        data = self._pending + data.translate(None, _BASE64_WHITESPACE)
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        if usable:
+            self._write(data[:usable])
+
+    def close(self):
+        if self._pending:
+            # Tolerate senders that drop the trailing padding
+            self._write(self._pending + b'=' * (-len(self._pending) % 4))
+            self._pending = b''
+        return self.size
+
+    def _write(self, data):
+        try:
+            decoded = base64.b64decode(data, validate=True)
+        except ValueError as e:
+            raise ValueError(f"Invalid base64 data: {str(e)}")
+        self.dest.write(decoded)
+        self.size += len(decoded)
+
+def _decode_key(raw):
+    try:
+        return json.loads(b'"' + raw + b'"')
+    except ValueError:
+        return None
+
+# Read a JSON object from stream, decoding the base64 string member `field` into dest.
+# Returns (data, size): data holds the other top-level members (`field` itself is present
+# with an empty value when it was found) and size is the number of decoded bytes written.
+# Only the base64 value is streamed; the rest of the document is expected to be small.
+def decode_json_base64_field(stream, field, dest, chunk_size=CHUNK_SIZE):
+    skeleton = bytearray()
+    decoder = None
+    depth = 0
+    in_string = False
+    escaped = False
+    in_target = False
+    target_escape = False
+    key_buffer = bytearray()
+    last_string = None
+    pending_key = None
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        pos = 0
+        length = len(chunk)
+        while pos < length:
+            if in_target:
+                if target_escape:
+                    # JSON allows "\/" and escaped whitespace inside the value
+                    escape = chunk[pos:pos + 1]
+                    if escape == b'/':
+                        decoder.feed(b'/')
+                    elif escape not in (b'n', b'r', b't'):
+                        raise ValueError(f"Invalid base64 data: unsupported escape \\{escape.decode('latin-1')}")
+                    target_escape = False
+                    pos += 1
+                    continue
+
+                match = _STRING_STOP.search(chunk, pos)
+                end = match.start() if match else length
+                if end > pos:
+                    decoder.feed(chunk[pos:end])
+                if not match:
+                    pos = length
+                    continue
+
+                pos = end + 1
+                if match.group() == b'\\':
+                    target_escape = True
+                else:
+                    in_target = False
+                    skeleton += b'"'
+                continue
+
+            byte = chunk[pos:pos + 1]
+            pos += 1
+
+            if in_string:
+                skeleton += byte
+                if escaped:
+                    escaped = False
+                elif byte == b'\\':
+                    escaped = True
+                elif byte == b'"':
+                    in_string = False
+                    last_string = bytes(key_buffer)
+                    continue
+                if len(key_buffer) < _MAX_CAPTURED_KEY:
+                    key_buffer += byte
+                continue
+
+            if byte == b'"':
+                if depth == 1 and pending_key == field:
+                    in_target = True
+                    decoder = Base64StreamDecoder(dest)
+                    skeleton += b'"'
+                else:
+                    in_string = True
+                    key_buffer = bytearray()
+                    skeleton += byte
+                continue
+
+            skeleton += byte
+            if byte in (b'{', b'['):
+                depth += 1
+            elif byte in (b'}', b']'):
+                depth -= 1
+            elif byte == b':' and depth == 1 and last_string is not None:
+                pending_key = _decode_key(last_string)
+            elif byte == b',':
+                pending_key = None
+
+    if in_target or in_string:
+        raise ValueError("Invalid JSON: unterminated string")
+
+    data = json.loads(bytes(skeleton)) if skeleton.strip() else None
+    if not isinstance(data, dict):
+        raise ValueError("Invalid JSON: expected an object")
+
+    size = decoder.close() if decoder else 0
+    return data, size
+
+# Yield a JSON object whose `data_field` is src base64 encoded chunk by chunk.
+# src is an open binary file and is closed once the body has been produced.
+def iter_base64_json(src, data_field, fields, chunk_size=ENCODE_CHUNK_SIZE):
+    try:
+        yield f'{{{json.dumps(data_field)}: "'.encode('utf-8')
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            yield base64.b64encode(chunk)
+        tail = json.dumps(fields)[1:] if fields else '}'
+        yield (f'"{", " if fields else ""}{tail}').encode('utf-8')
+    finally:
+        src.close()
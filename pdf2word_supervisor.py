@@ -0,0 +1,186 @@
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import signal
+import time
+
+# Per-job limits for conversions.
+#
+# A job runs in a forked child process (cheap once the stack is imported, see
+# pdf2word_warmup) while the calling thread watches it: past the wall-clock
+# deadline, over its CPU or memory cap or once the caller reports the client
+# gone, the child and any shard processes it started are killed; the child
+# leads a process group, over which CPU time and memory are measured. The
+# calling worker carries on and answers with a structured error instead of
+# being killed by gunicorn's or the platform's own timeout.
+
+# Wall-clock seconds per synchronous conversion, below gunicorn's 300 s worker
+# timeout and the 230 s the Azure front end waits for a response (0 = no deadline).
+# Asynchronous jobs (pdf2word_jobs) have their own PDF2WORD_JOB_TIMEOUT, as no
+# request is waiting on them.
+DEFAULT_DEADLINE = float(os.environ.get('PDF2WORD_CONVERT_DEADLINE', '220'))
+# CPU seconds per conversion, its shard processes included (0 = no limit)
+DEFAULT_CPU_SECONDS = float(os.environ.get('PDF2WORD_JOB_CPU_SECONDS', '0'))
+# Resident memory of the conversion and its shard processes in MB (0 = no limit)
+DEFAULT_MAX_RSS_MB = int(os.environ.get('PDF2WORD_JOB_MAX_RSS_MB', '0'))
+
+# How often the deadline, CPU time, memory and the client are checked
+POLL_INTERVAL = 0.1
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+class JobLimits:
+    def __init__(self, deadline=DEFAULT_DEADLINE, cpu_seconds=DEFAULT_CPU_SECONDS, max_rss_mb=DEFAULT_MAX_RSS_MB):
+        self.deadline = deadline
+        self.cpu_seconds = cpu_seconds
+        self.max_rss_mb = max_rss_mb
+
+    def __bool__(self):
+        return bool(self.deadline or self.cpu_seconds or self.max_rss_mb)
+
+class JobLimitExceeded(Exception):
+    # limit is "deadline", "cpu", "memory" or "cancelled"
+    def __init__(self, limit, message, maximum=None, elapsed=None, progress=None):
+        super().__init__(message)
+        self.limit = limit
+        self.maximum = maximum
+        self.elapsed = elapsed
+        self.progress = progress
+
+    def __reduce__(self):
+        return (JobLimitExceeded, (self.limit, str(self), self.maximum, self.elapsed, self.progress))
+
+class JobSupervisor:
+    # cancelled, if given, is polled while the job runs and stops it when it returns True
+    def __init__(self, limits=None, cancelled=None):
+        self.limits = JobLimits() if limits is None else limits
+        self.cancelled = cancelled
+
+    def run(self, function, *args, progress=None):
+        # Same contract as calling function(*args, progress=progress); raises
+        # JobLimitExceeded when a limit is hit or the job is cancelled
+        if not self.limits and self.cancelled is None:
+            return function(*args, progress=progress)
+        if multiprocessing.current_process().daemon:
+            # Daemonic pool processes (the --serve workers) may not have children
+            logging.warning('Job limits not applied: running in a daemonic process')
+            return function(*args, progress=progress)
+
+        context = multiprocessing.get_context('fork')
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_run_child, args=(sender, function, args, self.limits.cpu_seconds),
+                                  name='pdf2word-job')
+        started = time.monotonic()
+        process.start()
+        sender.close()
+        try:
+            # Also done in the child: whichever runs first makes it a group leader
+            os.setpgid(process.pid, process.pid)
+        except OSError:
+            pass
+        try:
+            return self._watch(process, receiver, started, progress)
+        finally:
+            if process.exitcode is None:
+                _kill(process)
+            process.join()
+            receiver.close()
+
+    def _watch(self, process, receiver, started, progress):
+        last_progress = None
+        while True:
+            if receiver.poll(POLL_INTERVAL):
+                try:
+                    kind, value = receiver.recv()
+                except EOFError:
+                    # The child is gone without a result
+                    process.join()
+                    raise self._exit_error(process, started, last_progress)
+                if kind == "error":
+                    raise value
+                if kind == "result":
+                    return value
+                last_progress = {"stage": value[0], "page": value[1], "pages": value[2]}
+                if progress:
+                    progress(*value)
+
+            elapsed = time.monotonic() - started
+            if self.limits.deadline and elapsed > self.limits.deadline:
+                raise JobLimitExceeded("deadline", f"Conversion timed out after {self.limits.deadline:g} seconds",
+                                       self.limits.deadline, round(elapsed, 3), last_progress)
+            if self.limits.max_rss_mb or self.limits.cpu_seconds:
+                rss_mb, cpu_seconds = _group_usage(process.pid)
+                if self.limits.max_rss_mb and rss_mb > self.limits.max_rss_mb:
+                    raise JobLimitExceeded("memory",
+                                           f"Conversion exceeded the {self.limits.max_rss_mb} MB memory limit",
+                                           self.limits.max_rss_mb, round(elapsed, 3), last_progress)
+                if self.limits.cpu_seconds and cpu_seconds > self.limits.cpu_seconds:
+                    raise self._cpu_error(started, last_progress)
+            if self.cancelled is not None and self.cancelled():
+                raise JobLimitExceeded("cancelled", "Conversion cancelled: the client disconnected",
+                                       None, round(elapsed, 3), last_progress)
+
+    def _exit_error(self, process, started, last_progress):
+        if process.exitcode in (-signal.SIGXCPU, -signal.SIGKILL) and self.limits.cpu_seconds:
+            return self._cpu_error(started, last_progress)
+        return Exception(f"Conversion process exited unexpectedly (exit code {process.exitcode})")
+
+    def _cpu_error(self, started, last_progress):
+        return JobLimitExceeded("cpu", f"Conversion exceeded the {self.limits.cpu_seconds:g} CPU second limit",
+                                self.limits.cpu_seconds, round(time.monotonic() - started, 3), last_progress)
+
+def _run_child(sender, function, args, cpu_seconds):
+    try:
+        os.setpgid(0, 0)
+    except OSError:
+        pass
+    if cpu_seconds:
+        # A backstop for the group total checked by _watch: the limit applies to
+        # each process, shard processes included, and each gets the whole allowance.
+        # SIGXCPU at the soft limit, SIGKILL a little later if that is ignored
+        soft = math.ceil(cpu_seconds)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 5))
+
+    def progress(stage, done, total):
+        sender.send(("progress", (stage, done, total)))
+
+    try:
+        result = ("result", function(*args, progress=progress))
+    except Exception as e:
+        result = ("error", e)
+    try:
+        sender.send(result)
+    except Exception as e:
+        # The exception could not be pickled; pass its message on
+        sender.send(("error", Exception(str(result[1]) if result[0] == "error" else str(e))))
+    sender.close()
+
+def _kill(process):
+    # The child leads its own process group, which includes its shard processes
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        process.kill()
+
+def _group_usage(pgid):
+    # (resident MB, CPU seconds) of the processes in process group pgid. CPU time
+    # includes that of exited children they have waited for, e.g. finished shards.
+    rss_pages = ticks = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                # Fields after the command name, which may hold spaces: state is
+                # the first, then ppid, pgrp, ... utime, stime, cutime, cstime, ... rss
+                fields = f.read().rsplit(')', 1)[1].split()
+            if int(fields[2]) != pgid:
+                continue
+            ticks += sum(int(value) for value in fields[11:15])
+            rss_pages += int(fields[21])
+        except (OSError, ValueError, IndexError):
+            continue
+    return rss_pages * PAGE_SIZE / (1024 * 1024), ticks / CLOCK_TICKS
@@ -0,0 +1,129 @@
+import gc
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+# Warm start for pre-forking servers.
+#
+# With gunicorn --preload (see gunicorn.conf.py) the master imports the
+# conversion stack and runs one small conversion before forking, so every
+# worker starts with the modules, lazily imported extensions (OpenCV) and
+# library caches already in memory, shared copy-on-write. Anything that must
+# not be shared - threads, process pools - is started through after_fork().
+#
+# The time each step took is kept in startup_report and shown on /health.
+
+PRELOAD = os.environ.get('PDF2WORD_PRELOAD', 'on').lower() in ('on', '1', 'true')
+
+# Heaviest first; cv2 is only imported by pdf2docx once a page has images
+STACK = ("fitz", "numpy", "cv2", "docx", "pdf2docx", "pdf2word")
+
+startup_report = None
+
+_preloading = False
+_after_fork = []
+
+def import_stack():
+    # Seconds per module; 0.0 for a module that something imported earlier
+    timings = {}
+    for name in STACK:
+        if name in sys.modules:
+            timings[name] = 0.0
+            continue
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logging.warning(f'Warm-up could not import {name}: {str(e)}')
+            continue
+        timings[name] = round(time.perf_counter() - start, 3)
+    return timings
+
+def _sample_pdf(path):
+    # One page with a heading, a paragraph, a ruled table and an image, so every
+    # pdf2docx stage (text, tables, images) runs once, and a plain text page for
+    # the native engine
+    import fitz
+
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    page.insert_text((72, 72), "Warm-up", fontsize=16, fontname='hebo')
+    page.insert_textbox(fitz.Rect(72, 90, 523, 160), "The quick brown fox jumps over the lazy dog. " * 6,
+                        fontsize=10, fontname='helv')
+    for row in range(4):
+        page.draw_line((72, 180 + row * 20), (523, 180 + row * 20), width=0.5)
+    for col in range(4):
+        x = 72 + col * 150.33
+        page.draw_line((x, 180), (x, 240), width=0.5)
+        for row in range(3):
+            page.insert_text((x + 4, 194 + row * 20), f'{row}.{col}', fontsize=9, fontname='helv')
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 48), False)
+    pix.set_rect(pix.irect, (40, 120, 200))
+    page.insert_image(fitz.Rect(72, 260, 264, 404), pixmap=pix)
+    page = doc.new_page(width=595, height=842)
+    page.insert_textbox(fitz.Rect(72, 72, 523, 160), "The quick brown fox jumps over the lazy dog. " * 6,
+                        fontsize=10, fontname='helv')
+    doc.save(path)
+    doc.close()
+
+def warm_conversion():
+    # Runs a conversion of the sample page outside any cache, workspace pool or
+    # metrics registry; returns its duration in seconds
+    from pdf2word import convert_document
+
+    with tempfile.TemporaryDirectory(prefix='pdf2word-warmup-') as directory:
+        pdf_path = os.path.join(directory, 'warmup.pdf')
+        _sample_pdf(pdf_path)
+        start = time.perf_counter()
+        convert_document(pdf_path, os.path.join(directory, 'warmup.docx'), workers=1)
+        return round(time.perf_counter() - start, 3)
+
+def warm_up():
+    # Import and exercise the conversion stack; returns the startup report.
+    # A failed warm-up conversion is logged and the server starts anyway.
+    global startup_report
+    start = time.perf_counter()
+    report = {"pid": os.getpid(), "preload": _preloading, "imports": import_stack()}
+    report["importSeconds"] = round(sum(report["imports"].values()), 3)
+    try:
+        report["warmupSeconds"] = warm_conversion()
+    except Exception as e:
+        logging.warning(f'Warm-up conversion failed: {str(e)}')
+        report["warmupSeconds"] = None
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    startup_report = report
+    logging.info(f'Startup: {json.dumps(report)}')
+    return report
+
+def begin_preload():
+    # Called by the master before it loads the app
+    global _preloading
+    _preloading = True
+    warm_up()
+
+def end_preload():
+    # Called by the master once the app is loaded, right before it forks workers:
+    # keeps the collector from touching (and so copying) everything loaded so far
+    gc.freeze()
+
+def after_fork(start):
+    # Runs start() in this process now, or in every worker after the fork when
+    # the app is being preloaded by the master
+    if _preloading:
+        _after_fork.append(start)
+    else:
+        start()
+
+def worker_started():
+    # Called in each worker right after it is forked
+    global _preloading
+    _preloading = False
+    start = time.perf_counter()
+    for hook in _after_fork:
+        hook()
+    if startup_report is not None:
+        startup_report["worker"] = {"pid": os.getpid(), "seconds": round(time.perf_counter() - start, 3)}